@@ -0,0 +1,189 @@
+"""Warbler's JSON API, version 1 (mounted at /api/v1).
+
+Compact JSON for mobile and single-page clients, instead of whole pages.
+Responses are built straight from column tuples -- no ORM objects, no
+templates -- and message lists page with the same ?before=/?after=/?limit=
+cursors as the HTML views.
+
+Endpoints use the same login session as the pages; ones that need a user
+answer 401 without one. Errors come back as {"error": ...}.
+"""
+
+from flask import Blueprint, abort, g, jsonify, request
+from werkzeug.exceptions import HTTPException
+
+from current_user import forget_current_user
+from graph import suggestions_for
+from jobs import enqueue
+from models import db, User, Message, Follows, Likes, TimelineEntry
+from pagination import paginate_messages
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+MESSAGE_COLUMNS = (Message.id, Message.text, Message.timestamp,
+                   Message.user_id, User.username, User.image_url)
+
+PROFILE_COLUMNS = (User.id, User.username, User.image_url,
+                   User.header_image_url, User.bio, User.location,
+                   User.messages_count, User.following_count,
+                   User.followers_count, User.likes_count)
+
+
+@api.errorhandler(HTTPException)
+def error_json(error):
+    return jsonify(error=error.description), error.code
+
+
+def login_required():
+    if not g.user:
+        abort(401, "Access unauthorized.")
+
+
+def message_json(row, likes):
+    return {
+        'id': row.id,
+        'text': row.text,
+        'timestamp': row.timestamp.isoformat(),
+        'user': {
+            'id': row.user_id,
+            'username': row.username,
+            'image_url': row.image_url,
+        },
+        'liked': row.id in likes,
+    }
+
+
+def messages_json(query, timestamp_col, id_col):
+    """A page of `query`'s messages, with the cursors to its neighbours."""
+
+    page = paginate_messages(
+        query.join(User, Message.user_id == User.id)
+             .with_entities(*MESSAGE_COLUMNS),
+        timestamp_col, id_col)
+
+    likes = (g.user.liked_ids_among(row.id for row in page)
+             if g.user else set())
+
+    return jsonify(messages=[message_json(row, likes) for row in page],
+                   older=page.older, newer=page.newer)
+
+
+@api.route('/timeline')
+def timeline():
+    """The logged-in user's home timeline."""
+
+    login_required()
+
+    return messages_json(g.user.timeline(),
+                         TimelineEntry.timestamp, TimelineEntry.message_id)
+
+
+@api.route('/suggestions')
+def suggestions():
+    """Who the logged-in user might follow: friends of friends."""
+
+    login_required()
+
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 50)
+    return jsonify(users=[
+        {'id': id, 'username': username, 'image_url': image_url,
+         'mutual': mutual}
+        for id, username, image_url, mutual in suggestions_for(g.user, limit)])
+
+
+@api.route('/users/<int:user_id>')
+def profile(user_id):
+    """A user's profile and counters."""
+
+    row = (db.session.query(*PROFILE_COLUMNS)
+           .filter(User.id == user_id, User.deleted_at.is_(None))
+           .first())
+    if row is None:
+        abort(404, "No such user.")
+
+    user = row._asdict()
+    user['following'] = bool(g.user) and g.user.is_following(row)
+
+    return jsonify(user=user)
+
+
+@api.route('/users/<int:user_id>/messages')
+def user_messages(user_id):
+    """A user's messages, newest first."""
+
+    if not db.session.query(User.active().filter(User.id == user_id)
+                            .exists()).scalar():
+        abort(404, "No such user.")
+
+    return messages_json(Message.query.filter(Message.user_id == user_id),
+                         Message.timestamp, Message.id)
+
+
+@api.route('/messages/<int:message_id>')
+def message(message_id):
+    """One message."""
+
+    row = (db.session.query(*MESSAGE_COLUMNS)
+           .join(User, Message.user_id == User.id)
+           .filter(Message.id == message_id, User.deleted_at.is_(None))
+           .first())
+    if row is None:
+        abort(404, "No such message.")
+
+    likes = g.user.liked_ids_among([row.id]) if g.user else set()
+
+    return jsonify(message=message_json(row, likes))
+
+
+@api.route('/users/<int:user_id>/follow', methods=['POST', 'DELETE'])
+def follow(user_id):
+    """Follow (POST) or stop following (DELETE) a user; safe to retry."""
+
+    login_required()
+
+    if not db.session.query(User.active().filter(User.id == user_id)
+                            .exists()).scalar():
+        abort(404, "No such user.")
+
+    if user_id == g.user.id:
+        abort(400, "You can't follow yourself.")
+
+    if request.method == 'POST':
+        if Follows.follow(g.user.id, user_id):
+            enqueue('backfill_timeline', user_id=g.user.id,
+                    followed_id=user_id)
+    elif Follows.unfollow(g.user.id, user_id):
+        enqueue('prune_timeline', user_id=g.user.id, followed_id=user_id)
+    db.session.commit()
+
+    forget_current_user(g.user.id)
+    forget_current_user(user_id)
+
+    return jsonify(user_id=user_id, following=request.method == 'POST')
+
+
+@api.route('/messages/<int:message_id>/like', methods=['POST', 'DELETE'])
+def like(message_id):
+    """Like (POST) or unlike (DELETE) a message; safe to retry."""
+
+    login_required()
+
+    author_id = (db.session.query(Message.user_id)
+                 .join(User, Message.user_id == User.id)
+                 .filter(Message.id == message_id, User.deleted_at.is_(None))
+                 .scalar())
+    if author_id is None:
+        abort(404, "No such message.")
+
+    if author_id == g.user.id:
+        abort(403, "You can't like your own message.")
+
+    if request.method == 'POST':
+        Likes.like(g.user.id, message_id)
+    else:
+        Likes.unlike(g.user.id, message_id)
+    db.session.commit()
+
+    forget_current_user(g.user.id)
+
+    return jsonify(message_id=message_id, liked=request.method == 'POST')
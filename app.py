@@ -1,11 +1,27 @@
 import os
+from datetime import datetime
 
-from flask import Flask, render_template, request, flash, redirect, session, g, abort
+import click
+from flask import Flask, render_template, request, flash, redirect, session, g, abort, jsonify
+from flask import Response, stream_with_context
 from flask_debugtoolbar import DebugToolbarExtension
 from sqlalchemy.exc import IntegrityError, InvalidRequestError, SQLAlchemyError
+from sqlalchemy.orm import joinedload
 
+from api import api
+from caching import NO_STORE, REVALIDATE, cache_control, render_conditional
+from current_user import configure_current_users, forget_current_user, load_current_user
 from forms import UserAddForm, LoginForm, MessageForm, EditProfileForm
-from models import db, connect_db, User, Message
+from fragments import forget_message_card, init_fragments
+from graph import init_follow_graph, suggestions_for
+from jobs import enqueue, init_jobs
+from metrics import init_metrics
+from migrate import migrate_cli
+from mutual import followers_you_know, init_mutual
+from models import db, connect_db, User, Message, Follows, Likes, TimelineEntry, AccountPurge
+from pagination import IdPage, paginate_messages
+from search import search_users, usernames
+from trending import init_trending, trending_messages
 
 CURR_USER_KEY = "curr_user"
 
@@ -20,9 +36,34 @@ app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SQLALCHEMY_ECHO'] = False
 app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
-toolbar = DebugToolbarExtension(app)
+
+# The debug toolbar is a development tool; keep it out of production.
+if app.config['ENV'] == 'development':
+    toolbar = DebugToolbarExtension(app)
+
+# Timelines are paged with ?before=/?after= cursors; ?limit= can ask for a
+# different page size, up to MAX_MESSAGES_PER_PAGE.
+app.config['MESSAGES_PER_PAGE'] = int(os.environ.get('MESSAGES_PER_PAGE', 20))
+app.config['MAX_MESSAGES_PER_PAGE'] = 100
+
+app.config['USERS_PER_PAGE'] = int(os.environ.get('USERS_PER_PAGE', 30))
+
+# Stream user listings, so the top of the page is sent before the list has
+# been fetched.
+app.config['STREAM_LISTINGS'] = os.environ.get('STREAM_LISTINGS') == '1'
 
 connect_db(app)
+init_metrics(app)
+configure_current_users(app)
+init_fragments(app)
+init_jobs(app)
+init_follow_graph(app)
+init_mutual(app)
+init_trending(app)
+app.register_blueprint(api)
+
+# Endpoints that never look at g.user, so needn't load it
+ANONYMOUS_ENDPOINTS = {'static', 'metrics'}
 
 
 ##############################################################################
@@ -31,10 +72,14 @@ connect_db(app)
 
 @app.before_request
 def add_user_to_g():
-    """If we're logged in, add curr user to Flask global."""
+    """If we're logged in, add curr user to Flask global.
 
-    if CURR_USER_KEY in session:
-        g.user = User.query.get(session[CURR_USER_KEY])
+    g.user is a cached, read-only snapshot of the user (see
+    current_user.py); load the User itself to make changes.
+    """
+
+    if CURR_USER_KEY in session and request.endpoint not in ANONYMOUS_ENDPOINTS:
+        g.user = load_current_user(session[CURR_USER_KEY])
 
     else:
         g.user = None
@@ -81,6 +126,7 @@ def signup():
             flash("Username already taken", 'danger')
             return render_template('users/signup.html', form=form)
 
+        usernames.add(user.id, user.username)
         do_login(user)
 
         return redirect("/")
@@ -99,6 +145,8 @@ def login():
                                  form.password.data)
 
         if user:
+            # keeps a rehashed password, if authenticate made one
+            db.session.commit()
             do_login(user)
             flash(f"Hello, {user.username}!", "success")
             return redirect("/")
@@ -125,39 +173,124 @@ def logout():
 ##############################################################################
 # General user routes:
 
+
+# Just what a user card shows
+USER_CARD_COLUMNS = (User.id, User.username, User.image_url,
+                     User.header_image_url, User.bio)
+
+
+class FollowedByViewer:
+    """Which of `users` the logged-in user follows.
+
+    Looked up in one query the first time it's asked, so it can be handed
+    to a (streamed) template before `users` has been fetched.
+    """
+
+    def __init__(self, users):
+        self.users = users
+        self.ids = None
+
+    def __contains__(self, user_id):
+        if self.ids is None:
+            self.ids = (g.user.following_ids_among(u.id for u in self.users)
+                        if g.user else set())
+        return user_id in self.ids
+
+
+def liked_by_viewer(messages):
+    """Ids of the `messages` that the logged-in user likes (one query)."""
+
+    if not g.user:
+        return set()
+
+    return g.user.liked_ids_among(msg.id for msg in messages)
+
+
+def viewer_version():
+    """What the logged-in user sees of themselves on a page, for ETags."""
+
+    return g.user.version() if g.user else None
+
+
+def user_page(query):
+    """A page of user cards from `query`, using the request's ?after=."""
+
+    return IdPage(query.filter(User.deleted_at.is_(None)), User.id,
+                  app.config['USERS_PER_PAGE'],
+                  after=request.args.get('after', type=int))
+
+
+def render_listing(template, **context):
+    """Render a listing page, streaming it if STREAM_LISTINGS is on."""
+
+    if not app.config['STREAM_LISTINGS']:
+        return render_template(template, **context)
+
+    app.update_template_context(context)
+    stream = app.jinja_env.get_template(template).stream(context)
+    return Response(stream_with_context(stream))
+
+
 @app.route('/users')
 def list_users():
     """Page with listing of users.
 
-    Can take a 'q' param in querystring to search by that username.
+    Can take a 'q' param in querystring to search usernames and bios;
+    results are ranked and paged with a 'page' param.
     """
 
     search = request.args.get('q')
+    page = max(1, request.args.get('page', 1, type=int))
+    has_more = False
 
     if not search:
-        users = User.query.all()
+        users = user_page(db.session.query(*USER_CARD_COLUMNS))
     else:
-        users = User.query.filter(User.username.like(f"%{search}%")).all()
+        users, has_more = search_users(search, page=page,
+                                       per_page=app.config['USERS_PER_PAGE'])
 
-    return render_template('users/index.html', users=users)
+    return render_listing('users/index.html', users=users,
+                          following_ids=FollowedByViewer(users),
+                          search=search, page=page, has_more=has_more)
+
+
+@app.route('/api/users/autocomplete')
+def autocomplete_users():
+    """JSON list of users whose username starts with ?prefix=."""
+
+    prefix = request.args.get('prefix', '')
+    matches = usernames.complete(prefix)
+
+    return jsonify(users=[{'id': id, 'username': username}
+                          for id, username in matches])
 
 
 @app.route('/users/<int:user_id>')
+@cache_control(REVALIDATE)
 def users_show(user_id):
     """Show user profile."""
 
-    user = User.query.get_or_404(user_id)
+    user = User.active().filter(User.id == user_id).first_or_404()
 
     # snagging messages in order from the database;
     # user.messages won't be in order by default
-    messages = (Message
-                .query
-                .filter(Message.user_id == user_id)
-                .order_by(Message.timestamp.desc())
-                .limit(100)
-                .all())
-                
-    return render_template('users/show.html', user=user, messages=messages)
+    messages = paginate_messages(
+        Message.query.filter(Message.user_id == user_id),
+        Message.timestamp, Message.id)
+    likes = liked_by_viewer(messages)
+    following = bool(g.user) and g.user.is_following(user)
+    mutual = followers_you_know(g.user, user)
+
+    validators = (
+        user.id, user.profile_updated_at, user.messages_count,
+        user.following_count, user.followers_count, user.likes_count,
+        [msg.id for msg in messages], messages.older, messages.newer,
+        viewer_version(), sorted(likes), following, mutual,
+    )
+
+    return render_conditional('users/show.html', validators, user=user,
+                              messages=messages, likes=likes,
+                              following=following, mutual=mutual)
 
 
 @app.route('/users/<int:user_id>/following')
@@ -168,8 +301,16 @@ def show_following(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
-    return render_template('users/following.html', user=user)
+    user = User.active().filter(User.id == user_id).first_or_404()
+    following = user_page(
+        db.session
+        .query(*USER_CARD_COLUMNS)
+        .join(Follows, Follows.user_being_followed_id == User.id)
+        .filter(Follows.user_following_id == user_id))
+
+    return render_listing('users/following.html', user=user,
+                          following=following,
+                          following_ids=FollowedByViewer(following))
 
 
 @app.route('/users/<int:user_id>/followers')
@@ -180,8 +321,16 @@ def users_followers(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
-    return render_template('users/followers.html', user=user)
+    user = User.active().filter(User.id == user_id).first_or_404()
+    followers = user_page(
+        db.session
+        .query(*USER_CARD_COLUMNS)
+        .join(Follows, Follows.user_following_id == User.id)
+        .filter(Follows.user_being_followed_id == user_id))
+
+    return render_listing('users/followers.html', user=user,
+                          followers=followers,
+                          following_ids=FollowedByViewer(followers))
 
 
 @app.route('/users/follow/<int:follow_id>', methods=['POST'])
@@ -194,12 +343,18 @@ def add_follow(follow_id):
         return redirect("/")          
     
     try: 
-        followed_user = User.query.get_or_404(follow_id)    
-        g.user.following.append(followed_user)
+        followed_user = (User.active().filter(User.id == follow_id)
+                         .first_or_404())
+        if Follows.follow(g.user.id, followed_user.id):
+            enqueue('backfill_timeline', user_id=g.user.id,
+                    followed_id=followed_user.id)
         db.session.commit()
     except SQLAlchemyError as e:
         raise e
 
+    forget_current_user(g.user.id)
+    forget_current_user(follow_id)
+
     return redirect(f"/users/{g.user.id}/following")
 
 
@@ -212,12 +367,16 @@ def stop_following(follow_id):
         return redirect("/")
 
     try: 
-        followed_user = User.query.get(follow_id)
-        g.user.following.remove(followed_user)
+        if not Follows.unfollow(g.user.id, follow_id):
+            abort(404)
+        enqueue('prune_timeline', user_id=g.user.id, followed_id=follow_id)
         db.session.commit()
     except SQLAlchemyError as e:
         raise e
 
+    forget_current_user(g.user.id)
+    forget_current_user(follow_id)
+
     return redirect(f"/users/{g.user.id}/following")
 
 
@@ -230,36 +389,70 @@ def show_likes(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
-    return render_template('users/likes.html', user=user, likes=user.likes)   
+    user = User.active().filter(User.id == user_id).first_or_404()
+    messages = (Message
+                .query
+                .join(Likes, Likes.message_id == Message.id)
+                .filter(Likes.user_id == user_id)
+                .filter(Message.user_id.notin_(User.deleted_ids()))
+                .options(joinedload(Message.user))
+                .all())
+
+    return render_template('users/likes.html', user=user, messages=messages,
+                           likes=liked_by_viewer(messages))
 
 # Todo: PART 2 ADD LIKE
 @app.route('/messages/<int:message_id>/like', methods=['POST'])
 def add_like(message_id):
-    """ Toggle a liked message for the currently-logged-in user """
+    """ Toggle a liked message for the currently-logged-in user
+
+    Pass liked=1 or liked=0 to set the like rather than flip it, which is
+    safe to retry. Clients that accept JSON (see `wants_json`) get the new
+    state back instead of a redirect.
+    """
 
     # todo: to check user logged in or not
     if not g.user:
+        if wants_json():
+            return jsonify(error="Access unauthorized."), 401
         flash("Access unauthorized.", "danger")
         return redirect("/")    
 
     liked_message = Message.query.get_or_404(message_id)
+    if liked_message.user.deleted_at:
+        abort(404)
 
     if liked_message.user_id == g.user.id:
         return abort(403)
-    
-    user_likes = g.user.likes
 
-    if liked_message in user_likes:
-        g.user.likes = [like for like in user_likes if like != liked_message]
+    liked = request.values.get('liked')
+
+    if liked is None:
+        now_liked = Likes.toggle(g.user.id, message_id)
+    elif liked == '1':
+        Likes.like(g.user.id, message_id)
+        now_liked = True
     else:
-        g.user.likes.append(liked_message)
-    
+        Likes.unlike(g.user.id, message_id)
+        now_liked = False
+
     db.session.commit()
+    forget_current_user(g.user.id)
+
+    if wants_json():
+        return jsonify(message_id=message_id, liked=now_liked)
 
     return redirect('/')
 
 
+def wants_json():
+    """Does the client prefer a JSON response to an HTML one?"""
+
+    best = request.accept_mimetypes.best_match(['text/html', 'application/json'])
+    return best == 'application/json' and (
+        request.accept_mimetypes[best] > request.accept_mimetypes['text/html'])
+
+
 @app.route('/users/profile', methods=["GET", "POST"])
 def profile():
     """Update profile for current user."""
@@ -270,26 +463,37 @@ def profile():
         return redirect("/")
 
     
-    form = EditProfileForm(obj=g.user)
+    user = User.query.get_or_404(g.user.id)
+    form = EditProfileForm(obj=user)
 
     if form.validate_on_submit():
-        #TODO: ADD TRY/EXCEPT HERE
+        # the password field confirms the edit; it doesn't change the password
+        if not User.authenticate(user.username, form.password.data):
+            flash("Incorrect password.", 'danger')
+            return redirect('/users/profile')
+
+        old_username = user.username
         try:
-            g.user.username = form.username.data
-            g.user.email = form.email.data
-            g.user.image_url = form.image_url.data
-            g.user.header_image_url = form.header_image_url.data
-            g.user.bio = form.bio.data
-            g.user.password = form.password.data      
+            user.username = form.username.data
+            user.email = form.email.data
+            user.image_url = form.image_url.data
+            user.header_image_url = form.header_image_url.data
+            user.bio = form.bio.data
+            # also retires the cached cards of the user's messages
+            user.profile_updated_at = datetime.utcnow()
             db.session.commit()
 
         except (IntegrityError, InvalidRequestError):
             flash("Username already taken", 'danger')
             return redirect('/users/profile')
 
-        return redirect(f"/users/{g.user.id}")
+        forget_current_user(user.id)
+        usernames.remove(user.id, old_username)
+        usernames.add(user.id, user.username)
+
+        return redirect(f"/users/{user.id}")
     
-    return render_template("users/edit.html", form=form, user=g.user, user_id = g.user.id) 
+    return render_template("users/edit.html", form=form, user=user, user_id = user.id) 
 
 
 @app.route('/users/delete', methods=["POST"])
@@ -301,13 +505,19 @@ def delete_user():
         return redirect("/")
 
     do_logout()
+    user_id, username = g.user.id, g.user.username
     
+    # they're hidden at once; removing their rows is left to a job
     try:
-        db.session.delete(g.user)
+        AccountPurge.start(User.query.get(user_id))
+        enqueue('purge_user', user_id=user_id)
         db.session.commit()
     except SQLAlchemyError as e:
         raise e
 
+    forget_current_user(user_id)
+    usernames.remove(user_id, username)
+
     return redirect("/signup")
 
 
@@ -327,9 +537,14 @@ def messages_add():
     form = MessageForm()
 
     if form.validate_on_submit():
-        msg = Message(text=form.text.data)
-        g.user.messages.append(msg)
+        msg = Message(text=form.text.data, user_id=g.user.id)
+        db.session.add(msg)
+        db.session.flush()
+        # the author sees it at once; followers once the job has run
+        TimelineEntry.push(g.user.id, msg)
+        enqueue('fan_out', message_id=msg.id)
         db.session.commit()
+        forget_current_user(g.user.id)
 
         return redirect(f"/users/{g.user.id}")
 
@@ -337,11 +552,45 @@ def messages_add():
 
 
 @app.route('/messages/<int:message_id>', methods=["GET"])
+@cache_control(REVALIDATE)
 def messages_show(message_id):
     """Show a message."""
 
-    msg = Message.query.get(message_id)
-    return render_template('messages/show.html', message=msg)
+    msg = Message.query.get_or_404(message_id)
+    author = msg.user
+    if author.deleted_at:
+        abort(404)
+    likes = liked_by_viewer([msg])
+    following = bool(g.user) and g.user.is_following(author)
+
+    validators = (msg.id, author.profile_updated_at,
+                  viewer_version(), bool(likes), following)
+
+    # a message never changes, so for anonymous visitors (who see nothing
+    # else) the page is only as new as the message and its author's profile
+    last_modified = (None if g.user
+                     else max(msg.timestamp, author.profile_updated_at))
+
+    return render_conditional('messages/show.html', validators,
+                              last_modified=last_modified, message=msg,
+                              likes=likes, following=following)
+
+
+@app.route('/trending')
+@cache_control(REVALIDATE)
+def trending():
+    """Show the messages most liked lately (see trending.py)."""
+
+    messages = trending_messages()
+    likes = liked_by_viewer(messages)
+
+    validators = (
+        [(msg.id, msg.user.profile_updated_at) for msg in messages],
+        viewer_version(), sorted(likes),
+    )
+
+    return render_conditional('messages/trending.html', validators,
+                              messages=messages, likes=likes)
 
 
 @app.route('/messages/<int:message_id>/delete', methods=["POST"])
@@ -358,11 +607,15 @@ def messages_destroy(message_id):
         return redirect("/")
 
     try:    
+        TimelineEntry.retract(msg.id)
         db.session.delete(msg)
         db.session.commit()
     except SQLAlchemyError as e:
         raise e
 
+    forget_current_user(g.user.id)
+    forget_message_card(message_id)
+
     return redirect(f"/users/{g.user.id}")
 
 ##############################################################################
@@ -370,43 +623,80 @@ def messages_destroy(message_id):
 
 
 @app.route('/')
+@cache_control(REVALIDATE)
 def homepage():
     """Show homepage:
 
     - anon users: no messages
-    - logged in: 100 most recent messages of followed_users
+    - logged in: most recent messages of followed_users, a page at a time,
+      read from the user's materialized timeline (see TimelineEntry)
     """
 
     if g.user:
-        following_ids = [f.id for f in g.user.following] + [g.user.id]
-        messages = (Message
-                    .query
-                    .filter(Message.user_id.in_(following_ids))
-                    .order_by(Message.timestamp.desc())
-                    .limit(100)
-                    .all())
-                
-        liked_msg_ids = [msg.id for msg in g.user.likes]
-        
-        return render_template('home.html', messages=messages, likes=liked_msg_ids)
+        messages = paginate_messages(g.user.timeline()
+                                     .options(joinedload(Message.user)),
+                                     TimelineEntry.timestamp,
+                                     TimelineEntry.message_id)
+        likes = liked_by_viewer(messages)
+        suggestions = suggestions_for(g.user)
+
+        # the newest entry alone can't tell us about retracted messages or
+        # authors' profile edits, so the whole page's ids and authors count
+        validators = (
+            [(msg.id, msg.user.profile_updated_at) for msg in messages],
+            messages.older, messages.newer, viewer_version(), sorted(likes),
+            suggestions,
+        )
+
+        return render_conditional('home.html', validators,
+                                  messages=messages, likes=likes,
+                                  suggestions=suggestions)
 
     else:
-        return render_template('home-anon.html')
+        return render_conditional('home-anon.html', 'anonymous')
+
+
+##############################################################################
+# Maintenance commands
+
+
+@app.cli.command('reconcile-counters')
+def reconcile_counters():
+    """Rebuild every user's message/follow/like counters from scratch."""
+
+    User.reconcile_counters()
+    db.session.commit()
+    click.echo("Counters reconciled.")
+
+
+app.cli.add_command(migrate_cli)
 
 
 ##############################################################################
-# Turn off all caching in Flask
-#   (useful for dev; in production, this kind of stuff is typically
-#   handled elsewhere)
+# Cache policy
 #
-# https://stackoverflow.com/questions/34066804/disabling-caching-in-flask
+# Pages marked with @cache_control may be kept, but are revalidated with
+# their ETag on every use (see caching.py); everything else is never stored.
+# Static files keep Flask's own caching headers.
 
 @app.after_request
 def add_header(req):
-    """Add non-caching headers on every request."""
+    """Set each response's Cache-Control from its view's policy."""
+
+    if request.endpoint == 'static':
+        return req
+
+    view = app.view_functions.get(request.endpoint)
+    policy = getattr(view, 'cache_control', NO_STORE)
+
+    if policy == NO_STORE:
+        req.headers["Cache-Control"] = policy
+        req.headers["Pragma"] = "no-cache"
+        req.headers["Expires"] = "0"
+    else:
+        # pages differ per viewer; only anonymous ones may be shared
+        scope = 'private' if g.get('user') else 'public'
+        req.headers["Cache-Control"] = f"{scope}, {policy}"
+        req.vary.add('Cookie')
 
-    req.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-    req.headers["Pragma"] = "no-cache"
-    req.headers["Expires"] = "0"
-    req.headers['Cache-Control'] = 'public, max-age=0'
     return req
@@ -0,0 +1,330 @@
+"""End-to-end benchmarks for Warbler's busiest routes.
+
+Generates and seeds a dataset (generator/create_csvs.py, seed.py) into a
+scratch database, then drives the app through Flask's test client and
+reports, per route: p50/p95/p99 latency, SQL statements per request and
+the process's peak RSS. Results are compared against the stored baselines
+for the tier, and the run fails if a route got slower, chattier or bigger
+than its baseline allows.
+
+The scratch database is dropped and recreated by seed.py, so never point
+--database-url at one you care about.
+
+    createdb warbler-bench
+    python benchmark.py --tier small                    # seed, run, compare
+    python benchmark.py --tier small --skip-seed        # reuse the last seed
+    python benchmark.py --tier small --update-baseline  # record new baselines
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from random import Random
+
+from sqlalchemy import event
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+BASELINES = os.path.join(HERE, 'benchmark_baselines.json')
+
+# How far over its baseline a route may go before the run fails
+LATENCY_TOLERANCE = 0.25
+RSS_TOLERANCE = 0.25
+
+# Requests per route, and the share of them discarded as warm-up
+REQUESTS = 200
+WARMUP = 0.1
+
+# logins run bcrypt at full cost, so fewer of them
+LOGIN_REQUESTS = 40
+
+
+##############################################################################
+# Seeding
+
+def seed(tier, database_url, seed, workers):
+    """Generate a `tier` dataset and load it into `database_url`."""
+
+    env = dict(os.environ, DATABASE_URL=database_url, FLASK_ENV='production')
+
+    with tempfile.TemporaryDirectory() as out:
+        subprocess.run([sys.executable, os.path.join(HERE, 'generator', 'create_csvs.py'),
+                        '--tier', tier, '--seed', str(seed),
+                        '--workers', str(workers), '--out', out],
+                       check=True)
+        subprocess.run([sys.executable, os.path.join(HERE, 'seed.py'),
+                        '--dir', out, '--workers', str(workers)],
+                       check=True, env=env, cwd=HERE,
+                       stdout=subprocess.DEVNULL)
+
+
+##############################################################################
+# Scenarios
+#
+# Each takes the Bench and returns the arguments for one client call,
+# logging in first where the route needs a user. Any setup queries run
+# before the timed request and aren't counted.
+
+def homepage(bench):
+    bench.login(bench.random_user())
+    return 'get', '/', {}
+
+
+def users_show(bench):
+    return 'get', f'/users/{bench.random_user()}', {}
+
+
+def list_users(bench):
+    bench.login(bench.random_user())
+    if bench.rng.random() < 0.5:
+        return 'get', '/users', {}
+
+    prefix = bench.rng.choice(bench.usernames)[:3]
+    return 'get', f'/users?q={prefix}', {}
+
+
+def add_like(bench):
+    from models import Message
+
+    # users can't like their own messages
+    while True:
+        user_id = bench.random_user()
+        message_id = bench.rng.randint(1, bench.max_message_id)
+        message = Message.query.get(message_id)
+        if message and message.user_id != user_id:
+            break
+
+    bench.login(user_id)
+    return 'post', f'/messages/{message_id}/like', {
+        'headers': {'Accept': 'application/json'}}
+
+
+def add_follow(bench):
+    from models import Follows
+
+    while True:
+        follower, followed = bench.random_user(), bench.random_user()
+        if follower != followed and not Follows.exists(follower, followed):
+            break
+
+    bench.login(follower)
+    return 'post', f'/users/follow/{followed}', {}
+
+
+def messages_add(bench):
+    bench.login(bench.random_user())
+    return 'post', '/messages/new', {
+        'data': {'text': f"Benchmark message {bench.rng.random()}"}}
+
+
+def login(bench):
+    bench.logout()
+    username = bench.rng.choice(bench.usernames)
+    return 'post', '/login', {
+        'data': {'username': username, 'password': 'password'}}
+
+
+SCENARIOS = [homepage, users_show, list_users, add_like, add_follow,
+             messages_add, login]
+
+
+##############################################################################
+# Running
+
+class Bench:
+    """Drives the app for one run and collects measurements."""
+
+    def __init__(self, app, db, rng):
+        from app import CURR_USER_KEY
+        from graph import follow_graph
+        from models import Message, User
+
+        self.app = app
+        self.db = db
+        self.rng = rng
+        self.client = app.test_client()
+        self.session_key = CURR_USER_KEY
+        self.statements = 0
+
+        self.user_ids = [id for id, in db.session.query(User.id)]
+        self.usernames = [name for name, in db.session.query(User.username)]
+        self.max_message_id = db.session.query(
+            db.func.max(Message.id)).scalar() or 1
+        db.session.remove()
+
+        # a running process builds this in the background soon after it
+        # starts; build it first, so those queries aren't put on a request
+        with app.app_context():
+            follow_graph.refresh()
+
+        event.listen(db.engine, 'before_cursor_execute', self._count)
+
+    def _count(self, *args):
+        self.statements += 1
+
+    def random_user(self):
+        return self.rng.choice(self.user_ids)
+
+    def login(self, user_id):
+        with self.client.session_transaction() as sess:
+            sess[self.session_key] = user_id
+
+    def logout(self):
+        with self.client.session_transaction() as sess:
+            sess.pop(self.session_key, None)
+
+    def run(self, scenario, requests):
+        """Time `requests` calls of `scenario`; returns its stats."""
+
+        warmup = int(requests * WARMUP)
+        latencies, statements, errors = [], [], 0
+
+        for n in range(requests + warmup):
+            method, url, kwargs = scenario(self)
+            self.db.session.remove()
+
+            self.statements = 0
+            started = time.perf_counter()
+            resp = getattr(self.client, method)(url, **kwargs)
+            elapsed = time.perf_counter() - started
+
+            if resp.status_code >= 400:
+                errors += 1
+            if n >= warmup:
+                latencies.append(elapsed * 1000)
+                statements.append(self.statements)
+
+        latencies.sort()
+        return {
+            'p50_ms': round(percentile(latencies, 50), 2),
+            'p95_ms': round(percentile(latencies, 95), 2),
+            'p99_ms': round(percentile(latencies, 99), 2),
+            'sql_per_request': round(sum(statements) / len(statements), 2),
+            'sql_max': max(statements),
+            'peak_rss_mb': round(peak_rss_mb(), 1),
+            'errors': errors,
+        }
+
+
+def percentile(ordered, pct):
+    """The `pct`th percentile of an already sorted list (nearest rank)."""
+
+    index = max(0, min(len(ordered) - 1,
+                       round(pct / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+
+
+def regressions(results, baseline):
+    """Describe each way `results` is worse than `baseline`."""
+
+    found = []
+    for route, stats in results.items():
+        base = baseline.get(route)
+        if base is None:
+            continue
+
+        # p99 is reported but not gated: over a few hundred requests it's
+        # one or two samples, and too noisy to fail a build on
+        for key in ('p50_ms', 'p95_ms'):
+            if stats[key] > base[key] * (1 + LATENCY_TOLERANCE):
+                found.append(f"{route}: {key} {stats[key]} > baseline {base[key]}")
+        if stats['sql_max'] > base['sql_max']:
+            found.append(f"{route}: sql_max {stats['sql_max']} > baseline {base['sql_max']}")
+        if stats['peak_rss_mb'] > base['peak_rss_mb'] * (1 + RSS_TOLERANCE):
+            found.append(f"{route}: peak_rss_mb {stats['peak_rss_mb']} "
+                         f"> baseline {base['peak_rss_mb']}")
+        if stats['errors']:
+            found.append(f"{route}: {stats['errors']} error responses")
+
+    return found
+
+
+def report(results):
+    columns = ['p50_ms', 'p95_ms', 'p99_ms', 'sql_per_request', 'sql_max',
+               'peak_rss_mb', 'errors']
+    print(f"{'route':<14}" + ''.join(f"{name:>16}" for name in columns))
+    for route, stats in results.items():
+        print(f"{route:<14}" + ''.join(f"{stats[name]:>16}" for name in columns))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--tier', default='small',
+                        choices=['sample', 'small', 'medium', 'large'],
+                        help="dataset size, as for the generator (default: small)")
+    parser.add_argument('--database-url', default=os.environ.get(
+        'BENCHMARK_DATABASE_URL', 'postgresql:///warbler-bench'),
+                        help="scratch database (default: $BENCHMARK_DATABASE_URL "
+                             "or postgresql:///warbler-bench)")
+    parser.add_argument('--requests', type=int, default=REQUESTS,
+                        help=f"timed requests per route (default: {REQUESTS})")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--skip-seed', action='store_true',
+                        help="reuse the dataset already in the database")
+    parser.add_argument('--routes', nargs='+',
+                        choices=[scenario.__name__ for scenario in SCENARIOS],
+                        help="only benchmark these routes")
+    parser.add_argument('--update-baseline', action='store_true',
+                        help="store this run as the tier's baseline")
+    args = parser.parse_args()
+
+    if not args.skip_seed:
+        print(f"Seeding a {args.tier} dataset...")
+        seed(args.tier, args.database_url, args.seed, args.workers)
+
+    # like the tests: configure the database before importing the app
+    os.environ['DATABASE_URL'] = args.database_url
+    from app import app
+    from models import db
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    app.config['STREAM_LISTINGS'] = False
+
+    bench = Bench(app, db, Random(args.seed))
+    results = {}
+    for scenario in SCENARIOS:
+        if args.routes and scenario.__name__ not in args.routes:
+            continue
+        requests = LOGIN_REQUESTS if scenario is login else args.requests
+        results[scenario.__name__] = bench.run(scenario, min(requests, args.requests))
+
+    report(results)
+
+    baselines = {}
+    if os.path.exists(BASELINES):
+        with open(BASELINES) as f:
+            baselines = json.load(f)
+
+    if args.update_baseline:
+        baselines.setdefault(args.tier, {}).update(results)
+        with open(BASELINES, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"Baseline for {args.tier} updated.")
+        return 0
+
+    if args.tier not in baselines:
+        print(f"No baseline for {args.tier}; run with --update-baseline to record one.")
+        return 0
+
+    found = regressions(results, baselines[args.tier])
+    for problem in found:
+        print(f"REGRESSION {problem}")
+
+    return 1 if found else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
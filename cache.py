@@ -0,0 +1,139 @@
+"""Small in-process caches for Warbler."""
+
+from collections import OrderedDict
+from threading import Lock, Thread
+from time import monotonic
+
+from flask import current_app
+
+_MISSING = object()
+
+
+class LRUCache:
+    """A thread-safe, least-recently-used cache.
+
+    Holds at most `maxsize` entries; with a `ttl` (seconds), entries also
+    expire that long after being set. With a `maxweight`, the total of
+    `weigh(value)` over all entries is kept under it too (e.g. `len` of
+    cached strings, to bound memory rather than count).
+    """
+
+    def __init__(self, maxsize=1024, ttl=None, maxweight=None, weigh=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.maxweight = maxweight
+        self.weigh = weigh
+        self.weight = 0
+        self.entries = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, key, default=None):
+        """The value cached for `key`, or `default`."""
+
+        with self.lock:
+            entry = self.entries.get(key, _MISSING)
+            if entry is _MISSING:
+                return default
+
+            value, expires, weight = entry
+            if expires is not None and expires < monotonic():
+                self._pop(key)
+                return default
+
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        """Cache `value` under `key`, evicting the oldest entries if full."""
+
+        expires = monotonic() + self.ttl if self.ttl is not None else None
+        weight = self.weigh(value) if self.weigh is not None else 0
+
+        with self.lock:
+            self._pop(key)
+            self.entries[key] = (value, expires, weight)
+            self.weight += weight
+
+            while len(self.entries) > self.maxsize or (
+                    self.maxweight is not None
+                    and self.weight > self.maxweight):
+                self._pop(next(iter(self.entries)))
+
+    def delete(self, key):
+        """Drop `key` from the cache, if it's there."""
+
+        with self.lock:
+            self._pop(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.weight = 0
+
+    def _pop(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.weight -= entry[2]
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class Snapshot:
+    """A value that's expensive to build, rebuilt when it gets old.
+
+    Values are built (with `build()`, in an app context) in a background
+    thread: the first `get` starts one and returns `empty` until it's done,
+    and once the value is `reload_after` seconds old, `get` starts a
+    rebuild and keeps returning the old value until that finishes. So no
+    request waits for a build; `refresh` builds one on the calling thread.
+    """
+
+    def __init__(self, build, reload_after=600, empty=None):
+        self.build = build
+        self.reload_after = reload_after
+        self.empty = empty
+        self.value = None
+        self.built_at = None
+        self.lock = Lock()
+        self.rebuilding = False
+
+    def clear(self):
+        self.value = None
+
+    def get(self):
+        """The current value, or `empty` if the first isn't built yet."""
+
+        value = self.value
+        if value is None:
+            self._rebuild_in_background()
+            return self.empty
+
+        if monotonic() - self.built_at > self.reload_after:
+            self._rebuild_in_background()
+        return value
+
+    def refresh(self):
+        """Build a new value now, and return it."""
+
+        value = self.build()
+        self.value, self.built_at = value, monotonic()
+        return value
+
+    def _rebuild_in_background(self):
+        with self.lock:
+            if self.rebuilding:
+                return
+            self.rebuilding = True
+
+        app = current_app._get_current_object()
+        Thread(target=self._rebuild, args=(app,), daemon=True).start()
+
+    def _rebuild(self, app):
+        try:
+            with app.app_context():
+                self.refresh()
+        except Exception:
+            app.logger.exception("Building %r failed", self.build)
+        finally:
+            self.rebuilding = False
@@ -0,0 +1,75 @@
+"""HTTP caching for Warbler pages.
+
+Pages that are cheap to validate but expensive to render are served with
+an ETag (and, where a timestamp fully describes the page, Last-Modified),
+so a client or proxy holding a current copy gets a 304 instead of the
+full HTML. Each view picks its Cache-Control policy with `cache_control`;
+views that don't keep the no-store default set in app.py.
+"""
+
+import hashlib
+
+from flask import make_response, render_template, request, session
+
+# Don't keep a copy at all (forms, redirects, anything unvalidated)
+NO_STORE = "no-cache, no-store, must-revalidate"
+
+# Keep a copy, but check it's still current (and get a 304) before reuse
+REVALIDATE = "no-cache"
+
+
+def cache_control(policy):
+    """Decorator: use `policy` as the Cache-Control for a view's pages."""
+
+    def decorator(view):
+        view.cache_control = policy
+        return view
+
+    return decorator
+
+
+def make_etag(validators):
+    """An ETag for a page described by `validators` (anything repr-able)."""
+
+    return hashlib.sha1(repr(validators).encode('utf-8')).hexdigest()
+
+
+def render_conditional(template, validators, last_modified=None, **context):
+    """Render `template`, or answer 304 if the client's copy is current.
+
+    `validators` must change whenever the rendered page would -- including
+    anything shown only to the current viewer. Only pass `last_modified`
+    when no change to the page can happen without it moving forward.
+    """
+
+    if session.get('_flashes'):
+        # a one-off message is about to be shown; always render
+        return render_template(template, **context)
+
+    etag = make_etag(validators)
+    if last_modified:
+        # HTTP dates have whole-second resolution
+        last_modified = last_modified.replace(microsecond=0)
+
+    if _is_fresh(etag, last_modified):
+        response = make_response('', 304)
+    else:
+        response = make_response(render_template(template, **context))
+
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+
+    return response
+
+
+def _is_fresh(etag, last_modified):
+    """Do the request's validators match the current page?"""
+
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+
+    if last_modified and request.if_modified_since:
+        return last_modified <= request.if_modified_since.replace(tzinfo=None)
+
+    return False
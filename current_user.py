@@ -0,0 +1,78 @@
+"""Per-process cache of logged-in users, for add_user_to_g.
+
+Every request from a logged-in user needs their row for g.user. Rather
+than query it each time, a lightweight snapshot is kept in an LRU cache
+for CURRENT_USER_CACHE_TTL seconds. Views that change a user call
+`forget_current_user` so their next request sees the change; changes made
+in other processes show up once the snapshot expires.
+"""
+
+from cache import LRUCache
+from models import db, User
+
+current_users = LRUCache(maxsize=10000, ttl=60)
+
+
+class CurrentUser:
+    """A read-only snapshot of a user's row, as cached for g.user.
+
+    Has the columns pages show plus User's lookup methods (which only need
+    the id). Use `User.query.get(g.user.id)` for a User you can change.
+    """
+
+    COLUMNS = ('id', 'username', 'email', 'image_url', 'header_image_url',
+               'bio', 'location', 'messages_count', 'following_count',
+               'followers_count', 'likes_count', 'profile_updated_at')
+
+    timeline = User.timeline
+    is_following = User.is_following
+    is_followed_by = User.is_followed_by
+    following_ids_among = User.following_ids_among
+    liked_ids_among = User.liked_ids_among
+
+    def __init__(self, **columns):
+        self.__dict__.update(columns)
+
+    def __repr__(self):
+        return f"<CurrentUser #{self.id}: {self.username}>"
+
+    def version(self):
+        """Everything about this user a page might show, for ETags."""
+
+        return tuple(getattr(self, name) for name in self.COLUMNS)
+
+
+def configure_current_users(app):
+    """Size the cache from the app's config."""
+
+    current_users.maxsize = app.config.setdefault(
+        'CURRENT_USER_CACHE_SIZE', 10000)
+    current_users.ttl = app.config.setdefault('CURRENT_USER_CACHE_TTL', 60)
+
+
+def load_current_user(user_id):
+    """The CurrentUser for `user_id`, or None if there's no such user.
+
+    Deleted accounts count as no such user, which logs them out.
+    """
+
+    user = current_users.get(user_id)
+
+    if user is None:
+        columns = [getattr(User, name) for name in CurrentUser.COLUMNS]
+        row = (db.session.query(*columns)
+               .filter(User.id == user_id, User.deleted_at.is_(None))
+               .first())
+        if row is None:
+            return None
+
+        user = CurrentUser(**row._asdict())
+        current_users.set(user_id, user)
+
+    return user
+
+
+def forget_current_user(user_id):
+    """Drop `user_id`'s snapshot, e.g. after changing their row."""
+
+    current_users.delete(user_id)
@@ -0,0 +1,57 @@
+"""Cache of rendered message cards.
+
+The card for a message (avatar, username, date, text) looks the same on
+every page and to every viewer, so it's rendered once and its HTML kept in
+an LRU cache bounded by both count and total size. Templates call
+`message_card(msg, author)`; per-viewer parts such as the like button stay
+outside it.
+
+Cards are stored with the author's `profile_updated_at`, so a profile edit
+invalidates every card of theirs, in every process, the next time one is
+looked up. Deleted messages are dropped with `forget_message_card`.
+
+Settings (read by `init_fragments`):
+
+- FRAGMENT_CACHE_SIZE: most cards kept (default 10000).
+- FRAGMENT_CACHE_MAX_CHARS: most HTML kept, in characters (default 8M).
+"""
+
+from flask import current_app
+from markupsafe import Markup
+
+from cache import LRUCache
+
+CARD_TEMPLATE = 'messages/card.html'
+
+# message id -> (author's profile_updated_at, card HTML)
+message_cards = LRUCache(maxsize=10000, maxweight=8 * 2**20,
+                         weigh=lambda entry: len(entry[1]))
+
+
+def init_fragments(app):
+    """Size the cache from the app's config and expose `message_card`."""
+
+    message_cards.maxsize = app.config.setdefault('FRAGMENT_CACHE_SIZE', 10000)
+    message_cards.maxweight = app.config.setdefault(
+        'FRAGMENT_CACHE_MAX_CHARS', 8 * 2**20)
+    app.jinja_env.globals['message_card'] = message_card
+
+
+def message_card(msg, author):
+    """The card HTML for `msg`, written by `author`."""
+
+    version = author.profile_updated_at
+    cached = message_cards.get(msg.id)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    template = current_app.jinja_env.get_template(CARD_TEMPLATE)
+    html = Markup(template.render(msg=msg, author=author))
+    message_cards.set(msg.id, (version, html))
+    return html
+
+
+def forget_message_card(message_id):
+    """Drop a message's card, e.g. once the message is deleted."""
+
+    message_cards.delete(message_id)
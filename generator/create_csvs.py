@@ -3,75 +3,249 @@
 Students won't need to run this for the exercise; they will just use the CSV
 files that this generates. You should only need to run this if you wanted to
 tweak the CSV formats or generate fewer/more rows.
+
+Output is fully determined by --seed (and the row counts): it doesn't use
+the network, and the same seed gives the same files however many --workers
+generate them. Rows are streamed to disk in fixed-size shards, spread over
+a process pool and joined at the end, so memory use stays flat from the
+`sample` tier up to `xlarge`.
+
+- Follows: each user follows a random number of others (exponentially
+  distributed around the average), chosen with a power law so that
+  follower counts are heavy-tailed -- a few users have most followers.
+- Messages: authors are drawn with a (gentler) power law; timestamps rise
+  in volume over the two years before --end and follow a daily cycle.
+- Likes: as follows, but over messages.
+
+    python generator/create_csvs.py --tier medium --workers 8
+    python generator/create_csvs.py --users 5000 --messages 20000
 """
 
+import argparse
 import csv
-from random import choice, randint, sample
-from itertools import permutations
-import requests
-from faker import Faker
-from helpers import get_random_datetime
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from random import Random
+
+from helpers import (HEADER_IMAGE_URLS, IMAGE_URLS, WORDS, Scramble,
+                     message_time, place, power_law_rank, sentence)
 
 MAX_WARBLER_LENGTH = 140
 
 USERS_CSV_HEADERS = ['email', 'username', 'image_url', 'password', 'bio', 'header_image_url', 'location']
 MESSAGES_CSV_HEADERS = ['text', 'timestamp', 'user_id']
 FOLLOWS_CSV_HEADERS = ['user_being_followed_id', 'user_following_id']
+LIKES_CSV_HEADERS = ['user_id', 'message_id']
 
-NUM_USERS = 300
-NUM_MESSAGES = 1000
-NUM_FOLLWERS = 5000
-
-fake = Faker()
-
-# Generate random profile image URLs to use for users
-
-image_urls = [
-    f"https://randomuser.me/api/portraits/{kind}/{i}.jpg"
-    for kind, count in [("lego", 10), ("men", 100), ("women", 100)]
-    for i in range(count)
-]
-
-# Generate random header image URLs to use for users
-
-header_image_urls = [
-    requests.get(f"http://www.splashbase.co/api/v1/images/{i}").json()['url']
-    for i in range(1, 46)
-]
-
-with open('generator/users.csv', 'w') as users_csv:
-    users_writer = csv.DictWriter(users_csv, fieldnames=USERS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for i in range(NUM_USERS):
-        users_writer.writerow(dict(
-            email=fake.email(),
-            username=fake.user_name(),
-            image_url=choice(image_urls),
-            password='$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe',
-            bio=fake.sentence(),
-            header_image_url=choice(header_image_urls),
-            location=fake.city()
-        ))
-
-with open('generator/messages.csv', 'w') as messages_csv:
-    messages_writer = csv.DictWriter(messages_csv, fieldnames=MESSAGES_CSV_HEADERS)
-    messages_writer.writeheader()
-
-    for i in range(NUM_MESSAGES):
-        messages_writer.writerow(dict(
-            text=fake.paragraph()[:MAX_WARBLER_LENGTH],
-            timestamp=get_random_datetime(),
-            user_id=randint(1, NUM_USERS)
-        ))
-
-# Generate follows.csv from random pairings of users
-
-with open('generator/follows.csv', 'w') as follows_csv:
-    all_pairs = list(permutations(range(1, NUM_USERS + 1), 2))
+# usernames are two of these plus the user's id, so always unique
+HANDLE_WORDS = [word for word in WORDS if len(word) > 3]
+
+# bcrypt of "password", shared by every generated user
+PASSWORD = '$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe'
+
+# (users, messages, follows, likes) for each --tier
+TIERS = {
+    'sample': (300, 1000, 5000, 0),
+    'small': (10_000, 100_000, 250_000, 250_000),
+    'medium': (100_000, 2_000_000, 5_000_000, 5_000_000),
+    'large': (1_000_000, 20_000_000, 100_000_000, 50_000_000),
+    'xlarge': (5_000_000, 100_000_000, 500_000_000, 250_000_000),
+}
+
+# Rows per shard for users and messages; users per shard for follows and
+# likes. Fixed, so that the output doesn't depend on the worker count.
+SHARD_ROWS = 100_000
+SHARD_USERS = 10_000
+
+SPAN = timedelta(days=730)
+
+# How strongly popularity is skewed (see helpers.power_law_rank)
+FOLLOW_SKEW = 1.0
+AUTHOR_SKEW = 0.8
+LIKE_SKEW = 1.0
+
+
+class Spec:
+    """What to generate; passed to each worker."""
+
+    def __init__(self, out, seed, users, messages, follows, likes, end):
+        self.out = out
+        self.seed = seed
+        self.users = users
+        self.messages = messages
+        self.follows = follows
+        self.likes = likes
+        self.end = end
+
+    def rng(self, *name):
+        """A Random seeded for one part of the output."""
+
+        return Random('-'.join(map(str, (self.seed,) + name)))
+
+    def part(self, kind, shard):
+        return os.path.join(self.out, f".{kind}-{shard:06d}.csv")
 
-    users_writer = csv.DictWriter(follows_csv, fieldnames=FOLLOWS_CSV_HEADERS)
-    users_writer.writeheader()
 
-    for followed_user, follower in sample(all_pairs, NUM_FOLLWERS):
-        users_writer.writerow(dict(user_being_followed_id=followed_user, user_following_id=follower))
+##############################################################################
+# Shards (these run in the worker processes)
+
+def users_shard(spec, shard):
+    rng = spec.rng('users', shard)
+    first = shard * SHARD_ROWS + 1
+    last = min(first + SHARD_ROWS, spec.users + 1)
+
+    with open(spec.part('users', shard), 'w', newline='') as f:
+        writer = csv.writer(f)
+        for id in range(first, last):
+            username = f"{rng.choice(HANDLE_WORDS)}{rng.choice(HANDLE_WORDS)}{id}"
+            writer.writerow([
+                f"{username}@example.com",
+                username,
+                rng.choice(IMAGE_URLS),
+                PASSWORD,
+                sentence(rng, MAX_WARBLER_LENGTH),
+                rng.choice(HEADER_IMAGE_URLS),
+                place(rng),
+            ])
+
+    return last - first
+
+
+def messages_shard(spec, shard):
+    rng = spec.rng('messages', shard)
+    authors = Scramble(spec.rng('authors'), spec.users)
+    start = spec.end - SPAN
+    first = shard * SHARD_ROWS
+    last = min(first + SHARD_ROWS, spec.messages)
+
+    with open(spec.part('messages', shard), 'w', newline='') as f:
+        writer = csv.writer(f)
+        for n in range(first, last):
+            writer.writerow([
+                sentence(rng, MAX_WARBLER_LENGTH),
+                message_time(rng, start, SPAN, (n + rng.random()) / spec.messages),
+                authors(power_law_rank(rng, spec.users, AUTHOR_SKEW)),
+            ])
+
+    return last - first
+
+
+def _edges_shard(spec, kind, shard, total, targets, skew):
+    """Write (target, user) pairs for the users in `shard`.
+
+    Each user gets a number of distinct targets drawn around
+    `total / users`, picked by power-law rank mapped through a Scramble.
+    """
+
+    rng = spec.rng(kind, shard)
+    popular = Scramble(spec.rng(kind, 'popular'), targets)
+    average = total / spec.users
+    first = shard * SHARD_USERS + 1
+    last = min(first + SHARD_USERS, spec.users + 1)
+    count = 0
+
+    with open(spec.part(kind, shard), 'w', newline='') as f:
+        writer = csv.writer(f)
+        for user in range(first, last):
+            wanted = (min(int(rng.expovariate(1 / average) + 0.5), targets - 1)
+                      if average else 0)
+            chosen = set()
+            for _ in range(wanted * 4):
+                if len(chosen) == wanted:
+                    break
+                target = popular(power_law_rank(rng, targets, skew))
+                if kind == 'follows' and target == user:
+                    continue
+                chosen.add(target)
+
+            for target in sorted(chosen):
+                writer.writerow((target, user) if kind == 'follows'
+                                else (user, target))
+            count += len(chosen)
+
+    return count
+
+
+def follows_shard(spec, shard):
+    return _edges_shard(spec, 'follows', shard, spec.follows, spec.users,
+                        FOLLOW_SKEW)
+
+
+def likes_shard(spec, shard):
+    return _edges_shard(spec, 'likes', shard, spec.likes, spec.messages,
+                        LIKE_SKEW)
+
+
+##############################################################################
+# Driver
+
+def generate(pool, spec, kind, headers, shard_fn, rows, shard_size):
+    """Run `shard_fn` over every shard, then join the parts into kind.csv."""
+
+    shards = range((rows + shard_size - 1) // shard_size)
+    counts = pool.map(shard_fn, [spec] * len(shards), shards)
+    total = sum(counts)
+
+    path = os.path.join(spec.out, f"{kind}.csv")
+    with open(path, 'w', newline='') as out:
+        csv.writer(out).writerow(headers)
+        for shard in shards:
+            with open(spec.part(kind, shard)) as part:
+                shutil.copyfileobj(part, out)
+            os.remove(spec.part(kind, shard))
+
+    print(f"{path}: {total:,} rows")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--tier', choices=TIERS, default='sample',
+                        help="preset row counts (default: sample)")
+    parser.add_argument('--users', type=int)
+    parser.add_argument('--messages', type=int)
+    parser.add_argument('--follows', type=int,
+                        help="approximate number of follows")
+    parser.add_argument('--likes', type=int,
+                        help="approximate number of likes (0: no likes.csv)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--end', type=datetime.fromisoformat,
+                        default=datetime(2021, 1, 1),
+                        help="newest message time (default: 2021-01-01)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--out', default=os.path.dirname(os.path.abspath(__file__)),
+                        help="output directory (default: generator/)")
+    args = parser.parse_args()
+
+    users, messages, follows, likes = TIERS[args.tier]
+    spec = Spec(
+        out=args.out,
+        seed=args.seed,
+        users=args.users if args.users is not None else users,
+        messages=args.messages if args.messages is not None else messages,
+        follows=args.follows if args.follows is not None else follows,
+        likes=args.likes if args.likes is not None else likes,
+        end=args.end,
+    )
+    os.makedirs(spec.out, exist_ok=True)
+
+    with ProcessPoolExecutor(args.workers) as pool:
+        generate(pool, spec, 'users', USERS_CSV_HEADERS, users_shard,
+                 spec.users, SHARD_ROWS)
+        generate(pool, spec, 'messages', MESSAGES_CSV_HEADERS, messages_shard,
+                 spec.messages, SHARD_ROWS)
+        generate(pool, spec, 'follows', FOLLOWS_CSV_HEADERS, follows_shard,
+                 spec.users, SHARD_USERS)
+
+        likes_path = os.path.join(spec.out, 'likes.csv')
+        if spec.likes and spec.messages:
+            generate(pool, spec, 'likes', LIKES_CSV_HEADERS, likes_shard,
+                     spec.users, SHARD_USERS)
+        elif os.path.exists(likes_path):
+            # don't leave a stale likes.csv for seed.py to pick up
+            os.remove(likes_path)
+
+
+if __name__ == '__main__':
+    main()
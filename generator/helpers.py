@@ -1,14 +1,147 @@
-"""Support functions for CSV generation."""
+"""Support functions for CSV generation.
 
-from datetime import datetime
-from random import uniform
+Everything here draws from a `random.Random` passed in, so that a given
+seed always produces the same data, and nothing touches the network.
+"""
 
+from datetime import timedelta
+from math import exp, gcd, log
 
-def get_random_datetime(year_gap=2):
-    """Get a random datetime within the last few years."""
+IMAGE_URLS = [
+    f"https://randomuser.me/api/portraits/{kind}/{i}.jpg"
+    for kind, count in [("lego", 10), ("men", 100), ("women", 100)]
+    for i in range(count)
+]
 
-    now = datetime.now()
-    then = now.replace(year=now.year - year_gap)
-    random_timestamp = uniform(then.timestamp(), now.timestamp())
+# Header images, as previously fetched from the splashbase API
+HEADER_IMAGE_URLS = [
+    f"https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_{name}_1280.jpg"
+    for name in [
+        'mnh0n9pHJW1st5lhmo1', 'mnh0uemhCk1st5lhmo1', 'mnh121HEWa1st5lhmo1',
+        'mnh17lfd9R1st5lhmo1', 'mnh1d7s3UD1st5lhmo1', 'mnh1jdFvHR1st5lhmo1',
+        'mnh1uhYnog1st5lhmo1', 'mnh25vNOvI1st5lhmo1', 'mnh29fxz111st5lhmo1',
+        'mnh2m1hnS81st5lhmo1', 'mo1h6tGOZf1st5lhmo1', 'mo2wz2LTCs1st5lhmo1',
+        'mo2x3aAnRH1st5lhmo1', 'mo2x80NkDu1st5lhmo1', 'mo2x9xqeef1st5lhmo1',
+        'mo2xbk8JUK1st5lhmo1', 'mo2xdqmle51st5lhmo1', 'mo2xfarCvW1st5lhmo1',
+        'mo2xgqdEFn1st5lhmo1', 'mo2xijE2nr1st5lhmo1', 'mopq4kHmAg1st5lhmo1',
+        'mopq69jlcS1st5lhmo1', 'mopq8fyQwI1st5lhmo1', 'mopqamedKu1st5lhmo1',
+        'mopqc3ZZcz1st5lhmo1', 'mopqdfx05t1st5lhmo1', 'mopqfpSTPN1st5lhmo1',
+        'mopqhxFulr1st5lhmo1', 'mopqj9QUeq1st5lhmo1', 'mopqkkwK2M1st5lhmo1',
+        'mp6rzyNlAN1st5lhmo1', 'mp6s1hAudo1st5lhmo1', 'mp6s32zb6l1st5lhmo1',
+        'mp6s4dzqHA1st5lhmo1', 'mp6s661UgK1st5lhmo1', 'mp6s7lR1lS1st5lhmo1',
+        'mp6s995bvI1st5lhmo1', 'mp6sasSvPZ1st5lhmo1', 'mp6scv2xrZ1st5lhmo1',
+        'mpp6f50W261st5lhmo1', 'mpp6gwrYvm1st5lhmo1', 'mpp6l06zXi1st5lhmo1',
+        'mpp6poZxE51st5lhmo1', 'mpp6tjdFhf1st5lhmo1', 'mpp6w0dxAm1st5lhmo1',
+    ]
+]
 
-    return datetime.fromtimestamp(random_timestamp)
+WORDS = """
+    able about above across act add after again against age ago air all
+    almost along already also always among amount and animal answer any
+    area arm around art ask away baby back bad bag ball bank bar base be
+    bear beat bed before begin behind best better big bird black blue board
+    boat body book both box boy bring brother build business buy call can
+    car card care carry case cat catch cause center chair chance change
+    child church city claim class close cold color come common cost could
+    country course cover cut dark data day dead deal deep door down draw
+    dream drive drop dry during each early earth east easy eat edge effect
+    egg end enjoy enough even evening event ever every eye face fact fall
+    family far farm fast father fear feel few field fight fill film find
+    fine fire first fish five floor fly food foot force forest form free
+    friend front full game garden girl give glass go gold good green ground
+    group grow guess hair half hand happy hard have head hear heart heavy
+    help here high hill hold home hope horse hot hour house idea inside
+    island job join just keep kind king know lake land large last late
+    laugh lead learn leave less letter life light line list listen little
+    live long look lose love low machine main make man many map mark market
+    matter mean meet middle might mind minute miss moment money month moon
+    more morning most mother mountain move music name near need never new
+    news next nice night north note now number ocean off offer often old
+    once only open order other out page paper park part party pass past
+    pay people pick picture piece place plan plant play point poor power
+    pretty problem pull push question quick quiet rain reach read ready
+    real reason red remember rest rich ride right river road rock room
+    round rule run safe sail same save say school sea season seat second
+    see sell send serve set shape share ship shore short show side sign
+    simple sing sister sit six size sky sleep slow small smile snow soft
+    some song soon sound south space speak special spring square stand star
+    start stay step still stone stop story street strong study summer sun
+    sure table take talk tall team tell test thank thing think three time
+    today together tomorrow town train travel tree trip true try turn two
+    under until up use valley very visit voice wait walk wall want warm
+    watch water wave way weather week well west wheel while white whole
+    wide wild win wind window winter wish with woman wonder wood word work
+    world write year yellow young
+""".split()
+
+PLACE_PREFIXES = ['North ', 'South ', 'East ', 'West ', 'New ', 'Port ', '', '', '', '']
+PLACE_SUFFIXES = ['ton', 'ville', 'burgh', 'field', 'port', 'mouth', 'side', 'haven']
+
+# Relative posting activity for each hour of the day (00:00 - 23:00)
+HOURLY_ACTIVITY = [2, 1, 1, 1, 1, 2, 4, 6, 8, 9, 9, 10,
+                   11, 10, 9, 9, 10, 11, 12, 13, 13, 11, 8, 4]
+
+
+def sentence(rng, max_length):
+    """A random sentence of at most `max_length` characters."""
+
+    words = rng.choices(WORDS, k=rng.randint(4, 24))
+    text = ' '.join(words).capitalize()[:max_length - 1].rstrip()
+    return text + '.'
+
+
+def place(rng):
+    """A random, plausible-looking town name."""
+
+    return (rng.choice(PLACE_PREFIXES) + rng.choice(WORDS).capitalize()
+            + rng.choice(PLACE_SUFFIXES))
+
+
+def power_law_rank(rng, n, exponent=1.0):
+    """A rank in 1..n, where rank r is drawn with weight r ** -exponent.
+
+    Inverse-CDF sampling of the continuous distribution, so O(1) and
+    memory-free however large `n` is.
+    """
+
+    u = rng.random()
+    if exponent == 1.0:
+        rank = exp(u * log(n + 1))
+    else:
+        a = 1.0 - exponent
+        rank = ((((n + 1) ** a) - 1) * u + 1) ** (1 / a)
+
+    return min(int(rank), n)
+
+
+class Scramble:
+    """A fixed, seeded bijection of 1..n onto itself.
+
+    Used to turn popularity ranks into ids, so the most-followed users
+    aren't simply the oldest ones.
+    """
+
+    def __init__(self, rng, n):
+        self.n = n
+        self.offset = rng.randrange(n)
+        self.step = rng.randrange(1, n) if n > 1 else 1
+        while gcd(self.step, n) != 1:
+            self.step += 1
+
+    def __call__(self, rank):
+        return (rank * self.step + self.offset) % self.n + 1
+
+
+def message_time(rng, start, span, position):
+    """A timestamp for the message at `position` (0..1) through the dataset.
+
+    Posting grows over the `span` after `start` (volume rising linearly,
+    so positions map through a square root), and follows the daily cycle
+    in HOURLY_ACTIVITY within each day.
+    """
+
+    day = start + span * position ** 0.5
+    hour = rng.choices(range(24), weights=HOURLY_ACTIVITY)[0]
+
+    return (day.replace(hour=0, minute=0, second=0, microsecond=0)
+            + timedelta(hours=hour, seconds=rng.uniform(0, 3600)))
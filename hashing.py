@@ -0,0 +1,101 @@
+"""Password hashing for Warbler.
+
+bcrypt is deliberately slow, so hashes are computed on a small pool of
+threads or processes rather than directly on the request worker. A burst of
+logins then queues for the pool instead of pinning every worker's CPU.
+
+Settings (read by `init_app`):
+
+- BCRYPT_LOG_ROUNDS: work factor for new hashes (default 12). Hashes made
+  at any other cost are rehashed the next time their owner logs in.
+- PASSWORD_HASHING_POOL: 'thread' (default) or 'process'. bcrypt releases
+  the GIL, so threads already hash in parallel; processes also keep the
+  work off the web worker's CPU.
+- PASSWORD_HASHING_WORKERS: pool size (default: number of CPUs).
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from threading import Lock
+
+import bcrypt
+
+POOLS = {
+    'thread': ThreadPoolExecutor,
+    'process': ProcessPoolExecutor,
+}
+
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def _check(password, hashed):
+    return bcrypt.checkpw(password, hashed)
+
+
+class PasswordHasher:
+    """Hashes and checks passwords on a worker pool."""
+
+    def __init__(self):
+        self.rounds = 12
+        self.pool_kind = 'thread'
+        self.workers = os.cpu_count()
+        self.pool = None
+        self.lock = Lock()
+
+    def init_app(self, app):
+        self.rounds = app.config.setdefault(
+            'BCRYPT_LOG_ROUNDS', int(os.environ.get('BCRYPT_LOG_ROUNDS', 12)))
+        self.pool_kind = app.config.setdefault(
+            'PASSWORD_HASHING_POOL',
+            os.environ.get('PASSWORD_HASHING_POOL', 'thread'))
+        self.workers = app.config.setdefault(
+            'PASSWORD_HASHING_WORKERS',
+            int(os.environ.get('PASSWORD_HASHING_WORKERS', os.cpu_count())))
+
+        if self.pool_kind not in POOLS:
+            raise ValueError(
+                f"PASSWORD_HASHING_POOL must be one of {', '.join(POOLS)}")
+
+    def _run(self, fn, *args):
+        # the pool is started on first use, so that forking web servers
+        # give each worker process its own
+        if self.pool is None:
+            with self.lock:
+                if self.pool is None:
+                    self.pool = POOLS[self.pool_kind](self.workers)
+
+        return self.pool.submit(fn, *args).result()
+
+    def hash(self, password):
+        """Hash `password` at the configured cost."""
+
+        if not password:
+            raise ValueError("Password must be non-empty.")
+
+        return self._run(_hash, password.encode('utf-8'), self.rounds)
+
+    def check(self, hashed, password):
+        """Does `password` match `hashed`?"""
+
+        if not password:
+            return False
+
+        try:
+            return self._run(_check, password.encode('utf-8'),
+                             hashed.encode('utf-8'))
+        except ValueError:
+            # not a bcrypt hash at all
+            return False
+
+    def needs_rehash(self, hashed):
+        """Was `hashed` made at a cost other than the configured one?"""
+
+        try:
+            return int(hashed.split('$')[2]) != self.rounds
+        except (IndexError, ValueError):
+            return True
+
+
+hasher = PasswordHasher()
@@ -0,0 +1,340 @@
+"""Background jobs for Warbler, queued in the database.
+
+Side effects that can be slow -- pushing a message to every follower's
+timeline, backfilling or pruning a timeline, purging a deleted account's
+rows -- are queued by the request handlers and run by worker processes
+(`flask jobs work`). There's no broker: the queue is the `jobs` table, so
+a job is queued in the same transaction as the change that needs it and
+never runs for a change that was rolled back.
+
+A worker claims a job by pushing its `run_at` forward by the visibility
+timeout; if the worker dies, the job becomes visible again once that
+passes. Failed jobs are retried with exponential backoff, then kept with
+status 'failed' for inspection (`flask jobs status`, `flask jobs retry`).
+Because a job may run more than once, every job must be idempotent.
+
+Housekeeping that must happen whatever the traffic (e.g. deleting expired
+rows) is registered with `every`: each worker runs those jobs itself, at
+most once per their interval, between queued jobs.
+
+Settings (read by `init_jobs`):
+
+- JOBS_EAGER: run jobs inline as they're queued, rather than in a worker
+  (default: $JOBS_EAGER == '1'; the tests turn it on).
+- JOBS_VISIBILITY_TIMEOUT: seconds a claimed job is hidden (default 300).
+- JOBS_MAX_ATTEMPTS: tries before a job is marked failed (default 5).
+"""
+
+import json
+import os
+import time
+import traceback
+from datetime import datetime, timedelta
+from multiprocessing import Process
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+from models import db, AccountPurge, Message, Follows, TimelineEntry
+
+QUEUED = 'queued'
+FAILED = 'failed'
+
+# kind -> function, filled in by @job
+JOBS = {}
+
+# kind -> seconds between runs, filled in by `every`
+PERIODIC = {}
+
+PURGE_BATCHES_PER_JOB = 20
+
+
+class Job(db.Model):
+    """A queued call of one of the functions in JOBS."""
+
+    __tablename__ = 'jobs'
+
+    id = db.Column(db.Integer, primary_key=True)
+
+    kind = db.Column(db.Text, nullable=False)
+
+    # JSON of the keyword arguments
+    payload = db.Column(db.Text, nullable=False)
+
+    status = db.Column(db.Text, nullable=False, default=QUEUED)
+
+    # when the job is next visible to workers
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+
+    last_error = db.Column(db.Text)
+
+    created_at = db.Column(db.DateTime, nullable=False,
+                           default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_jobs_status_run_at', 'status', 'run_at'),
+    )
+
+    def __repr__(self):
+        return f"<Job #{self.id}: {self.kind} {self.status}>"
+
+
+def init_jobs(app):
+    app.config.setdefault('JOBS_EAGER', os.environ.get('JOBS_EAGER') == '1')
+    app.config.setdefault('JOBS_VISIBILITY_TIMEOUT', 300)
+    app.config.setdefault('JOBS_MAX_ATTEMPTS', 5)
+    app.cli.add_command(jobs_cli)
+
+
+def job(fn):
+    """Decorator: register `fn` as a job kind, under its name."""
+
+    JOBS[fn.__name__] = fn
+    return fn
+
+
+def every(kind, seconds):
+    """Have workers run job `kind` (which takes no arguments) every
+    `seconds`, or stop with `seconds=None`.
+    """
+
+    if seconds is None:
+        PERIODIC.pop(kind, None)
+    else:
+        PERIODIC[kind] = seconds
+
+
+def enqueue(kind, **kwargs):
+    """Queue a call of job `kind` with `kwargs` (which must be JSON-able).
+
+    The job is added to the current session, so it's queued when (and only
+    if) the caller commits. With JOBS_EAGER it runs right away instead.
+    """
+
+    payload = json.dumps(kwargs)
+
+    if current_app.config['JOBS_EAGER']:
+        JOBS[kind](**json.loads(payload))
+        return
+
+    db.session.add(Job(kind=kind, payload=payload))
+
+
+##############################################################################
+# Workers
+
+def claim():
+    """Claim the next visible job, or return None if there's none."""
+
+    now = datetime.utcnow()
+    query = (Job.query
+             .filter(Job.status == QUEUED, Job.run_at <= now)
+             .order_by(Job.run_at, Job.id))
+    if db.engine.dialect.name == 'postgresql':
+        query = query.with_for_update(skip_locked=True)
+
+    job = query.first()
+    if job is None:
+        db.session.rollback()
+        return None
+
+    # only take it if no other worker moved it in the meantime
+    timeout = timedelta(seconds=current_app.config['JOBS_VISIBILITY_TIMEOUT'])
+    claimed = (Job.query
+               .filter(Job.id == job.id, Job.run_at == job.run_at)
+               .update({Job.run_at: now + timeout,
+                        Job.attempts: Job.attempts + 1},
+                       synchronize_session=False))
+    db.session.commit()
+
+    return job if claimed else None
+
+
+def run(job):
+    """Run a claimed job; on success remove it, on failure reschedule it."""
+
+    try:
+        JOBS[job.kind](**json.loads(job.payload))
+        Job.query.filter(Job.id == job.id).delete()
+        db.session.commit()
+        return True
+
+    except Exception:
+        db.session.rollback()
+
+        job.last_error = traceback.format_exc(limit=5)
+        if job.attempts >= current_app.config['JOBS_MAX_ATTEMPTS']:
+            job.status = FAILED
+        else:
+            job.run_at = datetime.utcnow() + timedelta(seconds=2 ** job.attempts)
+        db.session.commit()
+        return False
+
+
+def run_periodic(due):
+    """Run the PERIODIC jobs whose time has come.
+
+    `due` maps kind -> monotonic time it's next due, and is updated; a
+    failure is logged, and the job tried again next interval.
+    """
+
+    now = time.monotonic()
+    for kind, seconds in PERIODIC.items():
+        if due.get(kind, now) > now:
+            continue
+        due[kind] = now + seconds
+
+        try:
+            JOBS[kind]()
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            current_app.logger.exception("Periodic job %s failed", kind)
+
+
+def work(burst=False, poll_interval=1.0):
+    """Run jobs until stopped (or, with `burst`, until the queue is empty)."""
+
+    due = {}
+    while True:
+        run_periodic(due)
+
+        job = claim()
+        if job is not None:
+            run(job)
+            continue
+
+        if burst and not queued_now():
+            return
+
+        time.sleep(poll_interval)
+
+
+def queued_now():
+    """Are there jobs waiting (visible or not)?"""
+
+    return db.session.query(
+        Job.query.filter(Job.status == QUEUED).exists()).scalar()
+
+
+def _worker_process(burst, poll_interval):
+    # connections can't be shared with the parent process
+    db.engine.dispose()
+    with current_app.app_context():
+        work(burst, poll_interval)
+
+
+##############################################################################
+# CLI
+
+jobs_cli = AppGroup('jobs', help="Run and inspect background jobs.")
+
+
+@jobs_cli.command('work')
+@click.option('--processes', default=1, help="Worker processes to run.")
+@click.option('--burst', is_flag=True,
+              help="Exit once the queue is empty rather than waiting.")
+@click.option('--poll-interval', default=1.0,
+              help="Seconds between polls of an empty queue.")
+def work_command(processes, burst, poll_interval):
+    """Run jobs as they're queued."""
+
+    if processes == 1:
+        work(burst, poll_interval)
+        return
+
+    db.engine.dispose()
+    workers = [Process(target=_worker_process, args=(burst, poll_interval))
+               for _ in range(processes)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
+@jobs_cli.command('status')
+def status_command():
+    """Show queue depth by job kind and status."""
+
+    rows = (db.session.query(Job.kind, Job.status, db.func.count(),
+                             db.func.min(Job.created_at))
+            .group_by(Job.kind, Job.status)
+            .order_by(Job.kind, Job.status)
+            .all())
+
+    if not rows:
+        click.echo("No jobs queued.")
+        return
+
+    now = datetime.utcnow()
+    click.echo(f"{'kind':<20}{'status':<10}{'count':>10}{'oldest':>12}")
+    for kind, status, count, oldest in rows:
+        age = int((now - oldest).total_seconds())
+        click.echo(f"{kind:<20}{status:<10}{count:>10}{age:>11}s")
+
+
+@jobs_cli.command('retry')
+def retry_command():
+    """Queue failed jobs to run again."""
+
+    retried = (Job.query
+               .filter(Job.status == FAILED)
+               .update({Job.status: QUEUED, Job.attempts: 0,
+                        Job.run_at: datetime.utcnow()},
+                       synchronize_session=False))
+    db.session.commit()
+    click.echo(f"{retried} jobs queued again.")
+
+
+##############################################################################
+# Jobs
+
+@job
+def fan_out(message_id):
+    """Push a message to its author's followers' timelines."""
+
+    message = Message.query.get(message_id)
+    if message is not None:
+        TimelineEntry.fan_out(message)
+
+
+@job
+def backfill_timeline(user_id, followed_id):
+    """Copy a newly followed user's recent messages into a timeline."""
+
+    # skip if they've unfollowed again since
+    if Follows.exists(user_id, followed_id):
+        TimelineEntry.backfill(user_id, followed_id)
+
+
+@job
+def prune_timeline(user_id, followed_id):
+    """Take an unfollowed user's messages out of a timeline."""
+
+    # skip if they've followed again since
+    if not Follows.exists(user_id, followed_id):
+        TimelineEntry.prune(user_id, followed_id)
+
+
+@job
+def purge_user(user_id):
+    """Remove a deleted account's rows, one batch per transaction.
+
+    Stops after PURGE_BATCHES_PER_JOB batches and queues itself to carry
+    on, so a big account doesn't outlast the visibility timeout.
+    """
+
+    purge = AccountPurge.query.get(user_id)
+    if purge is None:
+        return
+
+    for _ in range(PURGE_BATCHES_PER_JOB):
+        more = purge.run_batch()
+        db.session.commit()
+        if not more:
+            return
+
+    enqueue('purge_user', user_id=user_id)
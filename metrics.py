@@ -0,0 +1,215 @@
+"""Request, SQL and template timing for Warbler.
+
+`init_metrics(app)` hooks into the request cycle, SQLAlchemy's engine
+events and Flask's template signals, and serves what it collects at
+/metrics in the Prometheus text format.
+
+Numbers are kept per process; with several workers, scrape each of them
+(or aggregate in Prometheus).
+"""
+
+from threading import Lock
+from time import perf_counter
+
+from flask import Response, g, has_request_context, request
+from flask import before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+
+class Histogram:
+    """A Prometheus-style histogram, with one series per label value."""
+
+    def __init__(self, name, help, label, buckets):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.buckets = buckets
+        self.series = {}
+        self.lock = Lock()
+
+    def observe(self, label_value, value):
+        """Record one observation of `value` for `label_value`."""
+
+        with self.lock:
+            series = self.series.setdefault(
+                label_value, {'buckets': [0] * len(self.buckets),
+                              'sum': 0, 'count': 0})
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['buckets'][i] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def exposition(self):
+        """Lines of Prometheus text format for this histogram."""
+
+        lines = [f"# HELP {self.name} {self.help}",
+                 f"# TYPE {self.name} histogram"]
+
+        with self.lock:
+            for label_value, series in sorted(self.series.items()):
+                label = f'{self.label}="{_escape(label_value)}"'
+                for bound, count in zip(self.buckets, series['buckets']):
+                    lines.append(
+                        f'{self.name}_bucket{{{label},le="{bound}"}} {count}')
+                lines.append(
+                    f'{self.name}_bucket{{{label},le="+Inf"}} {series["count"]}')
+                lines.append(f'{self.name}_sum{{{label}}} {series["sum"]}')
+                lines.append(f'{self.name}_count{{{label}}} {series["count"]}')
+
+        return lines
+
+
+class Counter:
+    """A Prometheus-style counter, with one series per set of labels."""
+
+    def __init__(self, name, help, labels):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.series = {}
+        self.lock = Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self.series[label_values] = (
+                self.series.get(label_values, 0) + amount)
+
+    def exposition(self):
+        """Lines of Prometheus text format for this counter."""
+
+        lines = [f"# HELP {self.name} {self.help}",
+                 f"# TYPE {self.name} counter"]
+
+        with self.lock:
+            for label_values, value in sorted(self.series.items()):
+                labels = ",".join(f'{label}="{_escape(value)}"'
+                                  for label, value
+                                  in zip(self.labels, label_values))
+                lines.append(f"{self.name}{{{labels}}} {value}")
+
+        return lines
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"')
+
+
+request_latency = Histogram(
+    'warbler_request_duration_seconds',
+    "Time spent handling a request, by endpoint.",
+    'endpoint', LATENCY_BUCKETS)
+
+request_queries = Histogram(
+    'warbler_request_sql_queries',
+    "SQL statements run per request, by endpoint.",
+    'endpoint', QUERY_COUNT_BUCKETS)
+
+request_sql_time = Histogram(
+    'warbler_request_sql_duration_seconds',
+    "Total time spent in SQL per request, by endpoint.",
+    'endpoint', LATENCY_BUCKETS)
+
+template_render_time = Histogram(
+    'warbler_template_render_duration_seconds',
+    "Time spent rendering a template, by template.",
+    'template', LATENCY_BUCKETS)
+
+requests_total = Counter(
+    'warbler_requests_total',
+    "Requests handled, by endpoint and status code.",
+    ('endpoint', 'status'))
+
+ALL_METRICS = (request_latency, request_queries, request_sql_time,
+               template_render_time, requests_total)
+
+
+##############################################################################
+# Hooks
+
+
+def _start_request():
+    g.metrics_started = perf_counter()
+    g.sql_queries = 0
+    g.sql_seconds = 0.0
+
+
+def _finish_request(response):
+    if 'metrics_started' not in g:
+        return response
+
+    endpoint = request.endpoint or 'unknown'
+    request_latency.observe(endpoint, perf_counter() - g.metrics_started)
+    request_queries.observe(endpoint, g.sql_queries)
+    request_sql_time.observe(endpoint, g.sql_seconds)
+    requests_total.inc(endpoint, response.status_code)
+
+    return response
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    conn.info.setdefault('query_started', []).append(perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    elapsed = perf_counter() - conn.info['query_started'].pop()
+
+    if has_request_context() and 'sql_queries' in g:
+        g.sql_queries += 1
+        g.sql_seconds += elapsed
+
+
+def _forget_failed_query(context):
+    # no connection if it was connecting that failed
+    if context.connection is None:
+        return
+
+    started = context.connection.info.get('query_started')
+    if started:
+        started.pop()
+
+
+def _before_render(app, template, context):
+    if has_request_context():
+        g.setdefault('renders_started', []).append(perf_counter())
+
+
+def _after_render(app, template, context):
+    if has_request_context() and g.get('renders_started'):
+        elapsed = perf_counter() - g.renders_started.pop()
+        template_render_time.observe(template.name, elapsed)
+
+
+def metrics_view():
+    """Serve every metric in the Prometheus text format."""
+
+    lines = []
+    for metric in ALL_METRICS:
+        lines.extend(metric.exposition())
+
+    return Response("\n".join(lines) + "\n",
+                    mimetype='text/plain; version=0.0.4')
+
+
+def init_metrics(app):
+    """Start collecting metrics for `app` and serve them at /metrics."""
+
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+
+    if not event.contains(Engine, 'before_cursor_execute',
+                          _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(Engine, 'handle_error', _forget_failed_query)
+
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_after_render, app)
+
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
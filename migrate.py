@@ -0,0 +1,184 @@
+"""Versioned schema migrations for Warbler.
+
+`db.create_all()` builds the current schema for a new database (seed.py
+then stamps it as fully migrated); migrations bring an existing database
+up to date. Each is a file in migrations/, named NNNN_description.py, with
+a docstring and an `upgrade(connection)` function. Applied versions are
+recorded in the `schema_migrations` table.
+
+Index builds can lock a big table for minutes, so a migration setting
+CONCURRENT = True runs outside a transaction, and `create_index` builds
+with CREATE INDEX CONCURRENTLY on Postgres: reads and writes carry on
+while it works. Such a migration must be safe to re-run, since a failure
+part-way leaves it unrecorded.
+
+    flask migrate status
+    flask migrate upgrade
+    flask migrate stamp      # record everything as applied, without running it
+"""
+
+import importlib.util
+import os
+import re
+from datetime import datetime
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import Column, DateTime, MetaData, Table, Text, text
+
+from models import db
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              'migrations')
+
+MIGRATION_FILE = re.compile(r'^(\d{4})_(\w+)\.py$')
+
+# kept out of db.metadata, so create_all/drop_all leave it alone
+schema_migrations = Table(
+    'schema_migrations', MetaData(),
+    Column('version', Text, primary_key=True),
+    Column('name', Text, nullable=False),
+    Column('applied_at', DateTime, nullable=False, default=datetime.utcnow),
+)
+
+
+class Migration:
+    """One file in migrations/."""
+
+    def __init__(self, path):
+        version, name = MIGRATION_FILE.match(os.path.basename(path)).groups()
+        self.version = version
+        self.name = name
+
+        spec = importlib.util.spec_from_file_location(
+            f"migrations.m{version}", path)
+        self.module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(self.module)
+
+        self.concurrent = getattr(self.module, 'CONCURRENT', False)
+
+    def __repr__(self):
+        return f"<Migration {self.version}_{self.name}>"
+
+    def upgrade(self, connection):
+        self.module.upgrade(connection)
+
+
+def migrations():
+    """Every migration, in order."""
+
+    return [Migration(os.path.join(MIGRATIONS_DIR, filename))
+            for filename in sorted(os.listdir(MIGRATIONS_DIR))
+            if MIGRATION_FILE.match(filename)]
+
+
+def applied(engine):
+    """Versions already applied to `engine`'s database."""
+
+    schema_migrations.create(engine, checkfirst=True)
+    with engine.connect() as conn:
+        return {version for version,
+                in conn.execute(schema_migrations.select()
+                                .with_only_columns([schema_migrations.c.version]))}
+
+
+def pending(engine):
+    done = applied(engine)
+    return [migration for migration in migrations()
+            if migration.version not in done]
+
+
+def _record(conn, migration):
+    conn.execute(schema_migrations.insert(),
+                 {'version': migration.version, 'name': migration.name})
+
+
+def upgrade(engine, echo=print):
+    """Apply pending migrations to `engine`'s database, in order."""
+
+    for migration in pending(engine):
+        echo(f"Applying {migration.version}_{migration.name}...")
+
+        if migration.concurrent and engine.dialect.name == 'postgresql':
+            with engine.connect() as conn:
+                migration.upgrade(
+                    conn.execution_options(isolation_level='AUTOCOMMIT'))
+            with engine.begin() as conn:
+                _record(conn, migration)
+        else:
+            with engine.begin() as conn:
+                migration.upgrade(conn)
+                _record(conn, migration)
+
+
+def stamp(engine):
+    """Record every migration as applied, e.g. after create_all()."""
+
+    done = applied(engine)
+    with engine.begin() as conn:
+        for migration in migrations():
+            if migration.version not in done:
+                _record(conn, migration)
+
+
+##############################################################################
+# Helpers for migrations
+
+def create_index(conn, name, table, columns, where=None, using=None,
+                 dialect=None):
+    """Create an index unless it exists, concurrently on Postgres.
+
+    `columns` and `where` are SQL. With `dialect`, only on that database.
+    """
+
+    if dialect is not None and conn.dialect.name != dialect:
+        return
+
+    postgres = conn.dialect.name == 'postgresql'
+    autocommit = conn.get_execution_options().get('isolation_level') == 'AUTOCOMMIT'
+    concurrently = 'CONCURRENTLY ' if postgres and autocommit else ''
+
+    # a failed concurrent build leaves an invalid index behind, which
+    # IF NOT EXISTS would take for the real thing
+    if postgres and conn.execute(text(
+            "SELECT NOT indisvalid FROM pg_index "
+            "WHERE indexrelid = to_regclass(:name)"), name=name).scalar():
+        conn.execute(f"DROP INDEX {concurrently}{name}")
+
+    conn.execute(
+        f"CREATE INDEX {concurrently}IF NOT EXISTS {name} ON {table} "
+        + (f"USING {using} " if using else '')
+        + f"({columns})"
+        + (f" WHERE {where}" if where else ''))
+
+
+##############################################################################
+# CLI
+
+migrate_cli = AppGroup('migrate', help="Apply and inspect schema migrations.")
+
+
+@migrate_cli.command('status')
+def status_command():
+    """List migrations and whether each is applied."""
+
+    done = applied(db.engine)
+    for migration in migrations():
+        mark = 'applied' if migration.version in done else 'pending'
+        click.echo(f"{migration.version}_{migration.name:<40}{mark}")
+
+
+@migrate_cli.command('upgrade')
+def upgrade_command():
+    """Apply pending migrations."""
+
+    upgrade(db.engine, echo=click.echo)
+    click.echo("Schema is up to date.")
+
+
+@migrate_cli.command('stamp')
+def stamp_command():
+    """Record every migration as applied, without running them."""
+
+    stamp(db.engine)
+    click.echo("All migrations recorded as applied.")
@@ -0,0 +1,28 @@
+"""Bring a database made from an older schema up to the first versioned one.
+
+Creates the tables added since (timeline entries, jobs, account purges,
+...) from the models, and adds the users columns added since. The counter
+columns start at 0, and timelines empty; 0006 fills both in.
+"""
+
+from sqlalchemy import inspect
+
+from models import db
+
+USERS_COLUMNS = [
+    ('messages_count', 'INTEGER NOT NULL DEFAULT 0'),
+    ('following_count', 'INTEGER NOT NULL DEFAULT 0'),
+    ('followers_count', 'INTEGER NOT NULL DEFAULT 0'),
+    ('likes_count', 'INTEGER NOT NULL DEFAULT 0'),
+    ('profile_updated_at', 'TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP'),
+    ('deleted_at', 'TIMESTAMP'),
+]
+
+
+def upgrade(conn):
+    db.metadata.create_all(conn, checkfirst=True)
+
+    existing = {column['name'] for column in inspect(conn).get_columns('users')}
+    for name, definition in USERS_COLUMNS:
+        if name not in existing:
+            conn.execute(f"ALTER TABLE users ADD COLUMN {name} {definition}")
@@ -0,0 +1,31 @@
+"""Indexes for the hot queries, for databases made before they were declared.
+
+- messages (user_id, timestamp, id): profile timelines and backfills
+- timeline_entries (user_id, timestamp, message_id): home timelines
+- follows (user_following_id): "who does X follow", following counts
+- likes (message_id): a message's likes, and deleting messages
+- users (deleted_at), partial: skipping deleted accounts
+- users search vector (Postgres): /users?q=
+- jobs (status, run_at): workers claiming jobs
+"""
+
+from migrate import create_index
+
+CONCURRENT = True
+
+
+def upgrade(conn):
+    create_index(conn, 'ix_messages_user_timestamp', 'messages',
+                 'user_id, timestamp DESC, id DESC')
+    create_index(conn, 'ix_timeline_entries_user_timestamp', 'timeline_entries',
+                 'user_id, timestamp DESC, message_id DESC')
+    create_index(conn, 'ix_follows_user_following_id', 'follows',
+                 'user_following_id')
+    create_index(conn, 'ix_likes_message_id', 'likes', 'message_id')
+    create_index(conn, 'ix_users_deleted_at', 'users', 'deleted_at',
+                 where='deleted_at IS NOT NULL')
+    create_index(conn, 'ix_users_search', 'users',
+                 "(setweight(to_tsvector('simple', username), 'A') || "
+                 "setweight(to_tsvector('simple', coalesce(bio, '')), 'B'))",
+                 using='gin', dialect='postgresql')
+    create_index(conn, 'ix_jobs_status_run_at', 'jobs', 'status, run_at')
@@ -0,0 +1,15 @@
+"""Index timeline entries by message.
+
+Deleting a message removes its entries from every follower's timeline
+(TimelineEntry.retract, and the foreign key's cascade); without this each
+delete scanned the whole table.
+"""
+
+from migrate import create_index
+
+CONCURRENT = True
+
+
+def upgrade(conn):
+    create_index(conn, 'ix_timeline_entries_message_id', 'timeline_entries',
+                 'message_id')
@@ -0,0 +1,7 @@
+"""Add the table of per-bucket like counts that trending ranks by."""
+
+from trending import TrendingBucket
+
+
+def upgrade(conn):
+    TrendingBucket.__table__.create(conn, checkfirst=True)
@@ -0,0 +1,67 @@
+"""Key likes by (user_id, message_id), for databases made before it was.
+
+The original likes table had a surrogate `id` key and a unique constraint
+on message_id alone, so a message could only ever be liked by one user
+(create_all in 0001 leaves an existing table as it is). This drops both,
+along with rows that can't be keyed, and makes (user_id, message_id) the
+primary key. SQLite can't change a table's key in place, so there the
+table is rebuilt.
+"""
+
+from sqlalchemy import inspect
+
+from models import Likes
+
+
+def _is_legacy(conn):
+    inspector = inspect(conn)
+    key = inspector.get_pk_constraint('likes')['constrained_columns']
+    return sorted(key) != ['message_id', 'user_id']
+
+
+def upgrade(conn):
+    if not _is_legacy(conn):
+        return
+
+    if conn.dialect.name == 'postgresql':
+        _upgrade_in_place(conn)
+    else:
+        _rebuild(conn)
+
+
+def _upgrade_in_place(conn):
+    inspector = inspect(conn)
+    columns = {column['name'] for column in inspector.get_columns('likes')}
+
+    conn.execute("DELETE FROM likes "
+                 "WHERE user_id IS NULL OR message_id IS NULL")
+    if 'id' in columns:
+        conn.execute("DELETE FROM likes a USING likes b "
+                     "WHERE a.user_id = b.user_id "
+                     "AND a.message_id = b.message_id AND a.id > b.id")
+
+    for constraint in inspector.get_unique_constraints('likes'):
+        conn.execute(f'ALTER TABLE likes DROP CONSTRAINT "{constraint["name"]}"')
+
+    if 'id' in columns:
+        # takes the old primary key with it
+        conn.execute("ALTER TABLE likes DROP COLUMN id")
+    else:
+        key = inspector.get_pk_constraint('likes')['name']
+        if key:
+            conn.execute(f'ALTER TABLE likes DROP CONSTRAINT "{key}"')
+
+    conn.execute("ALTER TABLE likes ADD PRIMARY KEY (user_id, message_id)")
+
+
+def _rebuild(conn):
+    conn.execute("ALTER TABLE likes RENAME TO likes_legacy")
+    # index names are per database, not per table
+    for index in inspect(conn).get_indexes('likes_legacy'):
+        conn.execute(f'DROP INDEX "{index["name"]}"')
+
+    Likes.__table__.create(conn)
+    conn.execute("INSERT INTO likes (user_id, message_id) "
+                 "SELECT DISTINCT user_id, message_id FROM likes_legacy "
+                 "WHERE user_id IS NOT NULL AND message_id IS NOT NULL")
+    conn.execute("DROP TABLE likes_legacy")
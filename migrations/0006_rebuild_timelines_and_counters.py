@@ -0,0 +1,18 @@
+"""Fill in the data that 0001 and 0005 leave behind.
+
+0001 creates timeline_entries empty, and the home page reads only from
+it, so the timelines are built here from the follows and messages
+tables. That only happens if the table is empty: a timeline that's
+already kept up to date needn't be rewritten. The users counters start
+at 0 in 0001, and 0005 may drop likes, so they're recomputed.
+"""
+
+from models import db, TimelineEntry, User
+
+
+def upgrade(conn):
+    if conn.execute(db.select([TimelineEntry.__table__.c.user_id])
+                    .limit(1)).first() is None:
+        TimelineEntry.rebuild(conn)
+
+    User.reconcile_counters(conn)
@@ -0,0 +1,15 @@
+"""Record when each like was made.
+
+Trending takes an unlike off the bucket the like was counted in, which it
+finds from the like's timestamp. Existing likes are left without one (when
+they were made isn't known), so unliking them doesn't touch the buckets.
+"""
+
+from sqlalchemy import inspect
+
+
+def upgrade(conn):
+    # 0005 rebuilds the table from the models on SQLite, column and all
+    existing = {column['name'] for column in inspect(conn).get_columns('likes')}
+    if 'timestamp' not in existing:
+        conn.execute("ALTER TABLE likes ADD COLUMN timestamp TIMESTAMP")
@@ -1,12 +1,20 @@
 """SQLAlchemy models for Warbler."""
 
+from collections import Counter
 from datetime import datetime
 
-from flask_bcrypt import Bcrypt
-from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import DDL, event, func, literal, select, tuple_
+from sqlalchemy.exc import IntegrityError
 
-bcrypt = Bcrypt()
-db = SQLAlchemy()
+from hashing import hasher
+from routing import RoutingSQLAlchemy, router
+
+# reads in GET requests may go to a replica (see routing.py)
+db = RoutingSQLAlchemy()
+
+# How many of a user's recent messages get copied into a new follower's
+# timeline when they start following them.
+TIMELINE_BACKFILL = 100
 
 
 class Follows(db.Model):
@@ -20,34 +28,136 @@ class Follows(db.Model):
         primary_key=True,
     )
 
+    # the primary key covers lookups by followed user; this index covers
+    # "who does X follow" (and counting it)
     user_following_id = db.Column(
         db.Integer,
         db.ForeignKey('users.id', ondelete="cascade"),
         primary_key=True,
+        index=True,
     )
 
+    @classmethod
+    def exists(cls, follower_id, followed_id):
+        """Does `follower_id` follow `followed_id`? (a primary key lookup)"""
+
+        query = cls.query.filter_by(user_being_followed_id=followed_id,
+                                    user_following_id=follower_id)
+        return db.session.query(query.exists()).scalar()
+
+    @classmethod
+    def follow(cls, follower_id, followed_id):
+        """Make `follower_id` follow `followed_id`; a no-op if they already do.
+
+        Returns True if the follow is new (and so the follower's timeline
+        needs a backfill; see jobs.backfill_timeline).
+        """
+
+        if cls.exists(follower_id, followed_id):
+            return False
+
+        try:
+            with db.session.begin_nested():
+                db.session.add(cls(user_being_followed_id=followed_id,
+                                   user_following_id=follower_id))
+        except IntegrityError:
+            # a concurrent request followed first; anything else (a missing
+            # user, a broken key) is a real error
+            if not cls.exists(follower_id, followed_id):
+                raise
+            return False
+
+        return True
+
+    @classmethod
+    def unfollow(cls, follower_id, followed_id):
+        """Make `follower_id` stop following `followed_id`.
+
+        Returns False if they weren't following. The follower's timeline
+        still needs pruning (see jobs.prune_timeline).
+        """
+
+        follow = cls.query.get((followed_id, follower_id))
+        if not follow:
+            return False
+
+        db.session.delete(follow)
+        db.session.flush()
+        return True
+
 
 class Likes(db.Model):
     """Mapping user likes to warbles."""
 
     __tablename__ = 'likes' 
 
-    id = db.Column(
-        db.Integer,
-        primary_key=True
-    )
-
+    # a user likes a message at most once; (user_id, message_id) is the key
     user_id = db.Column(
         db.Integer,
-        db.ForeignKey('users.id', ondelete='cascade')
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
     )
 
     message_id = db.Column(
         db.Integer,
         db.ForeignKey('messages.id', ondelete='cascade'),
-        unique=True
+        primary_key=True,
+        index=True,
     )
 
+    # when it was liked, so an unlike can be taken off the trending bucket
+    # the like was counted in (see trending.py); null for older likes
+    timestamp = db.Column(
+        db.DateTime,
+        default=datetime.utcnow,
+    )
+
+    @classmethod
+    def exists(cls, user_id, message_id):
+        """Does `user_id` like `message_id`? (a primary key lookup)"""
+
+        query = cls.query.filter_by(user_id=user_id, message_id=message_id)
+        return db.session.query(query.exists()).scalar()
+
+    @classmethod
+    def like(cls, user_id, message_id):
+        """Make `user_id` like `message_id`; a no-op if they already do."""
+
+        if cls.query.get((user_id, message_id)):
+            return
+
+        try:
+            with db.session.begin_nested():
+                db.session.add(cls(user_id=user_id, message_id=message_id))
+        except IntegrityError:
+            # a concurrent request liked it first; anything else (a missing
+            # message, a stray unique constraint) is a real error
+            if not cls.exists(user_id, message_id):
+                raise
+
+    @classmethod
+    def unlike(cls, user_id, message_id):
+        """Make `user_id` not like `message_id`; a no-op if they don't."""
+
+        like = cls.query.get((user_id, message_id))
+        if like:
+            db.session.delete(like)
+            db.session.flush()
+
+    @classmethod
+    def toggle(cls, user_id, message_id):
+        """Flip whether `user_id` likes `message_id`.
+
+        Returns True if they like it now.
+        """
+
+        if cls.query.get((user_id, message_id)):
+            cls.unlike(user_id, message_id)
+            return False
+
+        cls.like(user_id, message_id)
+        return True
+
 
 class User(db.Model):
     """User in the system."""
@@ -94,41 +204,175 @@ class User(db.Model):
         nullable=False,
     )
 
-    messages = db.relationship('Message')
+    # Denormalized counts, kept in step with the messages, follows and likes
+    # tables by the mapper events at the bottom of this module. Rebuild them
+    # with `User.reconcile_counters()` after writing to those tables
+    # directly (bulk loads, raw SQL).
+
+    messages_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    following_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    followers_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    likes_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    # When the user last edited their profile; pages showing the user's
+    # name, picture or bio use it as a version for HTTP and fragment caches.
+    profile_updated_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+        server_default=func.now(),
+    )
+
+    # Set when the account is deleted. From then on the user is hidden (see
+    # `active` and `deleted_ids`) while AccountPurge removes their rows in
+    # the background.
+    deleted_at = db.Column(
+        db.DateTime,
+    )
+
+    __table_args__ = (
+        # only accounts still being purged, so it stays tiny
+        db.Index('ix_users_deleted_at', deleted_at,
+                 postgresql_where=deleted_at.isnot(None),
+                 sqlite_where=deleted_at.isnot(None)),
+    )
+
+    # The foreign keys behind these all cascade on delete, so deleting a
+    # user leaves the rows to the database rather than loading them first.
+
+    messages = db.relationship('Message', passive_deletes='all')
 
     followers = db.relationship(
         "User",
         secondary="follows",
         primaryjoin=(Follows.user_being_followed_id == id),
-        secondaryjoin=(Follows.user_following_id == id)
+        secondaryjoin=(Follows.user_following_id == id),
+        passive_deletes=True,
     )
 
     following = db.relationship(
         "User",
         secondary="follows",
         primaryjoin=(Follows.user_following_id == id),
-        secondaryjoin=(Follows.user_being_followed_id == id)
+        secondaryjoin=(Follows.user_being_followed_id == id),
+        passive_deletes=True,
     )
 
     likes = db.relationship(
         'Message',
-        secondary="likes"
+        secondary="likes",
+        passive_deletes=True,
     )
 
     def __repr__(self):
         return f"<User #{self.id}: {self.username}, {self.email}>"
 
+    def timeline(self):
+        """Query for the messages in this user's materialized timeline.
+
+        Unordered; sort (and page) it on TimelineEntry.timestamp and
+        TimelineEntry.message_id, which the timeline index covers.
+        """
+
+        return (Message
+                .query
+                .join(TimelineEntry, TimelineEntry.message_id == Message.id)
+                .filter(TimelineEntry.user_id == self.id)
+                .filter(Message.user_id.notin_(User.deleted_ids())))
+
     def is_followed_by(self, other_user):
         """Is this user followed by `other_user`?"""
 
-        found_user_list = [user for user in self.followers if user == other_user]
-        return len(found_user_list) == 1
+        return Follows.exists(follower_id=other_user.id, followed_id=self.id)
 
     def is_following(self, other_user):
         """Is this user following `other_use`?"""
 
-        found_user_list = [user for user in self.following if user == other_user]
-        return len(found_user_list) == 1
+        return Follows.exists(follower_id=self.id, followed_id=other_user.id)
+
+    def following_ids_among(self, user_ids):
+        """Which of `user_ids` does this user follow?
+
+        Answers for a whole page of users in one query, returning a set of
+        ids, so listings can show Follow/Unfollow buttons without checking
+        each card separately.
+        """
+
+        user_ids = list(user_ids)
+        if not user_ids:
+            return set()
+
+        rows = (db.session
+                .query(Follows.user_being_followed_id)
+                .filter(Follows.user_following_id == self.id,
+                        Follows.user_being_followed_id.in_(user_ids)))
+        return {followed_id for (followed_id,) in rows}
+
+    def liked_ids_among(self, message_ids):
+        """Which of `message_ids` does this user like?
+
+        One primary-key range query for a page of messages, returning a set
+        of ids, so like buttons cost the same however many messages the
+        user has ever liked.
+        """
+
+        message_ids = list(message_ids)
+        if not message_ids:
+            return set()
+
+        rows = (db.session
+                .query(Likes.message_id)
+                .filter(Likes.user_id == self.id,
+                        Likes.message_id.in_(message_ids)))
+        return {message_id for (message_id,) in rows}
+
+    @classmethod
+    def reconcile_counters(cls, connection=None):
+        """Recompute every user's counters from the base tables.
+
+        Runs on `connection` if given (e.g. a migration's), else the
+        session.
+        """
+
+        connection = connection or db.session
+        users = cls.__table__
+
+        def count(table, column):
+            return (select([func.count()])
+                    .select_from(table)
+                    .where(column == users.c.id)
+                    .as_scalar())
+
+        connection.execute(users.update().values(
+            messages_count=count(Message.__table__, Message.user_id),
+            following_count=count(Follows.__table__, Follows.user_following_id),
+            followers_count=count(Follows.__table__,
+                                  Follows.user_being_followed_id),
+            likes_count=count(Likes.__table__, Likes.user_id),
+        ))
 
     @classmethod
     def signup(cls, username, email, password, image_url):
@@ -137,7 +381,7 @@ class User(db.Model):
         Hashes password and adds user to system.
         """
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
+        hashed_pwd = hasher.hash(password)
 
         user = User(
             username=username,
@@ -149,6 +393,21 @@ class User(db.Model):
         db.session.add(user)
         return user
 
+    @classmethod
+    def active(cls):
+        """Query for the users that haven't deleted their account."""
+
+        return cls.query.filter(cls.deleted_at.is_(None))
+
+    @classmethod
+    def deleted_ids(cls):
+        """Subquery of the ids of deleted users whose rows remain.
+
+        Filter with `notin_` to hide their messages, follows and likes.
+        """
+
+        return select([cls.id]).where(cls.deleted_at.isnot(None))
+
     @classmethod
     def authenticate(cls, username, password):
         """Find user with `username` and `password`.
@@ -158,18 +417,66 @@ class User(db.Model):
         and, if it finds such a user, returns that user object.
 
         If can't find matching user (or if password is wrong), returns False.
+
+        If the stored hash was made at an outdated cost, it is replaced with
+        a fresh one; the caller should commit.
         """
 
-        user = cls.query.filter_by(username=username).first()
+        user = cls.active().filter_by(username=username).first()
 
         if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
+            is_auth = hasher.check(user.password, password)
             if is_auth:
+                if hasher.needs_rehash(user.password):
+                    user.password = hasher.hash(password)
                 return user
 
         return False
 
 
+# Full-text search over usernames and bios (see search.py). On Postgres this
+# is a GIN index over USER_SEARCH_VECTOR -- queries must use the exact same
+# expression for the index to apply. On SQLite it is an FTS5 table kept in
+# step with users by triggers.
+
+USER_SEARCH_VECTOR = ("setweight(to_tsvector('simple', username), 'A') || "
+                      "setweight(to_tsvector('simple', coalesce(bio, '')), 'B')")
+
+USERS_FTS_TABLE = 'users_fts'
+
+_user_search_ddl = [
+    DDL(f"CREATE INDEX ix_users_search ON users "
+        f"USING gin (({USER_SEARCH_VECTOR}))"
+        ).execute_if(dialect='postgresql'),
+
+    DDL(f"CREATE VIRTUAL TABLE {USERS_FTS_TABLE} USING fts5("
+        f"username, bio, content='users', content_rowid='id')"
+        ).execute_if(dialect='sqlite'),
+    DDL(f"CREATE TRIGGER users_fts_insert AFTER INSERT ON users BEGIN "
+        f"INSERT INTO {USERS_FTS_TABLE} (rowid, username, bio) "
+        f"VALUES (new.id, new.username, new.bio); END"
+        ).execute_if(dialect='sqlite'),
+    DDL(f"CREATE TRIGGER users_fts_delete AFTER DELETE ON users BEGIN "
+        f"INSERT INTO {USERS_FTS_TABLE} ({USERS_FTS_TABLE}, rowid, username, bio) "
+        f"VALUES ('delete', old.id, old.username, old.bio); END"
+        ).execute_if(dialect='sqlite'),
+    DDL(f"CREATE TRIGGER users_fts_update AFTER UPDATE OF username, bio ON users "
+        f"BEGIN "
+        f"INSERT INTO {USERS_FTS_TABLE} ({USERS_FTS_TABLE}, rowid, username, bio) "
+        f"VALUES ('delete', old.id, old.username, old.bio); "
+        f"INSERT INTO {USERS_FTS_TABLE} (rowid, username, bio) "
+        f"VALUES (new.id, new.username, new.bio); END"
+        ).execute_if(dialect='sqlite'),
+]
+
+for ddl in _user_search_ddl:
+    event.listen(User.__table__, 'after_create', ddl)
+
+event.listen(User.__table__, 'before_drop',
+             DDL(f"DROP TABLE IF EXISTS {USERS_FTS_TABLE}"
+                 ).execute_if(dialect='sqlite'))
+
+
 class Message(db.Model):
     """An individual message ("warble")."""
 
@@ -188,7 +495,7 @@ class Message(db.Model):
     timestamp = db.Column(
         db.DateTime,
         nullable=False,
-        default=datetime.utcnow(),
+        default=datetime.utcnow,
     )
 
     user_id = db.Column(
@@ -199,6 +506,425 @@ class Message(db.Model):
 
     user = db.relationship('User')
 
+    __table_args__ = (
+        # serves a user's profile timeline, newest first, at any page depth
+        db.Index('ix_messages_user_timestamp',
+                 user_id, timestamp.desc(), id.desc()),
+    )
+
+
+class TimelineEntry(db.Model):
+    """A message materialized into a user's home timeline.
+
+    Timelines are built on write: posting a message pushes it to the author
+    and to each of their followers, so the homepage only has to read one
+    user's entries, already sorted by timestamp.
+    """
+
+    __tablename__ = 'timeline_entries'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    # indexed for retracting a deleted message from every timeline
+    message_id = db.Column(
+        db.Integer,
+        db.ForeignKey('messages.id', ondelete='cascade'),
+        primary_key=True,
+        index=True,
+    )
+
+    # copy of the message's timestamp, so the timeline sorts without a join
+    timestamp = db.Column(
+        db.DateTime,
+        nullable=False,
+    )
+
+    __table_args__ = (
+        db.Index('ix_timeline_entries_user_timestamp',
+                 user_id, timestamp.desc(), message_id.desc()),
+    )
+
+    @classmethod
+    def push(cls, user_id, message):
+        """Put `message` on `user_id`'s timeline (e.g. its author's)."""
+
+        db.session.add(cls(user_id=user_id, message_id=message.id,
+                           timestamp=message.timestamp))
+
+    @classmethod
+    def fan_out(cls, message):
+        """Push a message to its author's followers' timelines.
+
+        Safe to repeat: followers who already have it are skipped.
+        """
+
+        already_there = (select([cls.user_id])
+                         .where(cls.message_id == message.id))
+        followers = (select([Follows.user_following_id,
+                             literal(message.id),
+                             literal(message.timestamp)])
+                     .where(Follows.user_being_followed_id == message.user_id)
+                     .where(Follows.user_following_id.notin_(already_there)))
+
+        db.session.execute(
+            cls.__table__.insert().from_select(
+                ['user_id', 'message_id', 'timestamp'], followers))
+
+    @classmethod
+    def backfill(cls, user_id, followed_id, limit=TIMELINE_BACKFILL):
+        """Copy recent messages of `followed_id` into `user_id`'s timeline."""
+
+        already_there = (select([cls.message_id])
+                         .where(cls.user_id == user_id))
+        recent = (select([literal(user_id), Message.id, Message.timestamp])
+                  .where(Message.user_id == followed_id)
+                  .where(Message.id.notin_(already_there))
+                  .order_by(Message.timestamp.desc())
+                  .limit(limit))
+
+        db.session.execute(
+            cls.__table__.insert().from_select(
+                ['user_id', 'message_id', 'timestamp'], recent))
+
+    @classmethod
+    def prune(cls, user_id, followed_id):
+        """Remove messages of `followed_id` from `user_id`'s timeline."""
+
+        followed_messages = (select([Message.id])
+                             .where(Message.user_id == followed_id))
+
+        (cls.query
+         .filter(cls.user_id == user_id,
+                 cls.message_id.in_(followed_messages))
+         .delete(synchronize_session=False))
+
+    @classmethod
+    def retract(cls, message_id):
+        """Remove a message from every timeline it was pushed to."""
+
+        (cls.query
+         .filter(cls.message_id == message_id)
+         .delete(synchronize_session=False))
+
+    @classmethod
+    def rebuild(cls, connection=None):
+        """Rebuild every timeline from the messages and follows tables.
+
+        Used after bulk loads (see seed.py) and schema upgrades that bypass
+        the normal write path. Runs on `connection` if given (e.g. a
+        migration's), else the session.
+        """
+
+        connection = connection or db.session
+
+        followed = (select([Follows.user_following_id,
+                            Message.id,
+                            Message.timestamp])
+                    .select_from(Follows.__table__.join(
+                        Message.__table__,
+                        Message.user_id == Follows.user_being_followed_id)))
+        own = select([Message.user_id, Message.id, Message.timestamp])
+
+        connection.execute(cls.__table__.delete())
+        connection.execute(
+            cls.__table__.insert().from_select(
+                ['user_id', 'message_id', 'timestamp'],
+                followed.union_all(own)))
+
+
+##############################################################################
+# Counter maintenance
+#
+# These run inside the flush that writes the row, so the counters commit (or
+# roll back) in the same transaction as the change they count.
+
+
+def _bump_counters(connection, user_ids, **deltas):
+    """Add `deltas` (column name -> amount) to the counters of `user_ids`.
+
+    `user_ids` may be a single id or a subquery of ids.
+    """
+
+    users = User.__table__
+    if isinstance(user_ids, int):
+        condition = users.c.id == user_ids
+    else:
+        condition = users.c.id.in_(user_ids)
+
+    connection.execute(users.update().where(condition).values({
+        users.c[column]: users.c[column] + delta
+        for column, delta in deltas.items()
+    }))
+
+
+@event.listens_for(Message, 'after_insert')
+def _count_new_message(mapper, connection, message):
+    _bump_counters(connection, message.user_id, messages_count=1)
+
+
+@event.listens_for(Message, 'before_delete')
+def _count_deleted_message(mapper, connection, message):
+    # the database cascades the message's likes away; uncount them first
+    likers = select([Likes.user_id]).where(Likes.message_id == message.id)
+    _bump_counters(connection, likers, likes_count=-1)
+    _bump_counters(connection, message.user_id, messages_count=-1)
+
+
+@event.listens_for(Follows, 'after_insert')
+def _count_new_follow(mapper, connection, follow):
+    _bump_counters(connection, follow.user_following_id, following_count=1)
+    _bump_counters(connection, follow.user_being_followed_id,
+                   followers_count=1)
+
+
+@event.listens_for(Follows, 'after_delete')
+def _count_deleted_follow(mapper, connection, follow):
+    _bump_counters(connection, follow.user_following_id, following_count=-1)
+    _bump_counters(connection, follow.user_being_followed_id,
+                   followers_count=-1)
+
+
+@event.listens_for(Likes, 'after_insert')
+def _count_new_like(mapper, connection, like):
+    _bump_counters(connection, like.user_id, likes_count=1)
+
+
+@event.listens_for(Likes, 'after_delete')
+def _count_deleted_like(mapper, connection, like):
+    _bump_counters(connection, like.user_id, likes_count=-1)
+
+
+@event.listens_for(User, 'before_delete')
+def _count_deleted_user(mapper, connection, user):
+    # the user's follows, likes and messages all go with them
+    followed = (select([Follows.user_being_followed_id])
+                .where(Follows.user_following_id == user.id))
+    followers = (select([Follows.user_following_id])
+                 .where(Follows.user_being_followed_id == user.id))
+    _bump_counters(connection, followed, followers_count=-1)
+    _bump_counters(connection, followers, following_count=-1)
+
+    users = User.__table__
+    likes_of_their_messages = (select([Likes.user_id])
+                               .select_from(Likes.__table__
+                                            .join(Message.__table__))
+                               .where(Message.user_id == user.id))
+    likes_lost = (likes_of_their_messages
+                  .with_only_columns([func.count()])
+                  .where(Likes.user_id == users.c.id)
+                  .as_scalar())
+    connection.execute(users.update()
+                       .where(users.c.id.in_(likes_of_their_messages))
+                       .values(likes_count=users.c.likes_count - likes_lost))
+
+
+##############################################################################
+# Account deletion
+#
+# Deleting an account only sets users.deleted_at, which hides the user at
+# once. AccountPurge then removes their rows a batch at a time, each batch
+# one short transaction of set-based statements that also fixes the other
+# users' counters -- rather than one long delete that locks everything the
+# user ever touched.
+
+PURGE_BATCH = 1000
+
+
+def _purge_likes_given(user_id, limit):
+    message_ids = [id for id, in db.session.execute(
+        select([Likes.message_id]).where(Likes.user_id == user_id).limit(limit))]
+    if not message_ids:
+        return 0
+
+    db.session.execute(Likes.__table__.delete().where(
+        (Likes.user_id == user_id) & Likes.message_id.in_(message_ids)))
+    return len(message_ids)
+
+
+def _purge_likes_received(user_id, limit):
+    keys = db.session.execute(
+        select([Likes.user_id, Likes.message_id])
+        .select_from(Likes.__table__.join(Message.__table__))
+        .where(Message.user_id == user_id)
+        .limit(limit)).fetchall()
+    if not keys:
+        return 0
+
+    # a liker may have liked several of the messages in this batch
+    lost = Counter(liker_id for liker_id, _ in keys)
+    connection = db.session.connection()
+    for count in set(lost.values()):
+        _bump_counters(connection,
+                       [id for id, n in lost.items() if n == count],
+                       likes_count=-count)
+
+    db.session.execute(Likes.__table__.delete().where(
+        tuple_(Likes.user_id, Likes.message_id).in_([tuple(key) for key in keys])))
+    return len(keys)
+
+
+def _purge_following(user_id, limit):
+    followed_ids = [id for id, in db.session.execute(
+        select([Follows.user_being_followed_id])
+        .where(Follows.user_following_id == user_id)
+        .limit(limit))]
+    if not followed_ids:
+        return 0
+
+    _bump_counters(db.session.connection(), followed_ids, followers_count=-1)
+    db.session.execute(Follows.__table__.delete().where(
+        (Follows.user_following_id == user_id)
+        & Follows.user_being_followed_id.in_(followed_ids)))
+    return len(followed_ids)
+
+
+def _purge_followers(user_id, limit):
+    follower_ids = [id for id, in db.session.execute(
+        select([Follows.user_following_id])
+        .where(Follows.user_being_followed_id == user_id)
+        .limit(limit))]
+    if not follower_ids:
+        return 0
+
+    _bump_counters(db.session.connection(), follower_ids, following_count=-1)
+    db.session.execute(Follows.__table__.delete().where(
+        (Follows.user_being_followed_id == user_id)
+        & Follows.user_following_id.in_(follower_ids)))
+    return len(follower_ids)
+
+
+def _purge_timeline(user_id, limit):
+    message_ids = [id for id, in db.session.execute(
+        select([TimelineEntry.message_id])
+        .where(TimelineEntry.user_id == user_id)
+        .limit(limit))]
+    if not message_ids:
+        return 0
+
+    db.session.execute(TimelineEntry.__table__.delete().where(
+        (TimelineEntry.user_id == user_id)
+        & TimelineEntry.message_id.in_(message_ids)))
+    return len(message_ids)
+
+
+def _purge_fanned_out(user_id, limit):
+    keys = db.session.execute(
+        select([TimelineEntry.user_id, TimelineEntry.message_id])
+        .select_from(TimelineEntry.__table__.join(Message.__table__))
+        .where(Message.user_id == user_id)
+        .limit(limit)).fetchall()
+    if not keys:
+        return 0
+
+    db.session.execute(TimelineEntry.__table__.delete().where(
+        tuple_(TimelineEntry.user_id, TimelineEntry.message_id)
+        .in_([tuple(key) for key in keys])))
+    return len(keys)
+
+
+def _purge_messages(user_id, limit):
+    message_ids = [id for id, in db.session.execute(
+        select([Message.id]).where(Message.user_id == user_id).limit(limit))]
+    if not message_ids:
+        return 0
+
+    db.session.execute(Message.__table__.delete().where(
+        Message.id.in_(message_ids)))
+    return len(message_ids)
+
+
+def _purge_user(user_id, limit):
+    return db.session.execute(User.__table__.delete().where(
+        User.id == user_id)).rowcount
+
+
+# (step, function deleting up to `limit` rows and returning how many), in
+# order: likes and follows first, so counters are fixed before the user's
+# messages go and nothing is left for the cascades to do
+PURGE_STEPS = [
+    ('likes_given', _purge_likes_given),
+    ('likes_received', _purge_likes_received),
+    ('following', _purge_following),
+    ('followers', _purge_followers),
+    ('timeline', _purge_timeline),
+    ('fanned_out', _purge_fanned_out),
+    ('messages', _purge_messages),
+    ('user', _purge_user),
+]
+
+
+class AccountPurge(db.Model):
+    """Progress of removing a deleted account's rows."""
+
+    __tablename__ = 'account_purges'
+
+    # no foreign key: the record outlives the user
+    user_id = db.Column(
+        db.Integer,
+        primary_key=True,
+        autoincrement=False,
+    )
+
+    # the step in PURGE_STEPS being worked on; None once finished
+    step = db.Column(
+        db.Text,
+        default=PURGE_STEPS[0][0],
+    )
+
+    rows_deleted = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+    )
+
+    started_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+    )
+
+    finished_at = db.Column(
+        db.DateTime,
+    )
+
+    def __repr__(self):
+        return f"<AccountPurge #{self.user_id}: {self.step}, {self.rows_deleted} rows>"
+
+    @classmethod
+    def start(cls, user):
+        """Delete `user`'s account: hide them now, purge their rows later."""
+
+        user.deleted_at = datetime.utcnow()
+        purge = cls(user_id=user.id)
+        db.session.add(purge)
+        return purge
+
+    def run_batch(self, limit=PURGE_BATCH):
+        """Delete up to `limit` more of the user's rows.
+
+        Returns False once there's nothing left. The caller commits, which
+        ends the batch.
+        """
+
+        steps = dict(PURGE_STEPS)
+        names = [name for name, _ in PURGE_STEPS]
+
+        while self.step is not None:
+            deleted = steps[self.step](self.user_id, limit)
+            if deleted:
+                self.rows_deleted += deleted
+                return True
+
+            following = names.index(self.step) + 1
+            self.step = names[following] if following < len(names) else None
+
+        self.finished_at = datetime.utcnow()
+        return False
+
 
 def connect_db(app):
     """Connect this database to provided Flask app.
@@ -206,5 +932,7 @@ def connect_db(app):
     You should call this in your Flask app.
     """
 
+    router.init_app(app)
     db.app = app
     db.init_app(app)
+    hasher.init_app(app)
@@ -0,0 +1,83 @@
+"""Followers you know: who among the people you follow also follows a user.
+
+Profiles show "Followed by X, Y and 12 others you follow". That's one
+indexed join: the viewer's follows (by the user_following_id index), each
+checked against the profile's followers (by the primary key), so neither
+side is loaded in full. The total comes back with the first few names
+through a window count.
+
+Results are cached per (viewer, user) pair, keyed on the viewer's
+following count and the user's followers count so a follow or unfollow
+by either of them misses the cache; anything subtler (one of the viewer's
+follows changing theirs) shows up when the entry expires.
+
+Settings (read by `init_mutual`):
+
+- MUTUAL_CACHE_SIZE: most pairs kept (default 10000).
+- MUTUAL_CACHE_TTL: seconds a pair is kept (default 60).
+"""
+
+from collections import namedtuple
+
+from sqlalchemy import bindparam
+
+from cache import LRUCache
+from models import db, Follows, User
+
+MutualFollowers = namedtuple('MutualFollowers', 'count users')
+
+NONE = MutualFollowers(0, [])
+
+# built once: this runs on every profile view, and building the statement
+# costs more than running it
+_users = User.__table__
+_viewer_follows = Follows.__table__.alias('viewer_follows')
+_user_followers = Follows.__table__.alias('user_followers')
+
+MUTUAL_QUERY = (
+    db.select([_users.c.id, _users.c.username, db.func.count().over()])
+    .select_from(
+        _users
+        .join(_viewer_follows,
+              _viewer_follows.c.user_being_followed_id == _users.c.id)
+        .join(_user_followers,
+              _user_followers.c.user_following_id == _users.c.id))
+    .where(db.and_(
+        _viewer_follows.c.user_following_id == bindparam('viewer_id'),
+        _user_followers.c.user_being_followed_id == bindparam('user_id'),
+        _users.c.deleted_at.is_(None)))
+    .order_by(_users.c.followers_count.desc(), _users.c.id)
+    .limit(bindparam('limit')))
+
+# (viewer id, user id, limit) -> (counts when computed, MutualFollowers)
+mutual_followers = LRUCache(maxsize=10000, ttl=60)
+
+
+def init_mutual(app):
+    """Size the cache from the app's config."""
+
+    mutual_followers.maxsize = app.config.setdefault('MUTUAL_CACHE_SIZE', 10000)
+    mutual_followers.ttl = app.config.setdefault('MUTUAL_CACHE_TTL', 60)
+
+
+def followers_you_know(viewer, user, limit=3):
+    """The people `viewer` follows who follow `user`: their count, and the
+    first `limit` of them (most followed first) as (id, username) rows.
+    """
+
+    if viewer is None or viewer.id == user.id:
+        return NONE
+
+    version = (viewer.following_count, user.followers_count)
+    key = (viewer.id, user.id, limit)
+    cached = mutual_followers.get(key)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    rows = db.session.execute(MUTUAL_QUERY, {
+        'viewer_id': viewer.id, 'user_id': user.id, 'limit': limit}).fetchall()
+
+    mutual = MutualFollowers(rows[0][2] if rows else 0,
+                             [(id, username) for id, username, _ in rows])
+    mutual_followers.set(key, (version, mutual))
+    return mutual
@@ -0,0 +1,158 @@
+"""Keyset (cursor) pagination for Warbler listings.
+
+Message timelines are keyed on (timestamp, id), newest first; user lists
+on id. A cursor names the last row a client has seen, so fetching the next
+page is an index range scan no matter how deep it is -- unlike OFFSET,
+which reads and throws away every row before the page.
+"""
+
+from datetime import datetime
+from operator import attrgetter
+
+from flask import abort, current_app, request
+from sqlalchemy import tuple_
+
+CURSOR_TIME_FORMAT = '%Y%m%d%H%M%S%f'
+
+
+class Page:
+    """One page of rows plus the cursors to its neighbours.
+
+    `older` is the cursor to pass as ?before= for the next (older) page,
+    `newer` the one to pass as ?after= for the previous (newer) page. Either
+    is None when there is nothing in that direction.
+    """
+
+    def __init__(self, items, older=None, newer=None):
+        self.items = items
+        self.older = older
+        self.newer = newer
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def encode_cursor(timestamp, id):
+    """Turn a (timestamp, id) key into an opaque, URL-safe cursor."""
+
+    return f"{timestamp.strftime(CURSOR_TIME_FORMAT)}-{id}"
+
+
+def decode_cursor(cursor):
+    """Turn a cursor back into its (timestamp, id) key.
+
+    Raises ValueError if the cursor is malformed.
+    """
+
+    timestamp, id = cursor.split('-')
+    return datetime.strptime(timestamp, CURSOR_TIME_FORMAT), int(id)
+
+
+def paginate(query, timestamp_col, id_col, per_page,
+             before=None, after=None, key=attrgetter('timestamp', 'id')):
+    """Fetch one newest-first page of `query`.
+
+    `before`/`after` are cursors (as produced by `encode_cursor`); at most
+    one should be given. `key` pulls the (timestamp, id) pair out of a
+    result row.
+    """
+
+    if after:
+        rows = (query
+                .filter(tuple_(timestamp_col, id_col) > decode_cursor(after))
+                .order_by(timestamp_col.asc(), id_col.asc())
+                .limit(per_page + 1)
+                .all())
+        has_more = len(rows) > per_page
+        rows = rows[:per_page][::-1]
+        return _page(rows, key, older=bool(rows), newer=has_more)
+
+    if before:
+        query = query.filter(
+            tuple_(timestamp_col, id_col) < decode_cursor(before))
+
+    rows = (query
+            .order_by(timestamp_col.desc(), id_col.desc())
+            .limit(per_page + 1)
+            .all())
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    return _page(rows, key, older=has_more, newer=bool(before and rows))
+
+
+def paginate_messages(query, timestamp_col, id_col,
+                      key=attrgetter('timestamp', 'id')):
+    """Page through `query` using the request's ?before=/?after=/?limit=.
+
+    Responds with a 400 if a cursor is malformed.
+    """
+
+    config = current_app.config
+    per_page = request.args.get('limit', config['MESSAGES_PER_PAGE'], type=int)
+    per_page = max(1, min(per_page, config['MAX_MESSAGES_PER_PAGE']))
+
+    try:
+        return paginate(query, timestamp_col, id_col, per_page,
+                        before=request.args.get('before'),
+                        after=request.args.get('after'), key=key)
+    except ValueError:
+        abort(400)
+
+
+def _page(rows, key, older, newer):
+    """Build a Page, with cursors pointing past its first and last rows."""
+
+    return Page(
+        rows,
+        older=encode_cursor(*key(rows[-1])) if older else None,
+        newer=encode_cursor(*key(rows[0])) if newer else None,
+    )
+
+
+class IdPage:
+    """One page of rows in ascending id order, fetched on first use.
+
+    `next` is the cursor (an id) to pass as ?after= for the following page,
+    or None on the last page. Nothing is queried until the page is first
+    iterated, so a streamed template can send the top of the page first.
+    """
+
+    def __init__(self, query, id_col, per_page, after=None):
+        self.query = query
+        self.id_col = id_col
+        self.per_page = per_page
+        self.after = after
+        self._items = None
+        self._next = None
+
+    def _fetch(self):
+        if self._items is not None:
+            return
+
+        query = self.query
+        if self.after is not None:
+            query = query.filter(self.id_col > self.after)
+
+        rows = query.order_by(self.id_col).limit(self.per_page + 1).all()
+        self._items = rows[:self.per_page]
+        if len(rows) > self.per_page:
+            self._next = self._items[-1].id
+
+    @property
+    def items(self):
+        self._fetch()
+        return self._items
+
+    @property
+    def next(self):
+        self._fetch()
+        return self._next
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
@@ -0,0 +1,188 @@
+"""Read/write splitting for Warbler's database session.
+
+GET and HEAD requests read from a replica; everything else -- other
+requests, jobs, the CLI -- and every write goes to the primary. Within a
+request, reads go back to the primary once the session has written, so a
+transaction always sees its own changes.
+
+Replicas trail the primary, so a user who has just changed something would
+otherwise not see it on the page they're redirected to. After a request
+writes, the user's session is stamped, and their reads stay on the primary
+for REPLICA_STICKY_SECONDS.
+
+Each replica is checked at most every REPLICA_CHECK_SECONDS: if it can't be
+reached, or it's more than REPLICA_MAX_LAG seconds behind, reads fall back
+to the primary until the next check.
+
+Settings (read by `init_app`):
+
+- DATABASE_REPLICA_URLS (environment): comma-separated replica URLs, added
+  to SQLALCHEMY_BINDS as replica0, replica1, ...
+- DATABASE_REPLICAS: bind keys of the replicas to read from (default: the
+  ones from DATABASE_REPLICA_URLS; none means everything uses the primary).
+- REPLICA_STICKY_SECONDS: how long after a write a user reads from the
+  primary (default 5).
+- REPLICA_MAX_LAG: seconds of lag before a replica is skipped (default 5).
+- REPLICA_CHECK_SECONDS: how often a replica's health is checked
+  (default 2).
+- REPLICA_LAG_QUERY: SQL returning a replica's lag in seconds. The default
+  asks Postgres how far replay is behind (0 for a server that isn't a
+  standby); on other databases replicas are only checked for being up.
+
+To try it locally, point DATABASE_REPLICA_URLS at a second database (or a
+second Postgres server replicating from the first).
+"""
+
+import os
+import time
+from random import shuffle
+from threading import Lock
+
+from flask import g, has_request_context, request, session
+from flask_sqlalchemy import SignallingSession, SQLAlchemy
+from sqlalchemy import orm, text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.sql.expression import CompoundSelect, Select, UpdateBase
+
+READ_METHODS = {'GET', 'HEAD'}
+
+# session key holding the time of the user's last write
+WROTE_AT_KEY = '_db_wrote_at'
+
+POSTGRES_LAG_QUERY = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery()
+            OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM
+                              now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+
+class ReplicaRouter:
+    """Picks the engine each read in a request should use."""
+
+    def __init__(self):
+        self.app = None
+        # bind key -> (time checked, usable?)
+        self.health = {}
+        self.lock = Lock()
+
+    def init_app(self, app):
+        self.app = app
+
+        urls = [url for url in
+                os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url]
+        binds = app.config.setdefault('SQLALCHEMY_BINDS', {}) or {}
+        keys = []
+        for n, url in enumerate(urls):
+            binds[f'replica{n}'] = url
+            keys.append(f'replica{n}')
+        app.config['SQLALCHEMY_BINDS'] = binds
+
+        app.config.setdefault('DATABASE_REPLICAS', keys)
+        app.config.setdefault('REPLICA_STICKY_SECONDS', 5)
+        app.config.setdefault('REPLICA_MAX_LAG', 5)
+        app.config.setdefault('REPLICA_CHECK_SECONDS', 2)
+        app.config.setdefault('REPLICA_LAG_QUERY', None)
+
+        app.after_request(self.stamp_writes)
+
+    def replica(self):
+        """The engine to read from, or None for the primary."""
+
+        if not (has_request_context() and self.app.config['DATABASE_REPLICAS']):
+            return None
+
+        if 'db_replica' not in g:
+            g.db_replica = self._choose() if self._may_read_replica() else None
+        return g.db_replica
+
+    def wrote(self):
+        """Note that this request wrote: read from the primary from now on."""
+
+        if has_request_context():
+            g.db_wrote = True
+            g.db_replica = None
+
+    def _may_read_replica(self):
+        if request.method not in READ_METHODS or g.get('db_wrote'):
+            return False
+
+        wrote_at = session.get(WROTE_AT_KEY)
+        sticky = self.app.config['REPLICA_STICKY_SECONDS']
+        return wrote_at is None or time.time() - wrote_at >= sticky
+
+    def _choose(self):
+        keys = list(self.app.config['DATABASE_REPLICAS'])
+        shuffle(keys)
+
+        db = self.app.extensions['sqlalchemy'].db
+        for key in keys:
+            engine = db.get_engine(self.app, bind=key)
+            if self._usable(key, engine):
+                return engine
+        return None
+
+    def _usable(self, key, engine):
+        now = time.monotonic()
+        checked_at, usable = self.health.get(key, (None, False))
+        interval = self.app.config['REPLICA_CHECK_SECONDS']
+        if checked_at is not None and now - checked_at < interval:
+            return usable
+
+        with self.lock:
+            usable = self._check(engine)
+            self.health[key] = (now, usable)
+        return usable
+
+    def _check(self, engine):
+        query = self.app.config['REPLICA_LAG_QUERY']
+        if query is None:
+            query = (POSTGRES_LAG_QUERY if engine.dialect.name == 'postgresql'
+                     else 'SELECT 0')
+
+        try:
+            with engine.connect() as connection:
+                lag = connection.execute(text(query)).scalar()
+        except DBAPIError:
+            return False
+
+        return float(lag or 0) <= self.app.config['REPLICA_MAX_LAG']
+
+    def stamp_writes(self, response):
+        if g.get('db_wrote'):
+            session[WROTE_AT_KEY] = time.time()
+        return response
+
+
+router = ReplicaRouter()
+
+
+def _replica_safe(clause):
+    """Could `clause` run on a replica? Only plain SELECTs can."""
+
+    # DML, raw SQL (which could be anything) and bare connections can't
+    return (isinstance(clause, (Select, CompoundSelect))
+            and clause._for_update_arg is None)
+
+
+class RoutingSession(SignallingSession):
+    """A session sending reads to a replica when the router allows it."""
+
+    def get_bind(self, mapper=None, clause=None):
+        if self._flushing or isinstance(clause, UpdateBase):
+            router.wrote()
+        elif _replica_safe(clause):
+            replica = router.replica()
+            if replica is not None:
+                return replica
+
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """Flask-SQLAlchemy, with a RoutingSession."""
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
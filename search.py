@@ -0,0 +1,161 @@
+"""User search for Warbler.
+
+Two pieces:
+
+- `search_users()` does ranked full-text search over usernames and bios,
+  backed by a GIN index on Postgres and an FTS5 table on SQLite (both
+  declared in models.py).
+
+- `usernames` is an in-memory, sorted index of usernames that answers
+  prefix lookups for the autocomplete endpoint without touching the
+  database.
+"""
+
+import re
+from bisect import bisect_left
+from threading import Lock
+from time import monotonic
+
+from sqlalchemy import column, func, literal_column, table
+
+from models import db, User, USERS_FTS_TABLE, USER_SEARCH_VECTOR
+
+
+def _terms(q):
+    """Split a search string into lowercase word terms."""
+
+    return re.findall(r'\w+', q.lower())
+
+
+def search_users(q, page=1, per_page=30):
+    """Users whose username or bio match `q`, best matches first.
+
+    Every word in `q` must match the start of a word in the username or
+    bio. Returns (users, has_more).
+    """
+
+    terms = _terms(q)
+    if not terms:
+        return [], False
+
+    dialect = db.engine.dialect.name
+
+    if dialect == 'postgresql':
+        vector = literal_column(USER_SEARCH_VECTOR)
+        tsquery = func.to_tsquery(
+            'simple', ' & '.join(f"{term}:*" for term in terms))
+        query = (User
+                 .query
+                 .filter(vector.op('@@')(tsquery))
+                 .order_by(func.ts_rank(vector, tsquery).desc(), User.id))
+
+    elif dialect == 'sqlite':
+        fts = table(USERS_FTS_TABLE, column('rowid'))
+        match = ' '.join(f'"{term}"*' for term in terms)
+        query = (User
+                 .query
+                 .join(fts, fts.c.rowid == User.id)
+                 .filter(literal_column(USERS_FTS_TABLE).op('MATCH')(match))
+                 # bm25 scores are lower for better matches; usernames
+                 # count for more than bios
+                 .order_by(func.bm25(literal_column(USERS_FTS_TABLE),
+                                     10.0, 1.0),
+                           User.id))
+
+    else:
+        query = User.query
+        for term in terms:
+            query = query.filter(User.username.ilike(f"%{term}%"))
+        query = query.order_by(User.username)
+
+    query = query.filter(User.deleted_at.is_(None))
+    users = query.offset((page - 1) * per_page).limit(per_page + 1).all()
+    return users[:per_page], len(users) > per_page
+
+
+class UsernameIndex:
+    """Sorted, in-memory usernames for prefix lookups.
+
+    Loaded from the database on first use and reloaded every
+    `reload_after` seconds, so changes made by other processes show up
+    eventually; changes made in this process are applied straight away
+    through `add` and `remove`.
+    """
+
+    def __init__(self, reload_after=300):
+        self.reload_after = reload_after
+        self.lock = Lock()
+        self.loaded_at = None
+        # parallel lists, sorted by key: (lowercased username, id)
+        self.keys = []
+        self.usernames = []
+
+    def load(self):
+        """(Re)build the index from the users table."""
+
+        rows = sorted((username.lower(), id, username)
+                      for id, username
+                      in db.session.query(User.id, User.username)
+                      .filter(User.deleted_at.is_(None)))
+
+        with self.lock:
+            self.keys = [(key, id) for key, id, _ in rows]
+            self.usernames = [username for _, _, username in rows]
+            self.loaded_at = monotonic()
+
+    def _ensure_loaded(self):
+        if (self.loaded_at is None
+                or monotonic() - self.loaded_at > self.reload_after):
+            self.load()
+
+    def add(self, id, username):
+        """Add (or re-add) a user to the index."""
+
+        if self.loaded_at is None:
+            return
+
+        key = (username.lower(), id)
+        with self.lock:
+            i = bisect_left(self.keys, key)
+            if i < len(self.keys) and self.keys[i] == key:
+                self.usernames[i] = username
+                return
+            self.keys.insert(i, key)
+            self.usernames.insert(i, username)
+
+    def remove(self, id, username):
+        """Take a user out of the index."""
+
+        if self.loaded_at is None:
+            return
+
+        key = (username.lower(), id)
+        with self.lock:
+            i = bisect_left(self.keys, key)
+            if i < len(self.keys) and self.keys[i] == key:
+                del self.keys[i]
+                del self.usernames[i]
+
+    def complete(self, prefix, limit=10):
+        """Up to `limit` (id, username) pairs whose username starts with
+        `prefix` (case-insensitively), in alphabetical order.
+        """
+
+        prefix = prefix.lower()
+        if not prefix:
+            return []
+
+        self._ensure_loaded()
+
+        with self.lock:
+            i = bisect_left(self.keys, (prefix,))
+            matches = []
+            while (i < len(self.keys) and len(matches) < limit
+                   and self.keys[i][0].startswith(prefix)):
+                matches.append((self.keys[i][1], self.usernames[i]))
+                i += 1
+
+        return matches
+
+
+usernames = UsernameIndex()
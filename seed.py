@@ -1,20 +1,280 @@
-"""Seed database with sample data from CSV Files."""
+"""Seed database with sample data from CSV Files.
 
-from csv import DictReader
+Streams each CSV into its table a chunk at a time, so it copes with tens
+of millions of rows:
+
+- chunks are parsed on a pool of worker processes while the main process
+  loads the previous ones, with COPY FROM STDIN on PostgreSQL and an
+  executemany INSERT elsewhere;
+- every chunk commits together with a progress row, so `--resume` picks up
+  after the last committed chunk of an interrupted load;
+- secondary indexes are dropped for the load and rebuilt once at the end,
+  followed by the timelines and counters (see TimelineEntry.rebuild and
+  User.reconcile_counters).
+
+Rows get their ids from their line number in the CSV (users.csv line 1 is
+user 1, ...), which is what messages.csv and follows.csv refer to, and
+what makes a resumed load line up. CSVs must hold one record per line, as
+the generator writes them.
+
+    python seed.py                  # fresh load from generator/
+    python seed.py --resume         # carry on after an interruption
+"""
+
+import argparse
+import csv
+import io
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from itertools import islice
+
+from sqlalchemy import BigInteger, Column, DDL, DateTime, Integer, MetaData, Table, Text, inspect
+
+import migrate
 from app import db
-from models import User, Message, Follows
+from models import User, Message, Follows, Likes, TimelineEntry, USER_SEARCH_VECTOR
+
+# (CSV file, model), in load order; the CSVs' columns are the model's,
+# less the ids seed.py assigns. Missing files are skipped.
+SOURCES = [
+    ('users.csv', User),
+    ('messages.csv', Message),
+    ('follows.csv', Follows),
+    ('likes.csv', Likes),
+]
+
+progress = Table(
+    'seed_progress', MetaData(),
+    Column('table_name', Text, primary_key=True),
+    Column('rows_loaded', BigInteger, nullable=False),
+)
+
+# built by models.py's DDL events rather than declared on a table
+SEARCH_INDEX = 'ix_users_search'
+
+
+##############################################################################
+# Parsing (runs in the worker processes)
+
+def _convert(value, kind):
+    if value == '':
+        return None
+    if kind == 'int':
+        return int(value)
+    if kind == 'datetime':
+        return datetime.fromisoformat(value)
+    return value
+
+
+def parse_chunk(lines, first_id, kinds, as_copy):
+    """Parse a chunk of CSV lines, numbering rows from `first_id`.
+
+    Returns CSV text ready for COPY if `as_copy`, otherwise a list of
+    parameter tuples converted per `kinds` (None for tables without a
+    surrogate id).
+    """
+
+    rows = csv.reader(lines)
+
+    if first_id is not None:
+        rows = ([id] + row for id, row in enumerate(rows, first_id))
+
+    if as_copy:
+        out = io.StringIO()
+        csv.writer(out, lineterminator='\n').writerows(rows)
+        return out.getvalue()
+
+    return [tuple(_convert(value, kind) for value, kind in zip(row, kinds))
+            for row in rows]
+
+
+##############################################################################
+# Loading
+
+class Loader:
+    """Loads the CSVs in `directory` into the database."""
+
+    def __init__(self, directory, chunk_size, workers):
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self.engine = db.engine
+        self.use_copy = self.engine.dialect.name == 'postgresql'
+
+    def run(self, resume):
+        started = time.monotonic()
+
+        if not resume:
+            progress.drop(self.engine, checkfirst=True)
+            db.drop_all()
+            db.create_all()
+            # create_all made the current schema; no migrations to run
+            migrate.stamp(self.engine)
+
+        progress.create(self.engine, checkfirst=True)
+        self.drop_indexes()
+
+        total = 0
+        with ProcessPoolExecutor(self.workers) as pool:
+            for filename, model in SOURCES:
+                path = os.path.join(self.directory, filename)
+                if os.path.exists(path):
+                    total += self.load(pool, path, model.__table__)
+
+        print("Rebuilding indexes...")
+        self.create_indexes()
+        print("Rebuilding timelines and counters...")
+        TimelineEntry.rebuild()
+        User.reconcile_counters()
+        db.session.commit()
+
+        elapsed = time.monotonic() - started
+        print(f"Loaded {total:,} rows in {elapsed:.1f}s "
+              f"({total / elapsed:,.0f} rows/s overall)")
+
+    def load(self, pool, path, table):
+        """Stream one CSV into `table`; returns the number of rows loaded."""
+
+        with open(path, newline='') as f:
+            header = next(csv.reader([f.readline()]))
+            has_id = 'id' in table.c and 'id' not in header
+            columns = (['id'] if has_id else []) + header
+            kinds = [_kind(table.c[name]) for name in columns]
+
+            done = self.rows_loaded(table.name)
+            for _ in islice(f, done):
+                pass
+
+            def chunks():
+                first = done + 1
+                while True:
+                    lines = list(islice(f, self.chunk_size))
+                    if not lines:
+                        return
+                    yield (lines, first if has_id else None, kinds,
+                           self.use_copy)
+                    first += len(lines)
+
+            print(f"{table.name}: loading from row {done + 1:,}")
+            loaded, started = 0, time.monotonic()
+
+            for rows in _ordered(pool, chunks(), self.workers * 2):
+                count = self.insert(table, columns, rows, done + loaded)
+                loaded += count
+
+                rate = loaded / (time.monotonic() - started)
+                print(f"{table.name}: {done + loaded:,} rows "
+                      f"({rate:,.0f} rows/s)", flush=True)
+
+        if has_id and self.use_copy:
+            # ids were given explicitly, so move the sequence past them
+            with self.engine.begin() as conn:
+                conn.execute(
+                    f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), "
+                    f"coalesce((SELECT max(id) FROM {table.name}), 0) + 1, false)")
+
+        return loaded
+
+    def insert(self, table, columns, rows, done):
+        """Insert one parsed chunk and record it, in one transaction."""
+
+        with self.engine.begin() as conn:
+            if self.use_copy:
+                count = rows.count('\n')
+                cursor = conn.connection.cursor()
+                cursor.copy_expert(
+                    f"COPY {table.name} ({', '.join(columns)}) "
+                    f"FROM STDIN WITH (FORMAT csv)", io.StringIO(rows))
+            else:
+                count = len(rows)
+                conn.execute(table.insert(),
+                             [dict(zip(columns, row)) for row in rows])
+
+            updated = conn.execute(
+                progress.update()
+                .where(progress.c.table_name == table.name)
+                .values(rows_loaded=done + count))
+            if not updated.rowcount:
+                conn.execute(progress.insert().values(
+                    table_name=table.name, rows_loaded=done + count))
+
+        return count
+
+    def rows_loaded(self, table_name):
+        with self.engine.connect() as conn:
+            done = conn.execute(
+                progress.select()
+                .with_only_columns([progress.c.rows_loaded])
+                .where(progress.c.table_name == table_name)).scalar()
+        return done or 0
+
+    def drop_indexes(self):
+        """Drop secondary indexes, so the load doesn't maintain them."""
+
+        with self.engine.begin() as conn:
+            for table in db.metadata.sorted_tables:
+                for index in table.indexes:
+                    conn.execute(f"DROP INDEX IF EXISTS {index.name}")
+            if self.use_copy:
+                conn.execute(f"DROP INDEX IF EXISTS {SEARCH_INDEX}")
+
+    def create_indexes(self):
+        """Build the indexes dropped by `drop_indexes`."""
+
+        inspector = inspect(self.engine)
+        with self.engine.begin() as conn:
+            for table in db.metadata.sorted_tables:
+                existing = {index['name']
+                            for index in inspector.get_indexes(table.name)}
+                for index in table.indexes:
+                    if index.name not in existing:
+                        index.create(conn)
+
+            if self.use_copy:
+                conn.execute(DDL(
+                    f"CREATE INDEX IF NOT EXISTS {SEARCH_INDEX} ON users "
+                    f"USING gin (({USER_SEARCH_VECTOR}))"))
+
+
+def _kind(column):
+    if isinstance(column.type, Integer):
+        return 'int'
+    if isinstance(column.type, DateTime):
+        return 'datetime'
+    return 'text'
+
+
+def _ordered(pool, jobs, window):
+    """Run `parse_chunk` over `jobs` on `pool`, yielding results in order.
 
+    At most `window` chunks are in flight, so memory stays bounded however
+    large the file.
+    """
 
-db.drop_all()
-db.create_all()
+    pending = deque()
+    for job in jobs:
+        pending.append(pool.submit(parse_chunk, *job))
+        if len(pending) >= window:
+            yield pending.popleft().result()
 
-with open('generator/users.csv') as users:
-    db.session.bulk_insert_mappings(User, DictReader(users))
+    while pending:
+        yield pending.popleft().result()
 
-with open('generator/messages.csv') as messages:
-    db.session.bulk_insert_mappings(Message, DictReader(messages))
 
-with open('generator/follows.csv') as follows:
-    db.session.bulk_insert_mappings(Follows, DictReader(follows))
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--dir', default='generator',
+                        help="directory holding the CSVs (default: generator)")
+    parser.add_argument('--chunk-size', type=int, default=10000,
+                        help="rows per chunk/transaction (default: 10000)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help="CSV parsing processes (default: CPU count)")
+    parser.add_argument('--resume', action='store_true',
+                        help="continue an interrupted load instead of "
+                             "starting over")
+    args = parser.parse_args()
 
-db.session.commit()
+    Loader(args.dir, args.chunk_size, args.workers).run(args.resume)
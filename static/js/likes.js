@@ -0,0 +1,20 @@
+// Like/unlike messages without leaving the page.
+//
+// Like forms (form.like-form) post to /messages/<id>/like; asking for JSON
+// gets the new state back instead of a redirect to the homepage.
+
+$(document).on('submit', 'form.like-form', function (evt) {
+  evt.preventDefault();
+
+  const $form = $(this);
+  const $button = $form.find('button');
+
+  $.ajax({
+    url: $form.attr('action'),
+    method: 'POST',
+    headers: {Accept: 'application/json'},
+  }).done(function (resp) {
+    $button.toggleClass('btn-primary', resp.liked);
+    $button.toggleClass('btn-secondary', !resp.liked);
+  });
+});
@@ -0,0 +1,110 @@
+"""JSON API tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_api.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Follows, Likes
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+from current_user import current_users
+
+# run background jobs inline, so their effects can be checked right away
+app.config['JOBS_EAGER'] = True
+
+db.create_all()
+
+
+class ApiTestCase(TestCase):
+    """Test the /api/v1 endpoints."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+        current_users.clear()
+
+        self.client = app.test_client()
+
+        self.user = User.signup("testuser", "test@test.com", "password", None)
+        self.user.id = 8989
+        self.other = User.signup("other", "other@test.com", "password", None)
+        self.other.id = 9090
+        db.session.commit()
+
+        for i in range(5):
+            db.session.add(Message(text=f"msg {i}", user_id=9090))
+        db.session.commit()
+
+    def login(self):
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = 8989
+
+    def test_timeline_requires_login(self):
+        resp = self.client.get("/api/v1/timeline")
+        self.assertEqual(resp.status_code, 401)
+        self.assertEqual(resp.get_json(), {"error": "Access unauthorized."})
+
+    def test_follow_and_timeline(self):
+        self.login()
+        resp = self.client.post("/api/v1/users/9090/follow")
+        self.assertEqual(resp.get_json(), {"user_id": 9090, "following": True})
+
+        # retrying is harmless
+        self.assertEqual(self.client.post("/api/v1/users/9090/follow").status_code, 200)
+        self.assertEqual(Follows.query.count(), 1)
+
+        resp = self.client.get("/api/v1/timeline?limit=2")
+        data = resp.get_json()
+        self.assertEqual([m["text"] for m in data["messages"]], ["msg 4", "msg 3"])
+        self.assertEqual(data["messages"][0]["user"]["username"], "other")
+        self.assertIsNone(data["newer"])
+
+        data = self.client.get(f"/api/v1/timeline?limit=2&before={data['older']}").get_json()
+        self.assertEqual([m["text"] for m in data["messages"]], ["msg 2", "msg 1"])
+
+        resp = self.client.delete("/api/v1/users/9090/follow")
+        self.assertEqual(resp.get_json(), {"user_id": 9090, "following": False})
+        self.assertEqual(self.client.get("/api/v1/timeline").get_json()["messages"], [])
+
+    def test_profile(self):
+        self.login()
+        data = self.client.get("/api/v1/users/9090").get_json()["user"]
+        self.assertEqual(data["username"], "other")
+        self.assertEqual(data["messages_count"], 5)
+        self.assertFalse(data["following"])
+        self.assertNotIn("password", data)
+        self.assertNotIn("email", data)
+
+        self.assertEqual(self.client.get("/api/v1/users/1").status_code, 404)
+
+    def test_user_messages_cursor_matches_html(self):
+        data = self.client.get("/api/v1/users/9090/messages?limit=2").get_json()
+        html = self.client.get("/users/9090?limit=2").get_data(as_text=True)
+        self.assertIn(f"before={data['older']}", html)
+
+    def test_like(self):
+        self.login()
+        msg_id = Message.query.filter_by(text="msg 0").one().id
+
+        resp = self.client.post(f"/api/v1/messages/{msg_id}/like")
+        self.assertEqual(resp.get_json(), {"message_id": msg_id, "liked": True})
+        self.assertTrue(self.client.get(f"/api/v1/messages/{msg_id}").get_json()["message"]["liked"])
+
+        self.client.delete(f"/api/v1/messages/{msg_id}/like")
+        self.assertEqual(Likes.query.count(), 0)
+
+        self.assertEqual(self.client.post("/api/v1/messages/999999/like").status_code, 404)
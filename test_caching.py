@@ -0,0 +1,226 @@
+"""HTTP caching tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_caching.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Likes, TimelineEntry
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+from cache import LRUCache
+from current_user import current_users
+from fragments import message_cards
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+# run background jobs inline, so their effects can be checked right away
+app.config['JOBS_EAGER'] = True
+
+db.create_all()
+
+
+class ConditionalGetTestCase(TestCase):
+    """Test ETag / Last-Modified handling and cache policies."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+        current_users.clear()
+
+        self.client = app.test_client()
+
+        self.user = User.signup("testuser", "test@test.com", "password", None)
+        self.user.id = 8989
+        self.other = User.signup("other", "other@test.com", "password", None)
+        self.other.id = 9090
+        db.session.commit()
+
+        msg = Message(text="hello", user_id=9090)
+        db.session.add(msg)
+        db.session.commit()
+        self.msg_id = msg.id
+
+    def login(self, user_id=8989):
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def test_etag_revalidates(self):
+        resp = self.client.get("/users/9090")
+        self.assertEqual(resp.status_code, 200)
+        etag = resp.headers["ETag"]
+        self.assertEqual(resp.headers["Cache-Control"], "public, no-cache")
+        self.assertIn("Cookie", resp.headers["Vary"])
+
+        resp = self.client.get("/users/9090", headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp.get_data(), b"")
+
+    def test_etag_changes_with_content(self):
+        etag = self.client.get(f"/messages/{self.msg_id}").headers["ETag"]
+
+        other = User.query.get(9090)
+        other.profile_updated_at = other.profile_updated_at.replace(year=2100)
+        db.session.commit()
+
+        resp = self.client.get(f"/messages/{self.msg_id}",
+                               headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, 200)
+
+    def test_etag_includes_viewer_state(self):
+        self.login()
+        url = f"/messages/{self.msg_id}"
+        resp = self.client.get(url)
+        self.assertEqual(resp.headers["Cache-Control"], "private, no-cache")
+        etag = resp.headers["ETag"]
+
+        self.assertEqual(
+            self.client.get(url, headers={"If-None-Match": etag}).status_code,
+            304)
+
+        Likes.like(8989, self.msg_id)
+        db.session.commit()
+
+        self.assertEqual(
+            self.client.get(url, headers={"If-None-Match": etag}).status_code,
+            200)
+
+    def test_timeline_etag(self):
+        self.login()
+        self.client.post("/users/follow/9090")
+        etag = self.client.get("/").headers["ETag"]
+
+        self.assertEqual(
+            self.client.get("/", headers={"If-None-Match": etag}).status_code,
+            304)
+
+        msg = Message(text="newer", user_id=9090)
+        db.session.add(msg)
+        db.session.flush()
+        TimelineEntry.fan_out(msg)
+        db.session.commit()
+
+        self.assertEqual(
+            self.client.get("/", headers={"If-None-Match": etag}).status_code,
+            200)
+
+    def test_if_modified_since(self):
+        url = f"/messages/{self.msg_id}"
+        resp = self.client.get(url)
+        last_modified = resp.headers["Last-Modified"]
+
+        resp = self.client.get(url, headers={"If-Modified-Since": last_modified})
+        self.assertEqual(resp.status_code, 304)
+
+        resp = self.client.get(url, headers={
+            "If-Modified-Since": "Sat, 01 Jan 2000 00:00:00 GMT"})
+        self.assertEqual(resp.status_code, 200)
+
+    def test_no_last_modified_for_viewers(self):
+        self.login()
+        resp = self.client.get(f"/messages/{self.msg_id}")
+        self.assertNotIn("Last-Modified", resp.headers)
+
+    def test_pending_flash_renders(self):
+        etag = self.client.get("/users/9090").headers["ETag"]
+
+        with self.client.session_transaction() as sess:
+            sess['_flashes'] = [('success', 'Hello!')]
+
+        resp = self.client.get("/users/9090", headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("Hello!", resp.get_data(as_text=True))
+
+    def test_other_pages_not_stored(self):
+        resp = self.client.get("/login")
+        self.assertEqual(resp.headers["Cache-Control"],
+                         "no-cache, no-store, must-revalidate")
+        self.assertNotIn("ETag", resp.headers)
+
+
+class MessageCardCacheTestCase(TestCase):
+    """Test the rendered message card cache."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+        current_users.clear()
+        message_cards.clear()
+
+        self.client = app.test_client()
+
+        self.user = User.signup("testuser", "test@test.com", "password", None)
+        self.user.id = 8989
+        db.session.commit()
+
+        msg = Message(text="cached <b>hello</b>", user_id=8989)
+        db.session.add(msg)
+        db.session.commit()
+        self.msg_id = msg.id
+
+    def test_card_cached(self):
+        resp = self.client.get("/users/8989")
+        self.assertIn("cached &lt;b&gt;hello&lt;/b&gt;", resp.get_data(as_text=True))
+        self.assertIsNotNone(message_cards.get(self.msg_id))
+
+    def test_profile_edit_retires_card(self):
+        self.client.get("/users/8989")
+
+        user = User.query.get(8989)
+        user.username = "renamed"
+        user.profile_updated_at = user.profile_updated_at.replace(year=2100)
+        db.session.commit()
+
+        html = self.client.get("/users/8989").get_data(as_text=True)
+        self.assertIn("@renamed", html)
+        self.assertNotIn("@testuser", html)
+
+    def test_delete_forgets_card(self):
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = 8989
+
+        self.client.get("/users/8989")
+        self.client.post(f"/messages/{self.msg_id}/delete")
+        self.assertIsNone(message_cards.get(self.msg_id))
+
+
+class LRUCacheTestCase(TestCase):
+    """Test the cache's bounds."""
+
+    def test_maxsize(self):
+        cache = LRUCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+
+    def test_maxweight(self):
+        cache = LRUCache(maxsize=100, maxweight=10, weigh=len)
+        cache.set('a', 'x' * 4)
+        cache.set('b', 'x' * 4)
+        cache.set('a', 'x' * 5)
+        self.assertEqual(cache.weight, 9)
+
+        cache.set('c', 'x' * 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.weight, 8)
+
+        cache.delete('a')
+        self.assertEqual(cache.weight, 3)
@@ -0,0 +1,140 @@
+"""Follow graph and "who to follow" tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_graph.py
+
+
+import os
+import time
+from unittest import TestCase
+
+from models import db, User, Follows
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+from current_user import current_users
+from graph import FollowGraph, follow_graph
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['JOBS_EAGER'] = True
+
+# who follows whom: 1 follows 2 and 3, who both follow 4; 3 also follows 5
+FOLLOWS = [(1, 2), (1, 3), (2, 4), (3, 4), (3, 5), (2, 1), (5, 6)]
+
+
+class FollowGraphTestCase(TestCase):
+    """Test the graph snapshot and the suggestions built on it."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+        current_users.clear()
+        follow_graph.clear()
+
+        self.client = app.test_client()
+
+        for id in range(1, 7):
+            db.session.add(User(id=id, username=f"user{id}",
+                                email=f"user{id}@test.com",
+                                password="HASHED_PASSWORD"))
+        db.session.flush()
+        db.session.add_all([Follows(user_following_id=follower,
+                                    user_being_followed_id=followed)
+                            for follower, followed in FOLLOWS])
+        db.session.commit()
+
+        with app.app_context():
+            follow_graph.refresh()
+
+    def tearDown(self):
+        db.session.rollback()
+        follow_graph.clear()
+
+    def login(self, user_id=1):
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def test_build(self):
+        graph = FollowGraph.build()
+
+        self.assertEqual(graph.edges, len(FOLLOWS))
+        self.assertEqual(sorted(graph.following(1)), [2, 3])
+        self.assertEqual(sorted(graph.following(3)), [4, 5])
+        self.assertEqual(list(graph.following(4)), [])
+        self.assertEqual(list(graph.following(999)), [])
+
+        stats = graph.stats()
+        self.assertEqual(stats['edges'], len(FOLLOWS))
+        self.assertIn('memory_mb_per_million_edges', stats)
+        self.assertIn('build_seconds_per_million_edges', stats)
+
+    def test_suggest_friends_of_friends(self):
+        graph = FollowGraph.build()
+
+        # 4 is followed by both of 1's follows, 5 by one; 1 itself is skipped
+        self.assertEqual(graph.suggest(1), [(4, 2), (5, 1)])
+        self.assertEqual(graph.suggest(1, limit=1), [(4, 2)])
+        self.assertEqual(graph.suggest(6), [])
+
+    def test_build_skips_deleted_users(self):
+        User.query.get(4).deleted_at = db.func.now()
+        db.session.commit()
+
+        graph = FollowGraph.build()
+        self.assertEqual(graph.suggest(1), [(5, 1)])
+
+    def test_home_aside(self):
+        self.login()
+
+        resp = self.client.get("/")
+        html = str(resp.data)
+        self.assertIn("Who to follow", html)
+        self.assertIn("@user4", html)
+        self.assertIn("Followed by 2 people you follow", html)
+
+    def test_followed_since_snapshot_not_suggested(self):
+        self.login()
+        self.client.get("/")
+
+        self.client.post("/users/follow/4")
+        resp = self.client.get("/api/v1/suggestions")
+        self.assertEqual([user['id'] for user in resp.get_json()['users']], [5])
+
+    def test_api_suggestions(self):
+        self.login()
+
+        resp = self.client.get("/api/v1/suggestions?limit=1")
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.get_json(), {'users': [
+            {'id': 4, 'username': 'user4', 'image_url': User.query.get(4).image_url,
+             'mutual': 2}]})
+
+    def test_no_suggestions_until_built(self):
+        follow_graph.clear()
+        self.login()
+
+        resp = self.client.get("/api/v1/suggestions")
+        self.assertEqual(resp.get_json(), {'users': []})
+
+        for _ in range(100):
+            if not follow_graph.rebuilding:
+                break
+            time.sleep(0.05)
+        resp = self.client.get("/api/v1/suggestions")
+        self.assertEqual([user['id'] for user in resp.get_json()['users']], [4, 5])
+
+    def test_api_suggestions_requires_login(self):
+        resp = self.client.get("/api/v1/suggestions")
+        self.assertEqual(resp.status_code, 401)
@@ -0,0 +1,174 @@
+"""Background job tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_jobs.py
+
+
+import os
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from models import db, User, Message, Follows, TimelineEntry
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+from current_user import current_users
+from jobs import (FAILED, JOBS, Job, claim, enqueue, every, job, run,
+                  run_periodic, work)
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+db.create_all()
+
+calls = []
+
+
+@job
+def record_call(value):
+    calls.append(value)
+
+
+@job
+def always_fails():
+    raise RuntimeError("nope")
+
+
+@job
+def tick():
+    calls.append('tick')
+
+
+class JobQueueTestCase(TestCase):
+    """Test queueing and running jobs."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+        current_users.clear()
+        calls.clear()
+
+        self.eager = app.config['JOBS_EAGER']
+        app.config['JOBS_EAGER'] = False
+        self.ctx = app.test_request_context()
+        self.ctx.push()
+
+        self.client = app.test_client()
+
+        self.user = User.signup("testuser", "test@test.com", "password", None)
+        self.user.id = 8989
+        self.other = User.signup("other", "other@test.com", "password", None)
+        self.other.id = 9090
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.rollback()
+        self.ctx.pop()
+        app.config['JOBS_EAGER'] = self.eager
+
+    def test_enqueue_with_transaction(self):
+        enqueue('record_call', value=1)
+        db.session.rollback()
+        self.assertEqual(Job.query.count(), 0)
+
+        enqueue('record_call', value=2)
+        db.session.commit()
+        self.assertEqual(Job.query.count(), 1)
+
+        work(burst=True)
+        self.assertEqual(calls, [2])
+        self.assertEqual(Job.query.count(), 0)
+
+    def test_periodic(self):
+        every('tick', 60)
+        every('always_fails', 60)
+        try:
+            due = {}
+            run_periodic(due)
+            run_periodic(due)
+            self.assertEqual(calls, ['tick'])
+
+            # a failing periodic job doesn't stop the others, or the worker
+            due['tick'] = 0
+            run_periodic(due)
+            self.assertEqual(calls, ['tick', 'tick'])
+        finally:
+            every('tick', None)
+            every('always_fails', None)
+
+    def test_claim_hides_job(self):
+        enqueue('record_call', value=1)
+        db.session.commit()
+
+        claimed = claim()
+        self.assertEqual(claimed.attempts, 1)
+        self.assertIsNone(claim())
+
+        # once the visibility timeout passes, another worker may take it
+        Job.query.update({Job.run_at: datetime.utcnow() - timedelta(seconds=1)})
+        db.session.commit()
+        self.assertEqual(claim().id, claimed.id)
+
+    def test_retry_then_fail(self):
+        enqueue('always_fails')
+        db.session.commit()
+
+        self.assertFalse(run(claim()))
+        failed = Job.query.one()
+        self.assertEqual(failed.status, 'queued')
+        self.assertIn("RuntimeError", failed.last_error)
+        self.assertGreater(failed.run_at, datetime.utcnow())
+
+        for _ in range(app.config['JOBS_MAX_ATTEMPTS'] - 1):
+            Job.query.update({Job.run_at: datetime.utcnow()})
+            db.session.commit()
+            run(claim())
+
+        self.assertEqual(Job.query.one().status, FAILED)
+        self.assertIsNone(claim())
+
+    def test_follow_queues_backfill(self):
+        msg = Message(text="hello", user_id=9090)
+        db.session.add(msg)
+        db.session.commit()
+
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = 8989
+
+        self.client.post("/users/follow/9090")
+        self.assertEqual(Job.query.one().kind, 'backfill_timeline')
+        self.assertEqual(TimelineEntry.query.filter_by(user_id=8989).count(), 0)
+
+        work(burst=True)
+        self.assertEqual(TimelineEntry.query.filter_by(user_id=8989).count(), 1)
+
+    def test_fan_out_is_idempotent(self):
+        db.session.add(Follows(user_being_followed_id=9090, user_following_id=8989))
+        msg = Message(text="hello", user_id=9090)
+        db.session.add(msg)
+        db.session.commit()
+
+        JOBS['fan_out'](message_id=msg.id)
+        JOBS['fan_out'](message_id=msg.id)
+        db.session.commit()
+        self.assertEqual(TimelineEntry.query.filter_by(user_id=8989).count(), 1)
+
+    def test_jobs_cli(self):
+        enqueue('record_call', value=1)
+        db.session.commit()
+
+        runner = app.test_cli_runner()
+        result = runner.invoke(args=['jobs', 'status'])
+        self.assertIn("record_call", result.output)
+
+        runner.invoke(args=['jobs', 'work', '--burst'])
+        self.assertEqual(calls, [1])
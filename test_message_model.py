@@ -73,3 +73,31 @@ class MessageModelTestCase(TestCase):
         like = Likes.query.filter(Likes.user_id == self.uid).all()
         self.assertEqual(len(like), 1)
         self.assertEqual(like[0].message_id, m1.id)
+
+    def test_like_errors_not_swallowed(self):
+        """ Only a like that already exists counts as done """
+        msg = Message(text="Testing Message", user_id=self.uid)
+        db.session.add(msg)
+        db.session.commit()
+
+        Likes.like(self.uid, msg.id)
+        Likes.like(self.uid, msg.id)
+        self.assertEqual(Likes.query.count(), 1)
+
+        with self.assertRaises(exc.IntegrityError):
+            Likes.like(self.uid, msg.id + 1)
+
+    def test_liked_ids_among(self):
+        other = User.signup("otheruser", "other@email.com", "password", None)
+        db.session.commit()
+
+        m1 = Message(text="Testing Message 1", user_id=other.id)
+        m2 = Message(text="Testing Message 2", user_id=other.id)
+        db.session.add_all([m1, m2])
+        db.session.commit()
+
+        db.session.add(Likes(user_id=self.uid, message_id=m1.id))
+        db.session.commit()
+
+        self.assertEqual(self.user.liked_ids_among([m1.id, m2.id]), {m1.id})
+        self.assertEqual(self.user.liked_ids_among([]), set())
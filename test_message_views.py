@@ -7,7 +7,7 @@
 
 import os
 from unittest import TestCase
-from models import db, Message, User
+from models import db, Message, User, Follows, TimelineEntry
 
 # BEFORE we import our app, let's set an environmental variable
 # to use a different database for tests (we need to do this
@@ -20,6 +20,7 @@ os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
 # Now we can import app
 
 from app import app, CURR_USER_KEY
+from current_user import current_users
 
 # Create our tables (we do this here, so we only create the tables
 # once for all tests --- in each test, we'll delete the data
@@ -31,6 +32,9 @@ db.create_all()
 
 app.config['WTF_CSRF_ENABLED'] = False
 
+# run background jobs inline, so their effects can be checked right away
+app.config['JOBS_EAGER'] = True
+
 
 class MessageViewTestCase(TestCase):
     """Test views for messages."""
@@ -42,6 +46,7 @@ class MessageViewTestCase(TestCase):
         Message.query.delete()
 
         self.client = app.test_client()
+        current_users.clear()
 
         self.testuser = User.signup(username="testuser",
                                     email="test@test.com",
@@ -74,6 +79,34 @@ class MessageViewTestCase(TestCase):
             msg = Message.query.one()
             self.assertEqual(msg.text, "Hello")
     
+    def test_add_message_fans_out(self):
+        """Does a new message land in the author's and followers' timelines?"""
+
+        follower = User.signup("follower", "follower@test.com", "password", None)
+        follower.id = 7777
+        db.session.commit()
+
+        db.session.add(Follows(user_being_followed_id=self.testuser_id,
+                               user_following_id=7777))
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            c.post("/messages/new", data={"text": "Fan me out"})
+
+            msg = Message.query.one()
+            entries = TimelineEntry.query.filter_by(message_id=msg.id).all()
+            self.assertEqual({e.user_id for e in entries},
+                             {self.testuser_id, 7777})
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 7777
+
+            resp = c.get("/")
+            self.assertIn("Fan me out", str(resp.data))
+
     def test_add_no_session(self):
         with self.client as c:
             resp = c.post("/messages/new", data={"text":"test no session"}, follow_redirects=True)
@@ -124,6 +157,8 @@ class MessageViewTestCase(TestCase):
 
             m = Message.query.get(123456)
             self.assertIsNone(m)
+            self.assertEqual(
+                TimelineEntry.query.filter_by(message_id=123456).count(), 0)
 
     def test_unauthorized_message_delete(self):
     
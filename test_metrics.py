@@ -0,0 +1,62 @@
+"""Metrics tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_metrics.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app
+
+db.create_all()
+
+
+class MetricsTestCase(TestCase):
+    """Test the /metrics endpoint."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+
+        self.client = app.test_client()
+
+        user = User.signup("testuser", "test@test.com", "password", None)
+        user.id = 8989
+        db.session.commit()
+
+    def test_metrics(self):
+        self.client.get("/users/8989")
+
+        resp = self.client.get("/metrics")
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.content_type.startswith("text/plain"))
+
+        body = resp.get_data(as_text=True)
+        self.assertIn("# TYPE warbler_request_duration_seconds histogram", body)
+        self.assertIn('warbler_request_duration_seconds_count{endpoint="users_show"}', body)
+        self.assertIn('warbler_request_sql_queries_bucket{endpoint="users_show",le="+Inf"}', body)
+        self.assertIn('warbler_template_render_duration_seconds_count{template="users/show.html"}', body)
+        self.assertIn('warbler_requests_total{endpoint="users_show",status="200"}', body)
+
+    def test_sql_queries_counted(self):
+        self.client.get("/users/8989")
+
+        body = self.client.get("/metrics").get_data(as_text=True)
+        sums = [line for line in body.splitlines()
+                if line.startswith('warbler_request_sql_queries_sum{endpoint="users_show"}')]
+        self.assertEqual(len(sums), 1)
+        self.assertGreater(float(sums[0].split()[-1]), 0)
@@ -0,0 +1,169 @@
+"""Schema migration tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_migrate.py
+
+
+import os
+import tempfile
+from unittest import TestCase
+
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.exc import IntegrityError
+
+from models import db, Likes, TimelineEntry, User
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app
+import migrate
+
+
+class MigrateTestCase(TestCase):
+    """Test applying migrations."""
+
+    def setUp(self):
+        db.session.remove()
+        db.drop_all()
+        migrate.schema_migrations.drop(db.engine, checkfirst=True)
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        migrate.schema_migrations.drop(db.engine, checkfirst=True)
+
+    def index_names(self, table):
+        return {index['name'] for index in inspect(db.engine).get_indexes(table)}
+
+    def test_upgrade_adds_missing_indexes(self):
+        db.engine.execute("DROP INDEX ix_timeline_entries_message_id")
+        db.engine.execute("DROP INDEX ix_messages_user_timestamp")
+
+        migrate.upgrade(db.engine, echo=lambda line: None)
+
+        self.assertIn('ix_timeline_entries_message_id',
+                      self.index_names('timeline_entries'))
+        self.assertIn('ix_messages_user_timestamp', self.index_names('messages'))
+        self.assertEqual(migrate.pending(db.engine), [])
+
+    def test_upgrade_adds_missing_columns(self):
+        db.engine.execute("ALTER TABLE users DROP COLUMN deleted_at CASCADE")
+
+        migrate.upgrade(db.engine, echo=lambda line: None)
+
+        columns = {column['name'] for column in inspect(db.engine).get_columns('users')}
+        self.assertIn('deleted_at', columns)
+        self.assertIn('ix_users_deleted_at', self.index_names('users'))
+
+    def make_legacy_likes(self, engine):
+        """Swap in the original likes table: one like per message."""
+
+        engine.execute("DROP TABLE likes")
+        engine.execute(
+            "CREATE TABLE likes (id INTEGER PRIMARY KEY, "
+            "user_id INTEGER REFERENCES users (id) ON DELETE CASCADE, "
+            "message_id INTEGER UNIQUE REFERENCES messages (id) ON DELETE CASCADE)")
+        engine.execute(
+            "INSERT INTO users (id, email, username, password) VALUES "
+            "(1, 'a@test.com', 'a', 'x'), (2, 'b@test.com', 'b', 'x')")
+        engine.execute(
+            "INSERT INTO messages (id, text, timestamp, user_id) "
+            "VALUES (1, 'Hi', CURRENT_TIMESTAMP, 1)")
+        engine.execute("INSERT INTO likes (id, user_id, message_id) "
+                       "VALUES (1, 2, 1)")
+
+    def test_legacy_likes_rekeyed(self):
+        self.make_legacy_likes(db.engine)
+
+        migrate.upgrade(db.engine, echo=lambda line: None)
+
+        self.assertEqual(inspect(db.engine).get_pk_constraint('likes')
+                         ['constrained_columns'], ['user_id', 'message_id'])
+        self.assertEqual(inspect(db.engine).get_unique_constraints('likes'), [])
+        # when the legacy like was made isn't known
+        self.assertEqual(db.engine.execute(
+            "SELECT timestamp FROM likes").fetchall(), [(None,)])
+
+        # a second user's like of the same message is kept
+        Likes.like(1, 1)
+        db.session.commit()
+        self.assertEqual(Likes.query.count(), 2)
+
+    def test_legacy_likes_rekeyed_on_sqlite(self):
+        with tempfile.TemporaryDirectory() as dir:
+            engine = create_engine(f"sqlite:///{dir}/warbler.db")
+            try:
+                db.metadata.create_all(engine)
+                self.make_legacy_likes(engine)
+
+                migrate.upgrade(engine, echo=lambda line: None)
+
+                self.assertEqual(sorted(inspect(engine).get_pk_constraint(
+                    'likes')['constrained_columns']), ['message_id', 'user_id'])
+                engine.execute("INSERT INTO likes (user_id, message_id) "
+                               "VALUES (1, 1)")
+                self.assertEqual(engine.execute(
+                    "SELECT count(*) FROM likes").scalar(), 2)
+            finally:
+                engine.dispose()
+
+    def test_upgrade_fills_timelines_and_counters(self):
+        # rows written around the ORM, as by the pre-migration app
+        db.engine.execute(
+            "INSERT INTO users (id, email, username, password) VALUES "
+            "(1, 'a@test.com', 'a', 'x'), (2, 'b@test.com', 'b', 'x')")
+        db.engine.execute(
+            "INSERT INTO messages (id, text, timestamp, user_id) VALUES "
+            "(1, 'Hi', now(), 1), (2, 'Hello', now(), 2)")
+        db.engine.execute("INSERT INTO follows VALUES (2, 1)")
+        db.engine.execute("INSERT INTO likes VALUES (1, 2)")
+
+        migrate.upgrade(db.engine, echo=lambda line: None)
+
+        timeline = {(entry.user_id, entry.message_id)
+                    for entry in TimelineEntry.query}
+        self.assertEqual(timeline, {(1, 1), (1, 2), (2, 2)})
+
+        user = User.query.get(1)
+        self.assertEqual((user.messages_count, user.following_count,
+                          user.followers_count, user.likes_count), (1, 1, 0, 1))
+
+    def test_stamp(self):
+        migrate.stamp(db.engine)
+
+        self.assertEqual(migrate.pending(db.engine), [])
+        self.assertEqual(migrate.applied(db.engine),
+                         {migration.version for migration in migrate.migrations()})
+
+    def test_invalid_index_rebuilt(self):
+        db.engine.execute(
+            "INSERT INTO users (id, email, username, password) VALUES "
+            "(1, 'a@test.com', 'a', 'x'), (2, 'b@test.com', 'b', 'x')")
+        db.engine.execute(
+            "INSERT INTO messages (id, text, timestamp, user_id) "
+            "VALUES (1, 'Hi', now(), 1)")
+        db.engine.execute("INSERT INTO likes VALUES (1, 1), (2, 1)")
+
+        # a failed CREATE INDEX CONCURRENTLY leaves an invalid index behind
+        db.engine.execute("DROP INDEX ix_likes_message_id")
+        with db.engine.connect() as conn:
+            conn = conn.execution_options(isolation_level='AUTOCOMMIT')
+            with self.assertRaises(IntegrityError):
+                conn.execute("CREATE UNIQUE INDEX CONCURRENTLY ix_likes_message_id "
+                             "ON likes (message_id)")
+
+        migrate.upgrade(db.engine, echo=lambda line: None)
+
+        valid = db.engine.execute(
+            "SELECT indisvalid FROM pg_index "
+            "WHERE indexrelid = 'ix_likes_message_id'::regclass").scalar()
+        self.assertTrue(valid)
@@ -0,0 +1,133 @@
+"""Followers-you-know tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_mutual.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Follows
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+from current_user import current_users
+from mutual import followers_you_know, mutual_followers
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['JOBS_EAGER'] = True
+
+
+class MutualFollowersTestCase(TestCase):
+    """Test who among the viewer's follows follows a profile."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+        current_users.clear()
+        mutual_followers.clear()
+
+        self.client = app.test_client()
+
+        # user1 views user2; users 3-7 are who user1 follows
+        for id in range(1, 8):
+            db.session.add(User(id=id, username=f"user{id}",
+                                email=f"user{id}@test.com",
+                                password="HASHED_PASSWORD"))
+        db.session.commit()
+
+        for followed in range(3, 8):
+            self.follow(1, followed)
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def follow(self, follower, followed):
+        db.session.add(Follows(user_following_id=follower,
+                               user_being_followed_id=followed))
+        db.session.commit()
+
+    def login(self, user_id=1):
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def test_count_and_first_few(self):
+        for follower in (3, 4, 5, 6):
+            self.follow(follower, 2)
+        # the most followed come first
+        self.follow(2, 6)
+        self.follow(7, 5)
+
+        mutual = followers_you_know(User.query.get(1), User.query.get(2))
+        self.assertEqual(mutual.count, 4)
+        self.assertEqual(mutual.users, [(5, 'user5'), (6, 'user6'), (3, 'user3')])
+
+    def test_none(self):
+        self.follow(2, 1)
+
+        mutual = followers_you_know(User.query.get(1), User.query.get(2))
+        self.assertEqual(mutual, (0, []))
+        self.assertEqual(followers_you_know(None, User.query.get(2)).count, 0)
+        self.assertEqual(
+            followers_you_know(User.query.get(1), User.query.get(1)).count, 0)
+
+    def test_deleted_skipped(self):
+        self.follow(3, 2)
+        self.follow(4, 2)
+        User.query.get(3).deleted_at = db.func.now()
+        db.session.commit()
+
+        mutual = followers_you_know(User.query.get(1), User.query.get(2))
+        self.assertEqual(mutual, (1, [(4, 'user4')]))
+
+    def test_cached_per_pair_until_counts_change(self):
+        self.follow(3, 2)
+        viewer, user = User.query.get(1), User.query.get(2)
+        self.assertEqual(followers_you_know(viewer, user).count, 1)
+
+        # a follow that skipped the counters is only seen once they change
+        db.session.execute(Follows.__table__.insert().values(
+            user_following_id=4, user_being_followed_id=2))
+        db.session.commit()
+        self.assertEqual(followers_you_know(viewer, user).count, 1)
+
+        self.follow(5, 2)
+        self.assertEqual(followers_you_know(viewer, User.query.get(2)).count, 3)
+
+    def test_profile(self):
+        for follower in (3, 4, 5, 6, 7):
+            self.follow(follower, 2)
+        self.login()
+
+        resp = self.client.get("/users/2")
+        html = resp.get_data(as_text=True)
+        self.assertIn('id="followers-you-know"', html)
+        self.assertIn("and 2 others you follow", html)
+
+    def test_profile_names_only(self):
+        self.follow(3, 2)
+        self.follow(4, 2)
+        self.login()
+
+        html = self.client.get("/users/2").get_data(as_text=True)
+        self.assertIn('<a href="/users/3">@user3</a> and <a href="/users/4">@user4</a>',
+                      html)
+        self.assertNotIn("you follow", html)
+
+    def test_own_profile(self):
+        self.login(3)
+
+        html = self.client.get("/users/3").get_data(as_text=True)
+        self.assertNotIn('id="followers-you-know"', html)
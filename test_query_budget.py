@@ -0,0 +1,169 @@
+"""Query budget tests for listing pages."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_query_budget.py
+
+
+import os
+from unittest import TestCase
+
+from sqlalchemy import event
+
+from models import db, User, Message, Follows, Likes, TimelineEntry
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+from current_user import current_users
+from graph import follow_graph
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+# run background jobs inline, so their effects can be checked right away
+app.config['JOBS_EAGER'] = True
+
+# Most SQL statements any listing page may run, however long the list is.
+QUERY_BUDGET = 8
+
+
+class QueryCounter:
+    """Count the SQL statements sent to the database while in use.
+
+        with QueryCounter() as queries:
+            ...
+        queries.count
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def __enter__(self):
+        event.listen(db.engine, 'before_cursor_execute', self._count)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(db.engine, 'before_cursor_execute', self._count)
+
+    def _count(self, *args):
+        self.count += 1
+
+
+class QueryBudgetTestCase(TestCase):
+    """Listing pages should run a fixed number of queries."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+
+        self.client = app.test_client()
+        current_users.clear()
+
+        self.testuser = User.signup("testuser", "test@test.com", "password", None)
+        self.testuser_id = 8989
+        self.testuser.id = self.testuser_id
+        db.session.commit()
+
+    def tearDown(self):
+        resp = super().tearDown()
+        db.session.rollback()
+        return resp
+
+    def add_friends(self, count, start=1):
+        """Add users that follow, are followed and liked by testuser."""
+
+        friends = [User(username=f"friend{i}", email=f"friend{i}@test.com",
+                        password="HASHED_PASSWORD")
+                   for i in range(start, start + count)]
+        db.session.add_all(friends)
+        db.session.commit()
+
+        for friend in friends:
+            msg = Message(text=f"Hi from {friend.username}", user_id=friend.id)
+            db.session.add_all([
+                msg,
+                Follows(user_being_followed_id=friend.id, user_following_id=self.testuser_id),
+                Follows(user_being_followed_id=self.testuser_id, user_following_id=friend.id),
+            ])
+            db.session.flush()
+            db.session.add(Likes(user_id=self.testuser_id, message_id=msg.id))
+
+        TimelineEntry.rebuild()
+        db.session.commit()
+
+    def queries_for(self, url):
+        """How many statements does fetching `url` as testuser run?"""
+
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.testuser_id
+
+        # measure with a cold current-user cache, the worst case; the
+        # follow graph is rebuilt in the background, not per request
+        db.session.remove()
+        current_users.clear()
+        with app.app_context():
+            follow_graph.refresh()
+
+        with QueryCounter() as queries:
+            resp = self.client.get(url)
+
+        self.assertEqual(resp.status_code, 200)
+        return queries.count
+
+    def assert_bounded(self, url):
+        """Queries for `url` stay within budget and don't grow with the list."""
+
+        self.add_friends(2)
+        few = self.queries_for(url)
+
+        self.add_friends(20, start=3)
+        many = self.queries_for(url)
+
+        self.assertLessEqual(many, QUERY_BUDGET)
+        self.assertEqual(few, many)
+
+    def test_homepage(self):
+        self.assert_bounded("/")
+
+    def test_users_show(self):
+        self.assert_bounded(f"/users/{self.testuser_id}")
+
+    def test_show_following(self):
+        self.assert_bounded(f"/users/{self.testuser_id}/following")
+
+    def test_users_followers(self):
+        self.assert_bounded(f"/users/{self.testuser_id}/followers")
+
+    def test_show_likes(self):
+        self.assert_bounded(f"/users/{self.testuser_id}/likes")
+
+    def test_list_users(self):
+        self.assert_bounded("/users")
+
+    def test_current_user_cached(self):
+        url = f"/users/{self.testuser_id}"
+        cold = self.queries_for(url)
+
+        with QueryCounter() as queries:
+            self.client.get(url)
+
+        self.assertEqual(queries.count, cold - 1)
+
+    def test_metrics_skips_current_user(self):
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.testuser_id
+
+        with QueryCounter() as queries:
+            self.client.get("/metrics")
+
+        self.assertEqual(queries.count, 0)
@@ -0,0 +1,226 @@
+"""Query plan tests: the hot routes' queries must use indexes."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_query_plans.py
+
+
+import os
+from unittest import TestCase
+
+from sqlalchemy import event, text
+
+from models import db
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+from current_user import current_users
+from graph import follow_graph
+from trending import trending, window
+
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['JOBS_EAGER'] = True
+
+# Postgres happily seq-scans a table of a few rows, so the plans are only
+# worth checking against tables of a realistic size
+USERS = 20_000
+MESSAGES = 200_000
+FOLLOWS_PER_USER = 10
+LIKES_PER_USER = 10
+TIMELINE_USERS = 100
+
+# tables that must never be read in full by a request
+BIG_TABLES = {'users', 'messages', 'follows', 'likes', 'timeline_entries'}
+
+SEED_SQL = [
+    f"""INSERT INTO users (id, email, username, password, bio)
+        SELECT n, 'user' || n || '@test.com', 'user' || n, 'password',
+               'Bio of user ' || n
+        FROM generate_series(1, {USERS}) AS n""",
+    f"""INSERT INTO messages (id, text, timestamp, user_id)
+        SELECT n, 'Message ' || n, now() - n * interval '1 minute',
+               1 + (n::bigint * 7919) % {USERS}
+        FROM generate_series(1, {MESSAGES}) AS n""",
+    f"""INSERT INTO follows (user_being_followed_id, user_following_id)
+        SELECT DISTINCT 1 + (u::bigint * 104729 + k * 1299709) % {USERS}, u
+        FROM generate_series(1, {USERS}) AS u,
+             generate_series(1, {FOLLOWS_PER_USER}) AS k
+        WHERE 1 + (u::bigint * 104729 + k * 1299709) % {USERS} <> u""",
+    f"""INSERT INTO likes (user_id, message_id)
+        SELECT DISTINCT u, 1 + (u::bigint * 15485863 + k * 32452843) % {MESSAGES}
+        FROM generate_series(1, {USERS}) AS u,
+             generate_series(1, {LIKES_PER_USER}) AS k""",
+    # every author's own messages, plus full timelines for a few users
+    # (all of them would be millions of rows)
+    f"""INSERT INTO timeline_entries (user_id, message_id, timestamp)
+        SELECT m.user_id, m.id, m.timestamp FROM messages m
+        UNION ALL
+        SELECT f.user_following_id, m.id, m.timestamp
+        FROM follows f JOIN messages m ON m.user_id = f.user_being_followed_id
+        WHERE f.user_following_id <= {TIMELINE_USERS}""",
+    # every like as if it came in just now
+    """INSERT INTO trending_buckets (message_id, bucket, likes)
+       SELECT message_id, :bucket, count(*) FROM likes GROUP BY message_id""",
+    "SELECT setval('users_id_seq', (SELECT max(id) FROM users))",
+    "SELECT setval('messages_id_seq', (SELECT max(id) FROM messages))",
+    "ANALYZE",
+]
+
+
+def seq_scans(plan):
+    """Names of big tables that `plan` (EXPLAIN's JSON) reads in full."""
+
+    found = set()
+    if plan.get('Node Type') == 'Seq Scan' and plan['Relation Name'] in BIG_TABLES:
+        found.add(plan['Relation Name'])
+    for child in plan.get('Plans', []):
+        found |= seq_scans(child)
+    return found
+
+
+class QueryPlanTestCase(TestCase):
+    """EXPLAIN every statement a route runs; none may scan a big table."""
+
+    @classmethod
+    def setUpClass(cls):
+        db.drop_all()
+        db.create_all()
+
+        with db.engine.begin() as conn:
+            for statement in SEED_SQL[:-1]:
+                conn.execute(text(statement), bucket=window.bucket())
+        with db.engine.connect() as conn:
+            conn.execution_options(isolation_level='AUTOCOMMIT').execute(SEED_SQL[-1])
+
+        # reading the whole graph (or window of likes) is the point of the
+        # snapshots, and they're rebuilt in the background rather than by
+        # requests
+        with app.app_context():
+            for snapshot in (follow_graph, trending):
+                snapshot.refresh()
+
+    @classmethod
+    def tearDownClass(cls):
+        follow_graph.clear()
+        trending.clear()
+        db.session.remove()
+        db.drop_all()
+
+    def setUp(self):
+        current_users.clear()
+        self.client = app.test_client()
+        self.statements = []
+
+    def _capture(self, conn, cursor, statement, parameters, context,
+                 executemany):
+        if not executemany:
+            self.statements.append((statement, parameters))
+
+    def assertIndexed(self, method, url, **kwargs):
+        """Request `url`, then EXPLAIN each statement it ran."""
+
+        event.listen(db.engine, 'before_cursor_execute', self._capture)
+        try:
+            resp = getattr(self.client, method)(url, **kwargs)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', self._capture)
+        db.session.remove()
+
+        self.assertLess(resp.status_code, 400, url)
+        self.assertTrue(self.statements, url)
+
+        raw = db.engine.raw_connection()
+        try:
+            cursor = raw.cursor()
+            for statement, parameters in self.statements:
+                verb = statement.lstrip().split(None, 1)[0].upper()
+                if verb not in ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH'):
+                    continue
+
+                cursor.execute("EXPLAIN (FORMAT JSON) " + statement, parameters)
+                plan = cursor.fetchone()[0][0]['Plan']
+                scanned = seq_scans(plan)
+                self.assertFalse(
+                    scanned,
+                    f"{method.upper()} {url} scans {', '.join(sorted(scanned))}:\n"
+                    f"{statement}")
+        finally:
+            raw.rollback()
+            raw.close()
+
+    def login(self, user_id=1):
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def test_homepage(self):
+        self.login()
+        self.assertIndexed('get', '/')
+
+    def test_homepage_older_page(self):
+        self.login()
+        older = self.client.get('/api/v1/timeline').get_json()['older']
+        self.assertIndexed('get', f'/?before={older}')
+
+    def test_users_show(self):
+        self.login()
+        self.assertIndexed('get', '/users/2')
+
+    def test_users_show_anonymous(self):
+        self.assertIndexed('get', '/users/2')
+
+    def test_list_users(self):
+        self.login()
+        self.assertIndexed('get', '/users?after=10000')
+
+    def test_search_users(self):
+        self.login()
+        self.assertIndexed('get', '/users?q=user1234')
+
+    def test_following(self):
+        self.login()
+        self.assertIndexed('get', '/users/3/following')
+
+    def test_followers(self):
+        self.login()
+        self.assertIndexed('get', '/users/3/followers')
+
+    def test_likes(self):
+        self.login()
+        self.assertIndexed('get', '/users/3/likes')
+
+    def test_message_show(self):
+        self.login()
+        self.assertIndexed('get', '/messages/500')
+
+    def test_messages_add(self):
+        self.login(4)
+        self.assertIndexed('post', '/messages/new', data={'text': "Hello"})
+
+    def test_messages_destroy(self):
+        self.login(1 + 600 * 7919 % USERS)
+        self.assertIndexed('post', '/messages/600/delete')
+
+    def test_add_like(self):
+        self.login(5)
+        self.assertIndexed('post', '/messages/700/like',
+                           headers={'Accept': 'application/json'})
+
+    def test_api_timeline(self):
+        self.login()
+        self.assertIndexed('get', '/api/v1/timeline')
+
+    def test_api_user_messages(self):
+        self.assertIndexed('get', '/api/v1/users/2/messages')
+
+    def test_trending(self):
+        self.login()
+        self.assertIndexed('get', '/trending')
@@ -0,0 +1,117 @@
+"""Read/write routing tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_routing.py
+
+
+import os
+import tempfile
+from unittest import TestCase
+
+from models import db, User, Message
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+from current_user import current_users
+from routing import router
+
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['JOBS_EAGER'] = True
+
+db.create_all()
+
+
+class ReplicaRoutingTestCase(TestCase):
+    """Test that reads go to a replica, and when they don't.
+
+    The "replica" is a SQLite file holding different rows from the
+    primary, so it shows which database a page was read from.
+    """
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+        current_users.clear()
+        router.health.clear()
+
+        self.dir = tempfile.TemporaryDirectory()
+        self.use_replica(f"sqlite:///{self.dir.name}/replica.db")
+        db.Model.metadata.create_all(self.replica)
+
+        self.client = app.test_client()
+
+        user = User.signup("primaryuser", "primary@test.com", "password", None)
+        user.id = 1
+        db.session.commit()
+
+        self.replica.execute(User.__table__.insert(), {
+            'id': 1, 'username': 'replicauser', 'email': 'replica@test.com',
+            'password': user.password})
+
+    def tearDown(self):
+        db.session.rollback()
+        app.config['SQLALCHEMY_BINDS'] = {}
+        app.config['DATABASE_REPLICAS'] = []
+        app.config['REPLICA_STICKY_SECONDS'] = 5
+        app.config['REPLICA_LAG_QUERY'] = None
+        self.replica.dispose()
+        self.dir.cleanup()
+
+    def use_replica(self, url):
+        app.config['SQLALCHEMY_BINDS'] = {'replica': url}
+        app.config['DATABASE_REPLICAS'] = ['replica']
+        self.replica = db.get_engine(app, bind='replica')
+
+    def test_get_reads_replica(self):
+        resp = self.client.get("/users")
+        self.assertIn("replicauser", str(resp.data))
+        self.assertNotIn("primaryuser", str(resp.data))
+
+    def test_writes_go_to_primary_and_stick(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 1
+
+            resp = c.post("/messages/new", data={"text": "Written to primary"})
+            self.assertEqual(resp.status_code, 302)
+
+            self.assertEqual(Message.query.count(), 1)
+            self.assertEqual(self.replica.execute(
+                "SELECT count(*) FROM messages").scalar(), 0)
+
+            # just wrote, so reads come from the primary
+            resp = c.get("/users/1")
+            self.assertIn("Written to primary", str(resp.data))
+
+            app.config['REPLICA_STICKY_SECONDS'] = 0
+            resp = c.get("/users/1")
+            self.assertNotIn("Written to primary", str(resp.data))
+            self.assertIn("replicauser", str(resp.data))
+
+    def test_lagging_replica_skipped(self):
+        app.config['REPLICA_LAG_QUERY'] = "SELECT 60"
+
+        resp = self.client.get("/users")
+        self.assertIn("primaryuser", str(resp.data))
+
+    def test_unreachable_replica_skipped(self):
+        self.use_replica(f"sqlite:///{self.dir.name}/missing/replica.db")
+
+        resp = self.client.get("/users")
+        self.assertIn("primaryuser", str(resp.data))
+
+    def test_no_replicas(self):
+        app.config['DATABASE_REPLICAS'] = []
+
+        resp = self.client.get("/users")
+        self.assertIn("primaryuser", str(resp.data))
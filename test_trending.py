@@ -0,0 +1,233 @@
+"""Trending messages tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_trending.py
+
+
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from models import db, User, Message, Likes
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+from current_user import current_users
+from jobs import work
+from trending import TrendingBucket, prune, rank, trending, window
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['JOBS_EAGER'] = True
+
+
+class TrendingTestCase(TestCase):
+    """Test the like counters and the ranking built from them."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+        current_users.clear()
+        trending.clear()
+
+        self.client = app.test_client()
+
+        for id in range(1, 5):
+            db.session.add(User(id=id, username=f"user{id}",
+                                email=f"user{id}@test.com",
+                                password="HASHED_PASSWORD"))
+        db.session.flush()
+        # user1 wrote messages 1-3; the others like them
+        for id in range(1, 4):
+            db.session.add(Message(id=id, text=f"Message {id}", user_id=1))
+        db.session.commit()
+
+        self.now = window.bucket()
+
+    def tearDown(self):
+        db.session.rollback()
+        trending.clear()
+
+    def login(self, user_id):
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def add_bucket(self, message_id, age, likes):
+        db.session.add(TrendingBucket(message_id=message_id,
+                                      bucket=self.now - age, likes=likes))
+        db.session.commit()
+
+    def test_likes_counted_in_current_bucket(self):
+        self.login(2)
+        self.client.post("/messages/1/like")
+        self.login(3)
+        self.client.post("/messages/1/like")
+        self.client.post("/api/v1/messages/2/like")
+
+        counts = {(b.message_id, b.bucket): b.likes
+                  for b in TrendingBucket.query.all()}
+        self.assertEqual(counts, {(1, self.now): 2, (2, self.now): 1})
+
+    def test_unlike_uncounted(self):
+        self.login(2)
+        self.client.post("/messages/1/like")
+        self.client.post("/messages/1/like")
+
+        self.assertEqual(TrendingBucket.query.one().likes, 0)
+        self.assertEqual(rank(), ())
+
+    def add_like(self, user_id, message_id, age):
+        timestamp = datetime.utcnow() - timedelta(seconds=age * window.bucket_seconds)
+        db.session.add(Likes(user_id=user_id, message_id=message_id,
+                             timestamp=timestamp))
+        db.session.commit()
+
+    def test_unlike_uncounted_from_its_bucket(self):
+        self.add_like(2, 1, 10)
+        self.add_like(3, 1, 0)
+        self.login(2)
+        self.client.post("/messages/1/like")
+
+        counts = {b.bucket: b.likes for b in TrendingBucket.query.all()}
+        self.assertEqual(counts, {self.now - 10: 0, self.now: 1})
+
+    def test_unlike_outside_window_uncounted(self):
+        self.add_like(2, 1, self.now - window.oldest())
+        prune()
+        self.login(2)
+        self.client.post("/messages/1/like")
+
+        self.assertEqual(TrendingBucket.query.all(), [])
+
+    def test_likes_counted_on_sqlite(self):
+        with tempfile.TemporaryDirectory() as dir:
+            engine = create_engine(f"sqlite:///{dir}/warbler.db")
+            db.Model.metadata.create_all(engine)
+            session = Session(engine)
+            try:
+                session.add_all([
+                    User(id=1, username="user1", email="user1@test.com",
+                         password="HASHED_PASSWORD"),
+                    User(id=2, username="user2", email="user2@test.com",
+                         password="HASHED_PASSWORD")])
+                session.flush()
+                session.add(Message(id=1, text="Message 1", user_id=1))
+                session.flush()
+
+                for user_id in (1, 2):
+                    session.add(Likes(user_id=user_id, message_id=1))
+                    session.flush()
+                self.assertEqual(session.query(TrendingBucket.likes).scalar(), 2)
+
+                session.delete(session.query(Likes).get((2, 1)))
+                session.commit()
+                self.assertEqual(session.query(TrendingBucket.likes).scalar(), 1)
+            finally:
+                session.close()
+                engine.dispose()
+
+    def test_rank_decays(self):
+        half_life = window.half_life_seconds // window.bucket_seconds
+        # 4 likes two half-lives ago are worth 1 like now
+        self.add_bucket(1, 2 * half_life, 4)
+        self.add_bucket(2, 0, 2)
+        self.add_bucket(3, 0, 1)
+        self.add_bucket(3, half_life, 1)
+
+        ranking = rank()
+        self.assertEqual([id for id, _ in ranking], [2, 3, 1])
+        self.assertAlmostEqual(ranking[1][1], 1.5)
+        self.assertAlmostEqual(ranking[2][1], 1.0)
+
+    def test_window_and_prune(self):
+        self.add_bucket(1, self.now - window.oldest(), 10)
+        self.add_bucket(2, self.now - window.oldest() - 1, 1)
+
+        self.assertEqual([id for id, _ in rank()], [2])
+        self.assertEqual(prune(), 1)
+        self.assertEqual([b.message_id for b in TrendingBucket.query.all()], [2])
+
+    def test_workers_prune(self):
+        self.add_bucket(1, self.now - window.oldest(), 10)
+        self.add_bucket(2, 0, 1)
+
+        # nobody has looked at /trending
+        with app.app_context():
+            work(burst=True)
+
+        self.assertEqual([b.message_id for b in TrendingBucket.query.all()], [2])
+
+    def test_rank_limited(self):
+        window.size = 2
+        try:
+            for id in range(1, 4):
+                self.add_bucket(id, 0, id)
+            self.assertEqual([id for id, _ in rank()], [3, 2])
+        finally:
+            window.size = app.config['TRENDING_SIZE']
+
+    def test_page(self):
+        self.add_bucket(1, 0, 1)
+        self.add_bucket(3, 0, 5)
+        with app.app_context():
+            trending.refresh()
+
+        resp = self.client.get("/trending")
+        html = resp.get_data(as_text=True)
+        self.assertEqual(resp.status_code, 200)
+        self.assertLess(html.index("Message 3"), html.index("Message 1"))
+        self.assertNotIn("Message 2", html)
+
+    def test_page_served_from_snapshot(self):
+        with app.app_context():
+            trending.refresh()
+
+        self.add_bucket(2, 0, 1)
+        html = self.client.get("/trending").get_data(as_text=True)
+        self.assertIn("Nothing's trending yet.", html)
+
+        trending.built_at = time.monotonic() - trending.reload_after - 1
+        self.client.get("/trending")
+        for _ in range(100):
+            if not trending.rebuilding:
+                break
+            time.sleep(0.05)
+        self.assertIn("Message 2", self.client.get("/trending").get_data(as_text=True))
+
+    def test_page_empty_until_ranked(self):
+        self.add_bucket(1, 0, 1)
+
+        html = self.client.get("/trending").get_data(as_text=True)
+        self.assertIn("Nothing's trending yet.", html)
+
+        for _ in range(100):
+            if not trending.rebuilding:
+                break
+            time.sleep(0.05)
+        self.assertIn("Message 1", self.client.get("/trending").get_data(as_text=True))
+
+    def test_page_skips_deleted_authors(self):
+        self.add_bucket(1, 0, 1)
+        User.query.get(1).deleted_at = db.func.now()
+        db.session.commit()
+        with app.app_context():
+            trending.refresh()
+
+        html = self.client.get("/trending").get_data(as_text=True)
+        self.assertNotIn("Message 1", html)
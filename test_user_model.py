@@ -7,9 +7,12 @@
 
 import os
 from unittest import TestCase
+from unittest.mock import patch
+from flask import Flask
 from sqlalchemy import exc
 
-from models import db, User
+from models import db, User, Message, Follows, Likes
+from hashing import PasswordHasher, hasher
 
 # BEFORE we import our app, let's set an environmental variable
 # to use a different database for tests (we need to do this
@@ -108,6 +111,16 @@ class UserModelTestCase(TestCase):
         self.assertTrue(self.user1.is_following(self.user2))
         self.assertFalse(self.user2.is_following(self.user1))
 
+    def test_following_ids_among(self):
+        self.user1.following.append(self.user2)
+        db.session.commit()
+
+        self.assertEqual(
+            self.user1.following_ids_among([self.uid1, self.uid2, 3333]),
+            {self.uid2})
+        self.assertEqual(self.user2.following_ids_among([self.uid1]), set())
+        self.assertEqual(self.user2.following_ids_among([]), set())
+
     def test_is_followed_by(self):
         self.user1.following.append(self.user2)
         db.session.commit()
@@ -115,6 +128,44 @@ class UserModelTestCase(TestCase):
         self.assertTrue(self.user2.is_followed_by(self.user1))
         self.assertFalse(self.user1.is_followed_by(self.user2))
 
+    def test_counters(self):
+        db.session.add(Follows(user_being_followed_id=self.uid2,
+                               user_following_id=self.uid1))
+        m = Message(text="Count me", user_id=self.uid2)
+        db.session.add(m)
+        db.session.commit()
+        db.session.add(Likes(user_id=self.uid1, message_id=m.id))
+        db.session.commit()
+
+        user1 = User.query.get(self.uid1)
+        user2 = User.query.get(self.uid2)
+        self.assertEqual(user1.following_count, 1)
+        self.assertEqual(user1.likes_count, 1)
+        self.assertEqual(user2.followers_count, 1)
+        self.assertEqual(user2.messages_count, 1)
+
+        # deleting the message takes its like with it
+        db.session.delete(m)
+        db.session.commit()
+        self.assertEqual(User.query.get(self.uid1).likes_count, 0)
+        self.assertEqual(User.query.get(self.uid2).messages_count, 0)
+
+    def test_reconcile_counters(self):
+        db.session.add(Follows(user_being_followed_id=self.uid2,
+                               user_following_id=self.uid1))
+        db.session.commit()
+
+        User.query.update({User.followers_count: 99,
+                           User.following_count: 99})
+        db.session.commit()
+
+        User.reconcile_counters()
+        db.session.commit()
+
+        self.assertEqual(User.query.get(self.uid1).following_count, 1)
+        self.assertEqual(User.query.get(self.uid1).followers_count, 0)
+        self.assertEqual(User.query.get(self.uid2).followers_count, 1)
+
     # TODO: SIGN UP TEST
     def test_valid_signup(self):
         """test user1 and user2 signed up"""
@@ -158,6 +209,32 @@ class UserModelTestCase(TestCase):
         self.assertEqual(self.user1.id, u.id)
         self.assertEqual(self.user1.username, "test1")
 
+    def test_rehash_on_login(self):
+        rounds = hasher.rounds
+        hasher.rounds = 4
+        try:
+            user = User.signup("cheap", "cheap@gmail.com", "password", None)
+            db.session.commit()
+        finally:
+            hasher.rounds = rounds
+
+        self.assertTrue(user.password.startswith("$2b$04$"))
+
+        u = User.authenticate("cheap", "password")
+        db.session.commit()
+        self.assertTrue(u.password.startswith(f"$2b${rounds:02}$"))
+        self.assertTrue(User.authenticate("cheap", "password"))
+
+    def test_hashing_settings_from_environment(self):
+        settings = {'BCRYPT_LOG_ROUNDS': '5', 'PASSWORD_HASHING_POOL': 'process',
+                    'PASSWORD_HASHING_WORKERS': '3'}
+        with patch.dict(os.environ, settings):
+            hashing = PasswordHasher()
+            hashing.init_app(Flask(__name__))
+
+        self.assertEqual((hashing.rounds, hashing.pool_kind, hashing.workers),
+                         (5, 'process', 3))
+
     def test_invalid_username_auth(self):
         self.assertFalse(User.authenticate("invalidusername", "password"))
 
@@ -6,11 +6,12 @@
 
 
 import os
+from datetime import datetime
 from unittest import TestCase
 
 from werkzeug.test import Client
 
-from models import db, Message, User, Likes, Follows
+from models import db, Message, User, Likes, Follows, TimelineEntry, AccountPurge
 from bs4 import BeautifulSoup
 
 # BEFORE we import our app, let's set an environmental variable
@@ -24,6 +25,8 @@ os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
 # Now we can import app
 
 from app import app, CURR_USER_KEY
+from current_user import current_users
+from search import usernames
 
 # Create our tables (we do this here, so we only create the tables
 # once for all tests --- in each test, we'll delete the data
@@ -35,6 +38,9 @@ db.create_all()
 
 app.config['WTF_CSRF_ENABLED'] = False
 
+# run background jobs inline, so their effects can be checked right away
+app.config['JOBS_EAGER'] = True
+
 class UserViewTestCase(TestCase):
     """Test views for messages."""
 
@@ -45,6 +51,7 @@ class UserViewTestCase(TestCase):
         db.create_all()
 
         self.client = app.test_client()
+        current_users.clear()
 
         self.testuser = User.signup(username="testuser", email="test@email.com", password="testuser", image_url=None)
         self.testuser_id = 8989
@@ -80,6 +87,34 @@ class UserViewTestCase(TestCase):
             self.assertIn("@huulamnguyen", str(resp.data))
             self.assertIn("@liamnguyen", str(resp.data))
     
+    def test_users_index_pagination(self):
+        app.config['USERS_PER_PAGE'] = 3
+        try:
+            with self.client as c:
+                resp = c.get("/users")
+                soup = BeautifulSoup(str(resp.data), 'html.parser')
+                first = {p.text for p in soup.select(".card-link p")}
+                self.assertEqual(len(first), 3)
+
+                resp = c.get(soup.find("a", {"class": "load-more"})["href"])
+                soup = BeautifulSoup(str(resp.data), 'html.parser')
+                second = {p.text for p in soup.select(".card-link p")}
+                self.assertEqual(len(second), 2)
+                self.assertFalse(first & second)
+                self.assertIsNone(soup.find("a", {"class": "load-more"}))
+        finally:
+            app.config['USERS_PER_PAGE'] = 30
+
+    def test_users_index_streamed(self):
+        app.config['STREAM_LISTINGS'] = True
+        try:
+            with self.client as c:
+                resp = c.get("/users")
+                self.assertTrue(resp.is_streamed)
+                self.assertIn("@testuser1", resp.get_data(as_text=True))
+        finally:
+            app.config['STREAM_LISTINGS'] = False
+
     def test_user_search(self):
         with self.client as c:
             resp = c.get('/users?q=test')
@@ -93,6 +128,50 @@ class UserViewTestCase(TestCase):
             self.assertNotIn("@huulamnguyen", str(resp.data))
             self.assertNotIn("@liamnguyen", str(resp.data))
     
+    def test_user_search_ranks_usernames_first(self):
+        self.u3.bio = "Just testing things"
+        db.session.commit()
+
+        with self.client as c:
+            resp = c.get('/users?q=test')
+            page = str(resp.data)
+
+            self.assertIn("@huulamnguyen", page)
+            self.assertLess(page.index("@testuser"), page.index("@huulamnguyen"))
+
+    def test_autocomplete(self):
+        usernames.load()
+
+        with self.client as c:
+            resp = c.get('/api/users/autocomplete?prefix=TESTUSER')
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual([u["username"] for u in resp.json["users"]],
+                             ["testuser", "testuser1", "testuser2"])
+
+            resp = c.get('/api/users/autocomplete?prefix=')
+            self.assertEqual(resp.json["users"], [])
+
+    def test_edit_profile(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            data = {"username": "renamed", "email": "test@email.com",
+                    "bio": "New bio", "password": "wrongpassword"}
+            c.post("/users/profile", data=data)
+            self.assertEqual(User.query.get(self.testuser_id).username, "testuser")
+
+            data["password"] = "testuser"
+            resp = c.post("/users/profile", data=data)
+            self.assertEqual(resp.status_code, 302)
+
+            user = User.query.get(self.testuser_id)
+            self.assertEqual(user.username, "renamed")
+            self.assertEqual(user.bio, "New bio")
+            # the confirmation password didn't replace the stored hash
+            self.assertTrue(User.authenticate("renamed", "testuser"))
+
     def test_user_show(self):
         with self.client as c:
             resp = c.get(f'/users/{self.testuser_id}')
@@ -140,6 +219,25 @@ class UserViewTestCase(TestCase):
             # Test for a count of 1 like
             self.assertIn("1", found[3].text)
     
+    def test_like_buttons_show_viewer_likes(self):
+        self.setup_like()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            for url in [f"/users/{self.u1_id}", "/messages/123",
+                        f"/users/{self.testuser_id}/likes"]:
+                resp = c.get(url)
+                soup = BeautifulSoup(str(resp.data), 'html.parser')
+                form = soup.find("form", {"action": "/messages/123/like"})
+                self.assertIn("btn-primary", form.button["class"], url)
+
+            # no like buttons on your own messages
+            resp = c.get(f"/users/{self.testuser_id}")
+            soup = BeautifulSoup(str(resp.data), 'html.parser')
+            self.assertEqual(soup.find_all("form", {"class": "like-form"}), [])
+
     def test_add_like(self):
         m = Message(id=1995, text="Snowing today", user_id=self.u1_id)
         db.session.add(m)
@@ -157,6 +255,44 @@ class UserViewTestCase(TestCase):
             self.assertEqual(likes[0].user_id, self.testuser_id)
 
 
+    def test_like_json(self):
+        m = Message(id=1995, text="Snowing today", user_id=self.u1_id)
+        db.session.add(m)
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            headers = {"Accept": "application/json"}
+            resp = c.post("/messages/1995/like", headers=headers)
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.json, {"message_id": 1995, "liked": True})
+
+            # setting the state explicitly is idempotent
+            resp = c.post("/messages/1995/like?liked=1", headers=headers)
+            self.assertEqual(resp.json["liked"], True)
+            self.assertEqual(Likes.query.filter_by(message_id=1995).count(), 1)
+            self.assertEqual(User.query.get(self.testuser_id).likes_count, 1)
+
+            resp = c.post("/messages/1995/like?liked=0", headers=headers)
+            resp = c.post("/messages/1995/like?liked=0", headers=headers)
+            self.assertEqual(resp.json["liked"], False)
+            self.assertEqual(Likes.query.filter_by(message_id=1995).count(), 0)
+            self.assertEqual(User.query.get(self.testuser_id).likes_count, 0)
+
+    def test_message_liked_by_many(self):
+        m = Message(id=1995, text="Snowing today", user_id=self.u1_id)
+        db.session.add(m)
+        db.session.commit()
+
+        # the same message can be liked by more than one user
+        db.session.add_all([Likes(user_id=self.testuser_id, message_id=1995),
+                            Likes(user_id=self.u2_id, message_id=1995)])
+        db.session.commit()
+
+        self.assertEqual(Likes.query.filter_by(message_id=1995).count(), 2)
+
     def test_remove_like(self):
         self.setup_like()
 
@@ -273,4 +409,123 @@ class UserViewTestCase(TestCase):
             self.assertNotIn("@testuser1", str(resp.data))
             self.assertIn("Access unauthorized", str(resp.data))
 
+    def test_follow_backfills_timeline(self):
+        m = Message(id=4242, text="Before you followed me", user_id=self.u1_id)
+        db.session.add(m)
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            c.post(f"/users/follow/{self.u1_id}")
+            resp = c.get("/")
+            self.assertIn("Before you followed me", str(resp.data))
+
+            c.post(f"/users/stop-following/{self.u1_id}")
+            resp = c.get("/")
+            self.assertNotIn("Before you followed me", str(resp.data))
+            self.assertEqual(
+                TimelineEntry.query.filter_by(user_id=self.testuser_id).count(), 0)
+
+    def test_user_show_pagination(self):
+        for day in range(1, 4):
+            db.session.add(Message(text=f"Warble from day {day}",
+                                   timestamp=datetime(2021, 1, day),
+                                   user_id=self.u1_id))
+        db.session.commit()
+
+        with self.client as c:
+            resp = c.get(f"/users/{self.u1_id}?limit=2")
+            self.assertIn("Warble from day 3", str(resp.data))
+            self.assertIn("Warble from day 2", str(resp.data))
+            self.assertNotIn("Warble from day 1", str(resp.data))
+
+            soup = BeautifulSoup(str(resp.data), 'html.parser')
+            older = soup.find("a", {"class": "load-more"})["href"]
+
+            # the page size carries over
+            resp = c.get(older)
+            self.assertIn("Warble from day 1", str(resp.data))
+            self.assertNotIn("Warble from day 2", str(resp.data))
+            soup = BeautifulSoup(str(resp.data), 'html.parser')
+            self.assertIsNone(soup.find("a", {"class": "load-more"}))
+
+            newer = soup.find("a", string="Newer")["href"]
+            self.assertIn("limit=2", newer)
+            resp = c.get(newer)
+            self.assertIn("Warble from day 3", str(resp.data))
+            self.assertIn("Warble from day 2", str(resp.data))
+
+            resp = c.get(f"/users/{self.u1_id}?before=not-a-cursor")
+            self.assertEqual(resp.status_code, 400)
+
+    def test_delete_user_updates_counters(self):
+        self.setup_like()
+        self.setup_followers()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            resp = c.post("/users/delete")
+            self.assertEqual(resp.status_code, 302)
+
+        self.assertIsNone(User.query.get(self.u1_id))
+
+        testuser = User.query.get(self.testuser_id)
+        # testuser followed u1, was followed by u1 and liked u1's message
+        self.assertEqual(testuser.following_count, 1)
+        self.assertEqual(testuser.followers_count, 0)
+        self.assertEqual(testuser.likes_count, 0)
 
+        purge = AccountPurge.query.get(self.u1_id)
+        self.assertIsNotNone(purge.finished_at)
+        # the like, two follows, the message and the user
+        self.assertEqual(purge.rows_deleted, 5)
+
+    def test_deleted_user_hidden_before_purge(self):
+        self.setup_like()
+        self.setup_followers()
+        app.config['JOBS_EAGER'] = False
+
+        try:
+            with self.client as c:
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = self.u1_id
+                c.post("/users/delete")
+
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = self.testuser_id
+
+                self.assertEqual(c.get(f"/users/{self.u1_id}").status_code, 404)
+                self.assertEqual(c.get("/messages/123").status_code, 404)
+                self.assertNotIn("testuser1", str(c.get("/users?q=testuser").data))
+                self.assertNotIn("I want Alex", str(c.get("/").data))
+                self.assertNotIn("testuser1",
+                                 str(c.get(f"/users/{self.testuser_id}/followers").data))
+        finally:
+            app.config['JOBS_EAGER'] = True
+
+        # the rows are still there for the purge
+        self.assertIsNotNone(User.query.get(self.u1_id).deleted_at)
+        self.assertIsNotNone(Message.query.get(123))
+
+    def test_purge_in_small_batches(self):
+        self.setup_like()
+        self.setup_followers()
+
+        AccountPurge.start(User.query.get(self.u1_id))
+        db.session.commit()
+
+        purge = AccountPurge.query.get(self.u1_id)
+        batches = 0
+        while purge.run_batch(limit=1):
+            db.session.commit()
+            batches += 1
+
+        db.session.commit()
+        self.assertEqual(batches, 5)
+        self.assertIsNone(User.query.get(self.u1_id))
+        self.assertEqual(Follows.query.count(), 1)
+        self.assertEqual(User.query.get(self.testuser_id).following_count, 1)
@@ -0,0 +1,199 @@
+"""Trending messages: the most liked lately, with older likes counting less.
+
+Counting each message's likes at read time means scanning `likes`.
+Instead every like adds +1 to a per-message counter for the current
+TRENDING_BUCKET_SECONDS-long time bucket, in the same flush that writes
+the like, and an unlike adds -1 to the bucket the like was counted in
+(from the like's timestamp) if that's still in the window. The buckets in
+the last TRENDING_WINDOW_SECONDS are what's ranked; older ones are deleted
+by the job workers (`flask jobs work`) every TRENDING_PRUNE_SECONDS, so
+the table holds about one window.
+
+The ranking is a sum over a message's buckets of likes * 0.5 ** (age /
+TRENDING_HALF_LIFE_SECONDS). It's computed in the database, and only the
+top TRENDING_SIZE (message id, score) pairs are kept in memory; each
+process computes them in a background thread on first use (nothing's
+trending until then) and every TRENDING_RELOAD_SECONDS after (see
+cache.Snapshot), so /trending never ranks at request time.
+
+The buckets are in a table rather than in memory so that every process
+and worker counts every like, whichever process served it.
+"""
+
+import time
+from datetime import timezone
+
+from sqlalchemy import event
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import contains_eager
+
+from cache import Snapshot
+from jobs import every, job
+from models import db, Likes, Message, User
+
+
+class TrendingBucket(db.Model):
+    """Net likes a message got in one time bucket."""
+
+    __tablename__ = 'trending_buckets'
+
+    message_id = db.Column(
+        db.Integer,
+        db.ForeignKey('messages.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    # seconds since the epoch // TRENDING_BUCKET_SECONDS; indexed for
+    # reading the window and deleting what's slid out of it
+    bucket = db.Column(db.Integer, primary_key=True, index=True)
+
+    likes = db.Column(db.Integer, nullable=False, default=0)
+
+
+class Window:
+    """The sliding window's shape; `init_trending` sets it from the config."""
+
+    def __init__(self, bucket_seconds=300, length_seconds=24 * 3600,
+                 half_life_seconds=6 * 3600, size=50):
+        self.bucket_seconds = bucket_seconds
+        self.length_seconds = length_seconds
+        self.half_life_seconds = half_life_seconds
+        self.size = size
+
+    def bucket(self, now=None):
+        """The bucket `now` (default: the current time) falls in."""
+
+        now = time.time() if now is None else now
+        return int(now // self.bucket_seconds)
+
+    def oldest(self, now=None):
+        """The newest bucket that's out of the window."""
+
+        return self.bucket(now) - self.length_seconds // self.bucket_seconds
+
+
+window = Window()
+
+
+def _like_bucket(like):
+    """The bucket `like` is counted in (by its timestamp), or None."""
+
+    if like.timestamp is None:
+        return None
+    return window.bucket(like.timestamp.replace(tzinfo=timezone.utc).timestamp())
+
+
+def _count_like(connection, message_id, bucket, delta):
+    buckets = TrendingBucket.__table__
+
+    if connection.dialect.name == 'postgresql':
+        connection.execute(
+            insert(buckets)
+            .values(message_id=message_id, bucket=bucket, likes=delta)
+            .on_conflict_do_update(
+                index_elements=[buckets.c.message_id, buckets.c.bucket],
+                set_={'likes': buckets.c.likes + delta}))
+        return
+
+    # no upsert here (SQLite, in SQLAlchemy 1.3): update, else insert
+    updated = connection.execute(
+        buckets.update()
+        .where(db.and_(buckets.c.message_id == message_id,
+                       buckets.c.bucket == bucket))
+        .values(likes=buckets.c.likes + delta))
+    if not updated.rowcount:
+        connection.execute(buckets.insert().values(
+            message_id=message_id, bucket=bucket, likes=delta))
+
+
+@event.listens_for(Likes, 'after_insert')
+def _count_new_like(mapper, connection, like):
+    bucket = _like_bucket(like)
+    _count_like(connection, like.message_id,
+                window.bucket() if bucket is None else bucket, 1)
+
+
+@event.listens_for(Likes, 'after_delete')
+def _count_deleted_like(mapper, connection, like):
+    # take it off the bucket it was counted in; a like that's slid out of
+    # the window (or predates timestamps) isn't counted in any
+    bucket = _like_bucket(like)
+    if bucket is not None and bucket > window.oldest():
+        _count_like(connection, like.message_id, bucket, -1)
+
+
+def rank(now=None):
+    """The top `window.size` (message id, score) pairs, best first."""
+
+    buckets = TrendingBucket.__table__
+    newest, oldest = window.bucket(now), window.oldest(now)
+    half_lives = window.bucket_seconds / window.half_life_seconds
+
+    # as doubles: Postgres takes bare 0.5 for a numeric, and numeric power()
+    # is some 50 times slower
+    age = (newest - buckets.c.bucket) * db.cast(half_lives, db.Float)
+    score = db.func.sum(
+        buckets.c.likes * db.func.power(db.cast(0.5, db.Float), age)
+    ).label('score')
+    rows = db.session.execute(
+        db.select([buckets.c.message_id, score])
+        .where(buckets.c.bucket > oldest)
+        .group_by(buckets.c.message_id)
+        .having(score > 0)
+        .order_by(score.desc(), buckets.c.message_id.desc())
+        .limit(window.size))
+
+    return tuple((message_id, float(score)) for message_id, score in rows)
+
+
+def prune(now=None):
+    """Delete the buckets that have slid out of the window.
+
+    Run by workers every TRENDING_PRUNE_SECONDS (see `prune_trending`).
+    """
+
+    with db.engine.begin() as conn:
+        return conn.execute(
+            TrendingBucket.__table__.delete()
+            .where(TrendingBucket.bucket <= window.oldest(now))).rowcount
+
+
+@job
+def prune_trending():
+    """Delete expired like buckets, so the table holds one window's worth."""
+
+    prune()
+
+
+trending = Snapshot(rank, empty=())
+
+
+def trending_messages():
+    """The trending messages, with their authors loaded, best first."""
+
+    ranking = trending.get()
+    if not ranking:
+        return []
+
+    position = {message_id: i for i, (message_id, _) in enumerate(ranking)}
+    messages = (Message.query
+                .join(User, Message.user_id == User.id)
+                .options(contains_eager(Message.user))
+                .filter(Message.id.in_(position), User.deleted_at.is_(None))
+                .all())
+    messages.sort(key=lambda msg: position[msg.id])
+    return messages
+
+
+def init_trending(app):
+    """Shape the window and schedule the ranking from the app's config."""
+
+    window.bucket_seconds = app.config.setdefault('TRENDING_BUCKET_SECONDS', 300)
+    window.length_seconds = app.config.setdefault(
+        'TRENDING_WINDOW_SECONDS', 24 * 3600)
+    window.half_life_seconds = app.config.setdefault(
+        'TRENDING_HALF_LIFE_SECONDS', 6 * 3600)
+    window.size = app.config.setdefault('TRENDING_SIZE', 50)
+    trending.reload_after = app.config.setdefault('TRENDING_RELOAD_SECONDS', 60)
+    every('prune_trending',
+          app.config.setdefault('TRENDING_PRUNE_SECONDS', 300))